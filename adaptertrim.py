@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import os,sys
+import string
+from collections import deque
+from ctypes import *
+import util
+
+#adapter trimming by an Aho-Corasick automaton of all adapters, so a read is scanned once whatever the count of adapters is
+#a read is trimmed at the first adapter in it, or at a partial adapter at its 3' end:
+#the longest suffix of the read which is a prefix of an adapter, if it has at least adapter_min_partial bases
+#the adapters are matched exactly, a base of a read matches the same base of an adapter in upper or lower case
+#the automaton is built as a DFA over the bases used by the adapters, other bases like N never match
+#the scan is done by adapter_scan of editdistance/libed.so if it is built by make, otherwise in python
+
+#the built-in adapter sets of Illumina
+ADAPTER_SETS = {
+    "truseq" : [("TruSeq_Read1", "AGATCGGAAGAGCACACGTCTGAACTCCAGTCA"), ("TruSeq_Read2", "AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT")],
+    "nextera" : [("Nextera", "CTGTCTCTTATACACATCT")],
+    "smallrna" : [("SmallRNA_3p", "TGGAATTCTCGGGTGCCAAGG")],
+}
+
+ALL_CHARS = "".join([chr(i) for i in xrange(256)])
+
+#the adapters of adapter_trim (none, all, or a comma separated list of ADAPTER_SETS) and adapter_fasta, as a list of (name, sequence)
+#raises ValueError if they are invalid
+def loadAdapters(adapterTrim, adapterFasta):
+    adapters = []
+    names = []
+    if adapterTrim == "all":
+        names = sorted(ADAPTER_SETS.keys())
+    elif adapterTrim != "none":
+        names = adapterTrim.split(",")
+    for name in names:
+        if name not in ADAPTER_SETS:
+            raise ValueError("adapter_trim should be none, all, or a comma separated list of " + ", ".join(sorted(ADAPTER_SETS.keys())) + ", got " + adapterTrim)
+        adapters += ADAPTER_SETS[name]
+    if adapterFasta != None:
+        adapters += readFasta(adapterFasta)
+    return adapters
+
+def readFasta(filename):
+    if not os.path.exists(filename):
+        raise ValueError("adapter_fasta " + filename + " doesn't exist")
+    adapters = []
+    name = None
+    seq = []
+    for line in open(filename):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        if line.startswith(">"):
+            if name != None:
+                adapters.append((name, "".join(seq)))
+            name = line[1:].split()[0] if len(line) > 1 else str(len(adapters) + 1)
+            seq = []
+        elif name == None:
+            raise ValueError("adapter_fasta " + filename + " should be a FASTA file starting with >name")
+        else:
+            seq.append(line.upper())
+    if name != None:
+        adapters.append((name, "".join(seq)))
+    for name, seq in adapters:
+        if len(seq) == 0:
+            raise ValueError("adapter " + name + " in " + filename + " is empty")
+    return adapters
+
+class AdapterTrimmer:
+
+    #adapters is a list of (name, sequence)
+    def __init__(self, adapters, minPartial):
+        self.names = [name for name, seq in adapters]
+        self.minPartial = minPartial
+        self.maxLen = max([len(seq) for name, seq in adapters])
+        #class 0 is for the bases not in any adapter
+        bases = sorted(set("".join([seq.upper() for name, seq in adapters])))
+        classOf = {}
+        for i in xrange(len(bases)):
+            classOf[bases[i]] = i + 1
+        self.classes = len(bases) + 1
+        self.classTable = string.maketrans(ALL_CHARS, "".join([chr(classOf.get(c.upper(), 0)) for c in ALL_CHARS]))
+        self.build(adapters, classOf)
+        self.native = None
+        if util.ADAPTER_CTYPES_LOADED:
+            self.native = self.makeNative()
+
+    #the trie of the adapters, and then the DFA by the failure links in breadth first order
+    #for each state: match is the length of the longest adapter ending at it, matchAdapter is that adapter,
+    #depth is the length of the prefix it stands for, and owner is the first adapter with that prefix
+    def build(self, adapters, classOf):
+        goto = [{}]
+        self.depth = [0]
+        self.owner = [-1]
+        self.match = [0]
+        self.matchAdapter = [-1]
+        for adapter in xrange(len(adapters)):
+            seq = adapters[adapter][1].upper()
+            state = 0
+            for base in seq:
+                k = classOf[base]
+                if k not in goto[state]:
+                    goto.append({})
+                    self.depth.append(self.depth[state] + 1)
+                    self.owner.append(adapter)
+                    self.match.append(0)
+                    self.matchAdapter.append(-1)
+                    goto[state][k] = len(goto) - 1
+                state = goto[state][k]
+            if self.match[state] == 0:
+                self.match[state] = len(seq)
+                self.matchAdapter[state] = adapter
+        states = len(goto)
+        self.delta = [[0] * self.classes for s in xrange(states)]
+        fail = [0] * states
+        queue = deque()
+        for k in xrange(1, self.classes):
+            if k in goto[0]:
+                self.delta[0][k] = goto[0][k]
+                queue.append(goto[0][k])
+        while len(queue) > 0:
+            state = queue.popleft()
+            #an adapter ending at the failure state also ends here, the failure state is shorter so it is done
+            if self.match[state] == 0 and self.match[fail[state]] > 0:
+                self.match[state] = self.match[fail[state]]
+                self.matchAdapter[state] = self.matchAdapter[fail[state]]
+            for k in xrange(1, self.classes):
+                if k in goto[state]:
+                    child = goto[state][k]
+                    fail[child] = self.delta[fail[state]][k]
+                    self.delta[state][k] = child
+                    queue.append(child)
+                else:
+                    self.delta[state][k] = self.delta[fail[state]][k]
+
+    #the ctypes arrays of adapter_scan
+    def makeNative(self):
+        states = len(self.delta)
+        delta = (c_int * (states * self.classes))()
+        info = (c_int * (states * 4))()
+        for s in xrange(states):
+            for k in xrange(self.classes):
+                delta[s * self.classes + k] = self.delta[s][k]
+            info[s * 4] = self.match[s]
+            info[s * 4 + 1] = self.matchAdapter[s]
+            info[s * 4 + 2] = self.depth[s]
+            info[s * 4 + 3] = self.owner[s]
+        classTable = create_string_buffer(self.classTable, 256)
+        return (delta, classTable, info)
+
+    #returns (position, adapter, partial), the read should be trimmed to position
+    #position is len(seq) and adapter is -1 if there is no adapter, partial is True for a partial adapter at the 3' end
+    def scan(self, seq):
+        if self.native != None:
+            return self.scanNative(seq)
+        return self.scanPython(seq)
+
+    def scanNative(self, seq):
+        delta, classTable, info = self.native
+        result = (c_int * 3)()
+        util.ed_ctypes.adapter_scan(delta, self.classes, classTable, info, self.maxLen, self.minPartial, seq, len(seq), result)
+        return (result[0], result[1], result[2] == 1)
+
+    def scanPython(self, seq):
+        length = len(seq)
+        classes = bytearray(seq.translate(self.classTable))
+        delta = self.delta
+        match = self.match
+        state = 0
+        best = length
+        bestAdapter = -1
+        for i in xrange(length):
+            state = delta[state][classes[i]]
+            if match[state] > 0 and i - match[state] + 1 < best:
+                best = i - match[state] + 1
+                bestAdapter = self.matchAdapter[state]
+            #no adapter ending later can start before best
+            if i - self.maxLen + 1 >= best:
+                return (best, bestAdapter, False)
+        depth = self.depth[state]
+        if depth >= self.minPartial and length - depth < best:
+            return (length - depth, self.owner[state], True)
+        return (best, bestAdapter, False)
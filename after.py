@@ -4,8 +4,16 @@ import os,sys
 from optparse import OptionParser
 import time
 import fastq
+import badsink
+import goodshards
+import filterstages
+import adaptertrim
+import util
+import progress
+import scheduler
+import json
 import preprocesser
-from multiprocessing import Process, Queue
+import multiprocessing
 import copy
 from util import *
 
@@ -74,9 +82,49 @@ def parseCommand():
     parser.add_option("", "--qc_only", dest = "qc_only", action='store_true', default = False,
         help = "if qconly is true, only QC result will be output, this can be much fast")
     parser.add_option("", "--qc_sample", dest = "qc_sample", default = 200000, type = "int",
-        help = "sample up to qc_sample reads when do QC, 0 means sample all reads. Default is 200,000")
+        help = "sample up to qc_sample reads when do QC, 0 means sample all reads. The sampled reads are buffered and then filtered, so each file is read only once unless qc_sample is 0. qc_sample 0 cannot be used with stdin or an interleaved read1_file, which are read only once. Default is 200,000")
     parser.add_option("", "--qc_kmer", dest = "qc_kmer", default = 8, type = "int",
         help = "specify the kmer length for KMER statistics for QC, default is 8")
+    parser.add_option("", "--decompressor", dest = "decompressor", default = "auto",
+        help = "specify how to decompress .gz files: auto, pigz, igzip, gzip or python. auto uses the first one of pigz/igzip/gzip found in PATH, python uses the in-process gzip module. Default is auto")
+    parser.add_option("", "--compression_level", dest = "compression_level", default = 0, type = "int",
+        help = "gzip compression level (1~9) of the good/bad/overlap output files, which will be named *.fq.gz. Default 0 means no compression")
+    parser.add_option("", "--compression_threads", dest = "compression_threads", default = 2, type = "int",
+        help = "number of threads to compress the output files when compression_level > 0. Default is 2")
+    parser.add_option("", "--mmap", dest = "mmap", default = "off",
+        help = "specify whether map uncompressed input files into memory instead of reading them, which makes less copy and keeps a small memory footprint for large files. Default is off")
+    parser.add_option("", "--pair_name_check", dest = "pair_name_check", default = "on",
+        help = "specify whether check the read names (up to the first space) of read1/read2/index1/index2 are identical, the program stops at the first mismatch. Default is on")
+    parser.add_option("", "--compact_reads", dest = "compact_reads", default = "off",
+        help = "specify whether keep the reads of each input block in one buffer with line offsets, instead of a list of strings for each read. Trimming only moves the offsets. Default is off")
+    parser.add_option("", "--interleaved", dest = "interleaved", default = "off",
+        help = "specify whether read1_file is interleaved, which means read1 and read2 of a pair are two successive records. The good/bad outputs are interleaved too. Default is off")
+    parser.add_option("", "--good_output_file", dest = "good_output_file", default = None,
+        help = "write the good reads to this file instead of good_output_folder, read1 and read2 are interleaved. - means stdout, and it can be a named pipe. Only for a single file/pair")
+    parser.add_option("", "--bad_sink", dest = "bad_sink", default = "full",
+        help = "specify how to store the bad reads: full, gzip, sample:N or none. gzip writes *.bad.fq.gz, sample:N keeps N random reads for each reason, none writes no bad reads. The count of each reason is always in after.json. Default is full")
+    parser.add_option("", "--good_shards", dest = "good_shards", default = "none",
+        help = "write the good reads into shard files *.good.shardNNNN.fq: roundrobin:N writes to N shards in turn, count:M starts a new shard every M reads/pairs. The shards of read1/read2/index are synchronized, and listed with their read counts in *.good.shards.json. Default is none")
+    parser.add_option("", "--filter_processes", dest = "filter_processes", default = 1, type = "int",
+        help = "number of processes to filter a file/pair, the reads are split into chunks and filtered in parallel. Default 1 means no parallel filtering")
+    parser.add_option("", "--filter_order", dest = "filter_order", default = "ordered",
+        help = "specify the order of output reads when filter_processes > 1: ordered keeps the input order, unordered writes the chunks as soon as they are finished, which is faster. The stats are same in both modes. Default is ordered")
+    parser.add_option("", "--stage_order", dest = "stage_order", default = "precedence",
+        help = "specify the order of the bubble, length, polyX, low quality and N filters: precedence always runs them in this order, adaptive runs the filters with lower cost and higher rejection rate first, a read failing several filters may be counted for another reason. adaptive starts again from the precedence order every 5000 reads, so the reasons don't depend on filter_processes. The rejection rate of each filter is in after.json. Default is precedence")
+    parser.add_option("", "--overlap_engine", dest = "overlap_engine", default = "exhaustive",
+        help = "specify how to find the overlap of read1 and read2: exhaustive checks the offsets from 0 and skips the offsets far from matching, seeded only checks the offsets near the 8-base k-mers shared by read1 and read2, and uses exhaustive if a read has N or the k-mers are shared at too many offsets. seeded finds the first matching offset even if exhaustive skips it, it is faster for long reads and long inserts if editdistance library is built by make. Default is exhaustive")
+    parser.add_option("", "--adapter_trim", dest = "adapter_trim", default = "none",
+        help = "specify the built-in adapters to trim: none, all, or a comma separated list of truseq, nextera and smallrna. A read is trimmed at the first adapter in it, or at a partial adapter at its 3' end, before the length filter. All adapters are found in one scan of the read. The trimmed reads and bases are in after.json. Default is none")
+    parser.add_option("", "--adapter_fasta", dest = "adapter_fasta", default = None,
+        help = "a FASTA file of the adapters to trim, with the adapters of adapter_trim")
+    parser.add_option("", "--adapter_min_partial", dest = "adapter_min_partial", default = 5, type = "int",
+        help = "the minimum bases of a partial adapter at the 3' end of a read to trim it. Default is 5")
+    parser.add_option("", "--progress_interval", dest = "progress_interval", default = 10, type = "int",
+        help = "print the progress (reads, reads/s, MB/s of input, percent and ETA) every progress_interval seconds, and write it to status.json in the QC folder. With input_dir, one line is printed for all files. 0 means no progress. Default is 10")
+    parser.add_option("", "--jobs", dest = "jobs", default = multiprocessing.cpu_count(), type = "int",
+        help = "with input_dir, the maximum number of files/pairs filtered at the same time, the largest files are started first. When a file/pair is writing its QC and report, one more file/pair can be started, so at most jobs + 1 files/pairs are in process. Default is the number of CPUs")
+    parser.add_option("", "--memory_budget", dest = "memory_budget", default = 0, type = "int",
+        help = "with input_dir, the memory in MB for all files/pairs filtered at the same time, each file/pair is estimated to use 300MB for each filter process. 0 means no limit. Default is 0")
     return parser.parse_args()
 
 def matchFlag(filename, flag):
@@ -105,7 +153,7 @@ def processDir(folder, options):
     
     #is not a dir
     if not os.path.isdir(folder):
-        return
+        return 0
         
     options_list = []
     
@@ -150,17 +198,53 @@ def processDir(folder, options):
     if len(options_list) == 0:
         print("no read files to run with, do you call the program correctly?")
         print("see -h for help")
-        return
+        return 0
         
-    #create a job for each options
-    jobs = [Process(target = processOptions, args = (o, )) for o in options_list]
-    for job in jobs: job.start()
-    #wait for them to complete
-    for job in jobs: job.join()
+    #create a job for each options, the size is the size of all its input files
+    jobs = []
+    sizes = {}
+    for o in options_list:
+        files = [o.read1_file, o.read2_file, o.index1_file, o.index2_file]
+        size = sum([os.path.getsize(f) for f in files if f != None])
+        sizes[o.read1_file] = size
+        jobs.append(scheduler.Job(o.read1_file, size, scheduler.estimateMemory(o), processOptions, (o, )))
+
+    #run the jobs and print the progress of all jobs until they complete
+    aggregator = progress.ProgressAggregator(sizes, os.path.join(qc_base_folder, progress.STATUS_FILE), options.progress_interval)
+    jobs = scheduler.JobScheduler(jobs, options.jobs, options.memory_budget, aggregator).run()
+    return reportJobs(jobs, os.path.join(qc_base_folder, "jobs.json"))
+
+#print the result of each job and write them to a json file, returns the count of failed jobs
+def reportJobs(jobs, filename):
+    results = []
+    failed = 0
+    for job in jobs:
+        result = {}
+        result['file'] = job.name
+        result['exit_code'] = job.exitCode
+        result['seconds'] = round(job.seconds, 1)
+        result['summary'] = job.summary
+        results.append(result)
+        if job.exitCode != 0:
+            failed += 1
+            print(job.name + ": failed with exit code " + str(job.exitCode))
+        elif job.summary != None:
+            print(job.name + ": " + str(job.summary['good_reads']) + "/" + str(job.summary['total_reads']) + " good reads in " + "%.1f" % job.seconds + " s")
+    f = open(filename, "w")
+    f.write(json.dumps(results, sort_keys=True,indent=4, separators=(',', ': ')))
+    f.close()
+    return failed
     
-def processOptions(options):
-    filter = preprocesser.seqFilter(options)
-    filter.run()
+#the progress and the summary are sent to progressQueue in processDir mode
+def processOptions(options, progressQueue = None):
+    filter = preprocesser.seqFilter(options, progressQueue)
+    try:
+        stat = filter.run()
+    except fastq.PairingError as e:
+        print("Error: " + str(e))
+        sys.exit(1)
+    if progressQueue != None:
+        progressQueue.put({'file': options.read1_file, 'state': "finished", 'summary': stat["summary"]})
     
 def runDebubble(options):
     #lazy import debubble here because debubble uses PIL, which is not supported by pypy
@@ -181,6 +265,13 @@ def main():
     options.trim_pair_same = parseBool(options.trim_pair_same)
     options.draw = parseBool(options.draw)
     options.store_overlap = parseBool(options.store_overlap)
+    options.mmap = parseBool(options.mmap)
+    options.pair_name_check = parseBool(options.pair_name_check)
+    options.compact_reads = parseBool(options.compact_reads)
+    options.interleaved = parseBool(options.interleaved)
+    #the reads are written to stdout, so the logs go to stderr
+    if options.good_output_file == fastq.STDIO:
+        fastq.redirectStdout()
     options.trim_front2 = options.trim_front
     options.trim_tail2 = options.trim_tail
     
@@ -188,10 +279,56 @@ def main():
         print('specify current dir as input dir')
         options.input_dir="."
     
+    try:
+        badsink.parsePolicy(options.bad_sink)
+        goodshards.parsePolicy(options.good_shards)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+    if options.filter_order not in ("ordered", "unordered"):
+        print('filter_order should be ordered or unordered')
+        sys.exit(1)
+    if options.jobs < 1:
+        print('jobs should be at least 1')
+        sys.exit(1)
+    if options.compression_level < 0 or options.compression_level > 9:
+        print('compression_level should be 1~9, or 0 for no compression')
+        sys.exit(1)
+    if options.stage_order not in filterstages.STAGE_ORDERS:
+        print('stage_order should be precedence or adaptive')
+        sys.exit(1)
+    try:
+        adaptertrim.loadAdapters(options.adapter_trim, options.adapter_fasta)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+    if options.adapter_min_partial < 1:
+        print('adapter_min_partial should be at least 1')
+        sys.exit(1)
+    if options.overlap_engine not in util.OVERLAP_ENGINES:
+        print('overlap_engine should be exhaustive or seeded')
+        sys.exit(1)
+    if options.good_shards != "none" and options.good_output_file != None:
+        print('good_shards cannot be used with good_output_file')
+        sys.exit(1)
+    if options.interleaved and options.read2_file != None:
+        print('read2_file cannot be specified with an interleaved read1_file')
+        sys.exit(1)
+    #a stream is read only once, sampling all reads would buffer the whole stream in memory
+    if options.qc_sample <= 0 and (options.interleaved or options.read1_file == fastq.STDIO):
+        print('qc_sample should be more than 0 for stdin or an interleaved read1_file')
+        sys.exit(1)
+    if options.good_output_file != None and options.input_dir != None:
+        print('good_output_file can only be used with a single file/pair, specify read1_file instead of input_dir')
+        sys.exit(1)
+    
     if options.input_dir != None:
         if options.debubble:
             runDebubble(options)
-        processDir(options.input_dir, options)
+        failed = processDir(options.input_dir, options)
+        if failed > 0:
+            print(str(failed) + " files failed")
+            sys.exit(1)
     else:
         if options.barcode_flag in options.read1_file and parseBool(options.barcode):
             options.barcode = True
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os,sys
+import heapq
+
+#the policies of storing bad reads
+#full: write all bad reads, gzip: write all bad reads to .gz files
+#sample:N: keep N random reads for each reason, none: only count the bad reads
+SINK_POLICIES = ("full", "gzip", "sample", "none")
+
+#the flags of bad reads, which are prepended to the read names
+BAD_REASONS = ("BADBCD1", "BADBCD2", "BADTRIM1", "BADTRIM2", "BADBBL", "BADLEN", "BADPOL", "BADLQC", "BADNCT", "BADOL", "BADINDEL", "BADMISMATCH")
+
+#the compression level of gzip policy if compression_level is not specified
+#bad reads are seldom read, so the fastest level is used
+GZIP_LEVEL = 1
+
+#returns (policy, sample size), raises ValueError for an invalid policy
+def parsePolicy(policy):
+    name = policy
+    size = 0
+    if policy.startswith("sample:"):
+        name = "sample"
+        try:
+            size = int(policy[len("sample:"):])
+        except ValueError:
+            size = 0
+        if size <= 0:
+            raise ValueError("the sample size of bad_sink should be a positive number, like sample:1000")
+    if name not in SINK_POLICIES or policy == "sample":
+        raise ValueError("bad_sink should be full, gzip, sample:N or none, got " + policy)
+    return (name, size)
+
+#a fixed seed, so the samples are reproducible
+SAMPLE_SEED = 0x2545F4914F6CDD1D
+MASK64 = (1 << 64) - 1
+
+#a pseudo random 64 bit key of a record number, by the finalizer of splitmix64
+def sampleKey(record):
+    x = (record * 0x9E3779B97F4A7C15 + SAMPLE_SEED) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+class BadReadSink:
+
+    #writers are the bad writers of read1, read2, index1 and index2, None if absent
+    #writeReads(r1, r2, i1, i2, r1_file, r2_file, i1_file, i2_file, flag) writes a record
+    def __init__(self, policy, writers, writeReads):
+        self.policy, self.sampleSize = parsePolicy(policy)
+        self.writers = writers
+        self.writeReads = writeReads
+        #exact count of each reason, whatever the policy is
+        self.counts = {}
+        for reason in BAD_REASONS:
+            self.counts[reason] = 0
+        self.stored = 0
+        #reason -> heap of (-key, record number, (r1, r2, i1, i2)), the sampled records with the smallest keys
+        self.samples = {}
+
+    #record is the number of the record in the input starting from 1
+    def write(self, r1, r2, i1, i2, flag, record):
+        self.counts[flag] = self.counts.get(flag, 0) + 1
+        if self.policy == "none":
+            return
+        if self.policy != "sample":
+            self.writeReads(r1, r2, i1, i2, self.writers[0], self.writers[1], self.writers[2], self.writers[3], flag)
+            if self.writers[0] != None:
+                self.stored += 1
+            return
+        #keep the records with the smallest keys of each reason, the key only depends on the record number,
+        #so the same records are kept whatever order the chunks of parallel filtering are written in
+        key = sampleKey(record)
+        sample = self.samples.setdefault(flag, [])
+        if len(sample) < self.sampleSize:
+            heapq.heappush(sample, (-key, record, self.copy(r1, r2, i1, i2)))
+        elif key < -sample[0][0]:
+            heapq.heapreplace(sample, (-key, record, self.copy(r1, r2, i1, i2)))
+
+    #the reads are changed by later stages or reused by the reader, so the kept ones are copied
+    def copy(self, r1, r2, i1, i2):
+        return tuple([list(r) if r != None else None for r in (r1, r2, i1, i2)])
+
+    #write the sampled reads in the order of input, this should be called before the writers are closed
+    def finish(self):
+        if self.policy != "sample":
+            return
+        kept = []
+        for flag, sample in self.samples.items():
+            for (key, record, reads) in sample:
+                kept.append((record, flag, reads))
+        kept.sort()
+        if self.writers[0] == None:
+            kept = []
+        for (record, flag, (r1, r2, i1, i2)) in kept:
+            self.writeReads(r1, r2, i1, i2, self.writers[0], self.writers[1], self.writers[2], self.writers[3], flag)
+        self.stored = len(kept)
+        self.samples = {}
+
+    def summary(self):
+        result = {}
+        result['sink'] = self.policy
+        if self.policy == "sample":
+            result['sink'] = "sample:" + str(self.sampleSize)
+        result['reads_by_reason'] = self.counts
+        result['stored_reads'] = self.stored
+        return result
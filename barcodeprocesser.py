@@ -4,6 +4,7 @@ import os,sys
 from optparse import OptionParser
 import time
 import util
+import seqkernel
 
 #how many chars are different of these two strings with same length
 def diffNumber(str1, str2):
@@ -45,8 +46,8 @@ def moveBarcodeToName(read, barcodeLen, verify):
     return barcode
 
 def cleanBarcodeTail(read1, read2, readStart1, readStart2):
-    reverse1 = util.reverseComplement(readStart1)
-    reverse2 = util.reverseComplement(readStart2)
+    reverse1 = seqkernel.reverseComplement(readStart1)
+    reverse2 = seqkernel.reverseComplement(readStart2)
     barcodeStringLen = min(len(readStart1), len(readStart2))
     r1len  = len(read1[1])
     r2len  = len(read2[1])
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os,sys
+
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+#batch versions of the per-read filters of preprocesser, with numpy
+#the sequences or qualities of thousands of reads are packed into a padded 2D uint8 matrix
+#and the counts of all reads are computed by a few vectorized operations
+#the results are same as lowQualityNum, nNumber and len of each read
+
+#quality lines are padded with the largest value, so the padding is never low quality
+QUAL_PAD = 255
+SEQ_PAD = 0
+
+#pack the strings into a (count, max length) uint8 matrix, returns (matrix, lengths)
+def toMatrix(lines, pad):
+    lengths = numpy.array([len(line) for line in lines], dtype=numpy.int64)
+    width = 0
+    if len(lines) > 0:
+        width = int(lengths.max())
+    matrix = numpy.full((len(lines), width), pad, dtype=numpy.uint8)
+    #the cells of each row before its length are filled with the concatenated strings in order
+    mask = numpy.arange(width) < lengths[:, None]
+    matrix[mask] = numpy.frombuffer("".join(lines), dtype=numpy.uint8)
+    return (matrix, lengths)
+
+#same as lowQualityNum for each row of a quality matrix
+def lowQualityNums(qualMatrix, qual):
+    return (qualMatrix < qual + 33).sum(axis=1)
+
+#same as nNumber for each row of a sequence matrix
+def nNumbers(seqMatrix):
+    return (seqMatrix == ord('N')).sum(axis=1)
+
+#the low quality counts, N counts and sequence lengths of reads, as lists of int
+#returns None for the counts which are not needed, the lengths are always returned
+def readCounts(reads, qual, needLowQual, needN):
+    lowQual = None
+    nNum = None
+    if needLowQual:
+        qualMatrix, qualLengths = toMatrix([r[3] for r in reads], QUAL_PAD)
+        lowQual = lowQualityNums(qualMatrix, qual).tolist()
+    if needN:
+        seqMatrix, lengths = toMatrix([r[1] for r in reads], SEQ_PAD)
+        nNum = nNumbers(seqMatrix).tolist()
+        lengths = lengths.tolist()
+    else:
+        lengths = [len(r[1]) for r in reads]
+    return (lowQual, nNum, lengths)
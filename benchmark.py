@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+import os,sys
+from optparse import OptionParser
+import time
+import shutil
+import tempfile
+import random
+import fastq
+import batchkernels
+import preprocesser
+import util
+import seqkernel
+import adaptertrim
+
+def parseCommand():
+    usage = "usage: %prog <benchmark> <input_files> [options]\n\nbenchmarks:\n  reader    compare the throughput of fastq.Reader, fastq.BlockReader (with and without compact reads) and fastq.MmapReader\n  writer    compare writing the reads of a file/pair line by line, by fastq.Writer.writeLines and by fastq.Writer.writeBatch\n  kernels   compare the per-read low quality, N and length counting of preprocesser with batchkernels (needs numpy)\n  polyx     compare preprocesser.hasPolyX with the exact scan only, on random reads of several lengths, input files are optional\n  overlap   compare the exhaustive and k-mer seeded overlap of util, in python and native, on random short and long insert pairs and on pairs of input files (R1 R2 ...), input files are optional\n  seqkernel compare the per-character reverse complement, hamming distance and mismatch positions with seqkernel, on random reads and the reads of input files, input files are optional\n  adapters  compare finding each adapter separately with the one scan of adaptertrim, in python and native, for 1 to 500 adapters on random reads and the reads of input files, input files are optional"
+    version = "%prog 1.0"
+    parser = OptionParser(usage = usage, version = version)
+    parser.add_option("-r", "--repeat", dest = "repeat", default = 1, type = "int",
+        help = "how many times to repeat each benchmark, the best result is reported. Default is 1")
+    parser.add_option("-d", "--decompressor", dest = "decompressor", default = "auto",
+        help = "specify how to decompress .gz files: auto, pigz, igzip, gzip or python. Default is auto")
+    return parser.parse_args()
+
+def report(name, reads, bytes, seconds):
+    seconds = max(seconds, 1e-6)
+    print(name + ": " + str(reads) + " reads in " + "%.3f" % seconds + " s, " + "%.0f" % (reads/seconds) + " reads/s, " + "%.2f" % (bytes/seconds/1024.0/1024.0) + " MB/s")
+
+def readAll(reader):
+    reads = 0
+    bytes = 0
+    checksum = 0
+    while True:
+        read = reader.nextRead()
+        if read == None:
+            break
+        reads += 1
+        bytes += len(read[0]) + len(read[1]) + len(read[2]) + len(read[3]) + 4
+        checksum = (checksum + hash(read[1]) + hash(read[3])) & 0xFFFFFFFF
+    return reads, bytes, checksum
+
+def benchReader(files, options):
+    for f in files:
+        print(f)
+        readers = [("line reader", lambda: fastq.Reader(f, decompressor = options.decompressor)),
+            ("block reader", lambda: fastq.BlockReader(f, decompressor = options.decompressor)),
+            ("compact block reader", lambda: fastq.BlockReader(f, decompressor = options.decompressor, compact = True))]
+        if not f.endswith(".gz"):
+            readers.append(("mmap reader", lambda: fastq.MmapReader(f)))
+        checksums = []
+        for name, openReader in readers:
+            best = None
+            for i in xrange(options.repeat):
+                time1 = time.time()
+                reads, bytes, checksum = readAll(openReader())
+                time2 = time.time()
+                if best == None or time2 - time1 < best:
+                    best = time2 - time1
+            checksums.append(checksum)
+            report(name, reads, bytes, best)
+        if len(set(checksums)) != 1:
+            print("WARNING: readers returned different reads for " + f)
+
+#the count of write syscalls of this process, only available on linux
+def writeSyscalls():
+    try:
+        for line in open("/proc/self/io"):
+            if line.startswith("syscw:"):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def loadReads(filename, options):
+    reader = fastq.BlockReader(filename, decompressor = options.decompressor)
+    reads = []
+    while True:
+        batch = reader.nextBatch()
+        if batch == None:
+            break
+        reads += batch
+    return reads
+
+#write each line by a file.write call, this is how fastq.Writer worked without write coalescing
+def writeLineByLine(inputs, folder):
+    files = [open(os.path.join(folder, str(i) + ".fq"), "w") for i in xrange(len(inputs))]
+    for r in xrange(len(inputs[0])):
+        for i in xrange(len(inputs)):
+            for line in inputs[i][r]:
+                files[i].write(line + "\n")
+    for f in files:
+        f.close()
+
+def writeByWriteLines(inputs, folder):
+    writers = [fastq.Writer(os.path.join(folder, str(i) + ".fq")) for i in xrange(len(inputs))]
+    for r in xrange(len(inputs[0])):
+        for i in xrange(len(inputs)):
+            writers[i].writeLines(inputs[i][r])
+    for w in writers:
+        w.close()
+
+def writeByWriteBatch(inputs, folder, batchSize = 10000):
+    writers = [fastq.Writer(os.path.join(folder, str(i) + ".fq")) for i in xrange(len(inputs))]
+    for r in xrange(0, len(inputs[0]), batchSize):
+        for i in xrange(len(inputs)):
+            writers[i].writeBatch(inputs[i][r:r+batchSize])
+    for w in writers:
+        w.close()
+
+#the files are written together like seqFilter does, pass R1 and R2 to benchmark a paired-end run
+def benchWriter(files, options):
+    inputs = [loadReads(f, options) for f in files]
+    readNum = min([len(reads) for reads in inputs])
+    inputs = [reads[0:readNum] for reads in inputs]
+    bytes = 0
+    for reads in inputs:
+        for read in reads:
+            bytes += len(read[0]) + len(read[1]) + len(read[2]) + len(read[3]) + 4
+    print("write " + str(readNum) + " reads to " + str(len(files)) + " files")
+    writers = [("line by line", writeLineByLine), ("Writer.writeLines", writeByWriteLines), ("Writer.writeBatch", writeByWriteBatch)]
+    folder = tempfile.mkdtemp()
+    try:
+        for name, write in writers:
+            best = None
+            syscalls = None
+            for i in xrange(options.repeat):
+                calls1 = writeSyscalls()
+                time1 = time.time()
+                write(inputs, folder)
+                time2 = time.time()
+                calls2 = writeSyscalls()
+                if best == None or time2 - time1 < best:
+                    best = time2 - time1
+                if calls1 != None and calls2 != None:
+                    syscalls = calls2 - calls1
+            report(name, readNum, bytes, best)
+            if syscalls != None:
+                print("    " + str(syscalls) + " write syscalls")
+    finally:
+        shutil.rmtree(folder)
+
+def countPerRead(reads):
+    lowQual = [preprocesser.lowQualityNum(r, 20) for r in reads]
+    nNum = [preprocesser.nNumber(r) for r in reads]
+    lengths = [len(r[1]) for r in reads]
+    return (lowQual, nNum, lengths)
+
+def countByKernels(reads, batchSize = 5000):
+    lowQual = []
+    nNum = []
+    lengths = []
+    for start in xrange(0, len(reads), batchSize):
+        counts = batchkernels.readCounts(reads[start:start + batchSize], 20, True, True)
+        lowQual += counts[0]
+        nNum += counts[1]
+        lengths += counts[2]
+    return (lowQual, nNum, lengths)
+
+#the counts of both ways are compared, so this also verifies the kernels with real data
+def benchKernels(files, options):
+    if not batchkernels.HAVE_NUMPY:
+        print("numpy is not installed, batchkernels is not available")
+        sys.exit(1)
+    for f in files:
+        print(f)
+        reads = loadReads(f, options)
+        bytes = 0
+        for read in reads:
+            bytes += len(read[1]) + len(read[3])
+        results = []
+        for name, count in [("per read", countPerRead), ("batchkernels", countByKernels)]:
+            best = None
+            for i in xrange(options.repeat):
+                time1 = time.time()
+                result = count(reads)
+                time2 = time.time()
+                if best == None or time2 - time1 < best:
+                    best = time2 - time1
+            results.append(result)
+            report(name, len(reads), bytes, best)
+        if results[0] != results[1]:
+            print("WARNING: batchkernels returned different counts for " + f)
+
+#random reads, one of every 100 reads has a polyX of maxPoly bases with a mismatch
+def randomReads(length, number, maxPoly):
+    rand = random.Random(length)
+    reads = []
+    for i in xrange(number):
+        seq = [rand.choice("ACGT") for x in xrange(length)]
+        if i % 100 == 0 and length >= maxPoly:
+            start = rand.randint(0, length - maxPoly)
+            base = rand.choice("ACGT")
+            seq[start:start + maxPoly] = [base] * maxPoly
+            seq[start + maxPoly / 2] = "N"
+        reads.append("".join(seq))
+    return reads
+
+def benchPolyX(files, options, maxPoly = 35, mismatch = 2):
+    groups = []
+    for length in (50, 100, 150, 250, 300):
+        groups.append((str(length) + " bp", randomReads(length, 20000, maxPoly)))
+    for f in files:
+        groups.append((f, [read[1] for read in loadReads(f, options)]))
+    for name, seqs in groups:
+        print(name)
+        bytes = sum([len(seq) for seq in seqs])
+        results = []
+        for method, polyX in [("exact scan", preprocesser.hasPolyXExact), ("hasPolyX", preprocesser.hasPolyX)]:
+            best = None
+            for i in xrange(options.repeat):
+                time1 = time.time()
+                result = [polyX(seq, maxPoly, mismatch) for seq in seqs]
+                time2 = time.time()
+                if best == None or time2 - time1 < best:
+                    best = time2 - time1
+            results.append(result)
+            report(method, len(seqs), bytes, best)
+        if results[0] != results[1]:
+            print("WARNING: hasPolyX returned different results for " + name)
+
+#change some bases of a read, and insert or delete a base in some reads
+def mutate(rand, seq, errorRate):
+    seq = list(seq)
+    for i in xrange(len(seq)):
+        if rand.random() < errorRate:
+            seq[i] = rand.choice("ACGTN")
+    if rand.random() < 0.1 and len(seq) > 1:
+        pos = rand.randint(0, len(seq) - 1)
+        if rand.random() < 0.5:
+            del seq[pos]
+        else:
+            seq.insert(pos, rand.choice("ACGT"))
+    return "".join(seq)
+
+#random pairs of length bp, with inserts from minInsert to maxInsert bp
+#the adapters are sequenced if the insert is shorter than the read, and the reads don't overlap if it is longer than twice of it
+def randomPairs(length, number, minInsert, maxInsert):
+    rand = random.Random(length * 1000 + minInsert)
+    pairs = []
+    for i in xrange(number):
+        insert = rand.randint(minInsert, maxInsert)
+        fragment = "".join([rand.choice("ACGT") for x in xrange(insert)])
+        adapter1 = "".join([rand.choice("ACGT") for x in xrange(length)])
+        adapter2 = "".join([rand.choice("ACGT") for x in xrange(length)])
+        r1 = (fragment + adapter1)[0:length]
+        r2 = (util.reverseComplement(fragment) + adapter2)[0:length]
+        errorRate = rand.choice([0.0, 0.005, 0.01, 0.03, 0.1])
+        pairs.append((mutate(rand, r1, errorRate), mutate(rand, r2, errorRate)))
+    return pairs
+
+OVERLAP_METHODS = [("overlapScan", util.overlapScan), ("overlapNative", util.overlapNative),
+    ("overlapSeededPython", util.overlapSeededPython), ("overlapSeededNative", util.overlapSeededNative)]
+
+def benchOverlap(files, options):
+    if not util.OVERLAP_CTYPES_LOADED or not util.OVERLAP_SEEDED_CTYPES_LOADED:
+        print("the native overlap is not loaded, run make in AfterQC folder to build editdistance/libed.so")
+        sys.exit(1)
+    groups = []
+    for length in (50, 100, 150, 250):
+        #short inserts, from a few bases shorter than the read (overlap with negative offset) to mostly overlapped
+        groups.append((str(length) + " bp, short insert", randomPairs(length, 5000, length - 5, length * 2 - 30)))
+        #long inserts, the reads don't overlap
+        groups.append((str(length) + " bp, long insert", randomPairs(length, 5000, length * 2, length * 4)))
+    for i in xrange(0, len(files) - 1, 2):
+        reads1 = loadReads(files[i], options)
+        reads2 = loadReads(files[i + 1], options)
+        groups.append((files[i] + " " + files[i + 1], [(reads1[j][1], reads2[j][1]) for j in xrange(min(len(reads1), len(reads2)))]))
+    for name, pairs in groups:
+        print(name)
+        bytes = sum([len(r1) + len(r2) for r1, r2 in pairs])
+        results = []
+        for method, overlap in OVERLAP_METHODS:
+            best = None
+            for i in xrange(options.repeat):
+                time1 = time.time()
+                result = [overlap(r1, r2) for r1, r2 in pairs]
+                time2 = time.time()
+                if best == None or time2 - time1 < best:
+                    best = time2 - time1
+            results.append(result)
+            report(method, len(pairs), bytes, best)
+        different = len([j for j in xrange(len(pairs)) if results[0][j] != results[1][j]])
+        if different > 0:
+            print("WARNING: overlapNative returned different results for " + str(different) + " pairs of " + name)
+        different = len([j for j in xrange(len(pairs)) if results[2][j] != results[3][j]])
+        if different > 0:
+            print("WARNING: overlapSeededNative returned different results for " + str(different) + " pairs of " + name)
+        different = len([j for j in xrange(len(pairs)) if results[0][j] != results[2][j]])
+        overlapped = [len([r for r in result if r[1] > 30]) for result in (results[0], results[2])]
+        print("overlapped pairs: " + str(overlapped[0]) + " exhaustive, " + str(overlapped[1]) + " seeded, " + str(different) + " pairs with different results")
+
+#the per-character versions which util used before seqkernel
+def reverseComplementByChar(origin):
+    length = len(origin)
+    revCompArr = ['' for x in xrange(length)]
+    for i in xrange(length):
+        orig = origin[length - i -1]
+        if orig in seqkernel.COMP:
+            revCompArr[i] = seqkernel.COMP[orig]
+        else:
+            revCompArr[i] = 'N'
+    return ''.join(revCompArr)
+
+def hammingDistanceByChar(s1, s2):
+    length = min(len(s1), len(s2))
+    d = 0
+    for i in xrange(length):
+        if s1[i] != s2[i]:
+            d += 1
+    return d
+
+def mismatchPositionsByChar(s1, s2):
+    return [i for i in xrange(min(len(s1), len(s2))) if s1[i] != s2[i]]
+
+def benchSeqKernel(files, options):
+    groups = []
+    for length in (50, 150, 250):
+        groups.append((str(length) + " bp", randomReads(length, 20000, 35)))
+    for f in files:
+        groups.append((f, [read[1] for read in loadReads(f, options)]))
+    for name, seqs in groups:
+        print(name + (", numpy" if seqkernel.HAVE_NUMPY else ", no numpy"))
+        bytes = sum([len(seq) for seq in seqs])
+        #the reads and themselves with a few mutations, like the overlapped area of a pair
+        rand = random.Random(len(seqs))
+        mutated = [mutate(rand, seq, 0.01) for seq in seqs]
+        tests = [("reverse complement", [("per character", lambda: [reverseComplementByChar(seq) for seq in seqs]),
+                ("reverseComplement", lambda: [seqkernel.reverseComplement(seq) for seq in seqs]),
+                ("batchReverseComplement", lambda: seqkernel.batchReverseComplement(seqs))]),
+            ("hamming distance", [("per character", lambda: [hammingDistanceByChar(s1, s2) for s1, s2 in zip(seqs, mutated)]),
+                ("hammingDistance", lambda: [seqkernel.hammingDistance(s1, s2) for s1, s2 in zip(seqs, mutated)]),
+                ("hammingDistances", lambda: seqkernel.hammingDistances(seqs, mutated))]),
+            ("mismatch positions", [("per character", lambda: [mismatchPositionsByChar(s1, s2) for s1, s2 in zip(seqs, mutated)]),
+                ("mismatchPositions", lambda: [seqkernel.mismatchPositions(s1, s2) for s1, s2 in zip(seqs, mutated)])])]
+        for test, methods in tests:
+            results = []
+            for method, run in methods:
+                best = None
+                for i in xrange(options.repeat):
+                    time1 = time.time()
+                    result = run()
+                    time2 = time.time()
+                    if best == None or time2 - time1 < best:
+                        best = time2 - time1
+                results.append(result)
+                report(test + ", " + method, len(seqs), bytes, best)
+            for i in xrange(1, len(results)):
+                if results[i] != results[0]:
+                    print("WARNING: " + methods[i][0] + " returned different results for " + name)
+
+#random adapters of 20 to 35 bp, the built-in adapters are used if number is 0
+def randomAdapters(number):
+    if number == 0:
+        return adaptertrim.loadAdapters("all", None)
+    rand = random.Random(number)
+    return [("adapter" + str(i), "".join([rand.choice("ACGT") for x in xrange(rand.randint(20, 35))])) for i in xrange(number)]
+
+#random reads, a third of them has a whole adapter and a third has a part of an adapter at the 3' end
+def readsWithAdapters(length, number, adapters):
+    rand = random.Random(length * 1000 + len(adapters))
+    reads = []
+    for i in xrange(number):
+        seq = "".join([rand.choice("ACGT") for x in xrange(length)])
+        adapter = rand.choice(adapters)[1]
+        if i % 3 == 0:
+            pos = rand.randint(0, length - 1)
+            seq = (seq[0:pos] + adapter + seq)[0:length]
+        elif i % 3 == 1:
+            partial = rand.randint(1, len(adapter) - 1)
+            seq = seq[0:length - partial] + adapter[0:partial]
+        reads.append(seq)
+    return reads
+
+#the position to trim the read at, by finding each adapter and each partial adapter at the 3' end separately
+def findAdapters(adapters, seq, minPartial):
+    best = len(seq)
+    for name, adapter in adapters:
+        pos = seq.find(adapter)
+        if pos >= 0 and pos < best:
+            best = pos
+    for name, adapter in adapters:
+        for partial in xrange(min(len(adapter) - 1, len(seq)), minPartial - 1, -1):
+            if len(seq) - partial < best and seq.endswith(adapter[0:partial]):
+                best = len(seq) - partial
+                break
+    return best
+
+def benchAdapters(files, options, minPartial = 5):
+    if not util.ADAPTER_CTYPES_LOADED:
+        print("the native adapter scan is not loaded, run make in AfterQC folder to build editdistance/libed.so")
+        sys.exit(1)
+    for number in (0, 10, 100, 500):
+        adapters = randomAdapters(number)
+        trimmer = adaptertrim.AdapterTrimmer(adapters, minPartial)
+        groups = []
+        for length in (50, 150, 250):
+            groups.append((str(length) + " bp", readsWithAdapters(length, 10000, adapters)))
+        for f in files:
+            groups.append((f, [read[1] for read in loadReads(f, options)]))
+        for name, seqs in groups:
+            print(name + ", " + str(len(adapters)) + " adapters")
+            bytes = sum([len(seq) for seq in seqs])
+            results = []
+            for method, run in [("find each adapter", lambda: [findAdapters(adapters, seq, minPartial) for seq in seqs]),
+                    ("scanPython", lambda: [trimmer.scanPython(seq) for seq in seqs]),
+                    ("scanNative", lambda: [trimmer.scanNative(seq) for seq in seqs])]:
+                best = None
+                for i in xrange(options.repeat):
+                    time1 = time.time()
+                    result = run()
+                    time2 = time.time()
+                    if best == None or time2 - time1 < best:
+                        best = time2 - time1
+                results.append(result)
+                report(method, len(seqs), bytes, best)
+            if results[1] != results[2]:
+                print("WARNING: scanNative returned different results for " + name)
+            different = len([j for j in xrange(len(seqs)) if results[0][j] != results[1][j][0]])
+            if different > 0:
+                print("WARNING: the scan trimmed " + str(different) + " reads of " + name + " at other positions than finding each adapter")
+            print("trimmed reads: " + str(len([r for r in results[1] if r[1] >= 0])))
+
+BENCHMARKS = {
+    "reader": benchReader,
+    "writer": benchWriter,
+    "kernels": benchKernels,
+    "polyx": benchPolyX,
+    "overlap": benchOverlap,
+    "seqkernel": benchSeqKernel,
+    "adapters": benchAdapters,
+}
+
+#the benchmarks which can run without input files
+NO_INPUT_BENCHMARKS = ("polyx", "overlap", "seqkernel", "adapters")
+
+def main():
+    (options, args) = parseCommand()
+    if len(args) < 1 or args[0] not in BENCHMARKS or (len(args) < 2 and args[0] not in NO_INPUT_BENCHMARKS):
+        print("specify a benchmark and input files, see -h for help")
+        sys.exit(1)
+    BENCHMARKS[args[0]](args[1:], options)
+
+if __name__  == "__main__":
+    main()
@@ -347,7 +347,7 @@ class BubbleProcesser:
                    
     def statFileFastq(self, filename, queue):
         print("start: " + filename + "\n")
-        reader = fastq.Reader(filename)
+        reader = fastq.BlockReader(filename)
         records = []
         pattern = re.compile(r'\S+\:\d+\:\S+\:\d+\:\d+\:\d+\:\d+')
         while True:
@@ -0,0 +1,36 @@
+// the scan of a read by the Aho-Corasick automaton of the adapters, a native version of adaptertrim.AdapterTrimmer.scanPython
+// the automaton is a DFA: delta[state * classes + class] is the next state, class_table maps a character to its class
+// info[state * 4 + 0..3] are the length and the adapter of the longest adapter ending at the state,
+// the depth of the state and the first adapter which has the state as a prefix
+
+#include "./_adapter.h"
+
+void adapter_scan(const int *delta, const int classes, const unsigned char *class_table, const int *info,
+        const int max_len, const int min_partial, const char *seq, const int len, int *result) {
+    int state = 0;
+    int best = len;
+    int best_adapter = -1;
+    int partial = 0;
+    int i = 0;
+    for(; i < len; ++i) {
+        state = delta[state * classes + class_table[(unsigned char)seq[i]]];
+        int match = info[state * 4];
+        if(match > 0 && i - match + 1 < best) {
+            best = i - match + 1;
+            best_adapter = info[state * 4 + 1];
+        }
+        // no adapter ending later can start before best
+        if(i - max_len + 1 >= best) break;
+    }
+    if(i == len) {
+        int depth = info[state * 4 + 2];
+        if(depth >= min_partial && len - depth < best) {
+            best = len - depth;
+            best_adapter = info[state * 4 + 3];
+            partial = 1;
+        }
+    }
+    result[0] = best;
+    result[1] = best_adapter;
+    result[2] = partial;
+}
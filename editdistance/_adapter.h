@@ -0,0 +1,19 @@
+#ifndef ___ADAPTER__H__
+#define ___ADAPTER__H__
+
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// same as adaptertrim.AdapterTrimmer.scanPython of AfterQC, the automaton is built by AdapterTrimmer
+// result is set to {position, adapter, partial}
+void adapter_scan(const int *delta, const int classes, const unsigned char *class_table, const int *info,
+        const int max_len, const int min_partial, const char *seq, const int len, int *result);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
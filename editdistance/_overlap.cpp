@@ -0,0 +1,325 @@
+// the overlap of a read pair, a native version of util.overlap
+// it checks the same offsets as util.overlap in the same order, and gets the same (offset, overlap_len, distance)
+// all the edit distances of a scan are computed with one pattern map:
+// the pattern map of a string is also the pattern map of all its prefixes,
+// since the bits of a row of the bit-parallel edit distance only depend on the rows above it
+// the positive scan maps the reverse complement of r2, and the negative scan maps r1
+// find_overlap_seeded only checks the offsets near the k-mers shared by r1 and the reverse complement of r2
+
+#include <stdint.h>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+#include <algorithm>
+
+#include "./_overlap.h"
+
+using namespace std;
+
+static char complement(char base) {
+    switch(base) {
+        case 'A': return 'T';
+        case 'T': return 'A';
+        case 'C': return 'G';
+        case 'G': return 'C';
+        case 'a': return 't';
+        case 't': return 'a';
+        case 'c': return 'g';
+        case 'g': return 'c';
+        case 'N': return 'N';
+        case '\n': return '\n';
+    }
+    return 'N';
+}
+
+struct PatternMap {
+    vector<uint64_t> peq;
+    unsigned int words;
+
+    PatternMap(char const *s, unsigned int const len) {
+        words = (len + 63) >> 6;
+        peq.assign(256 * (words > 0 ? words : 1), 0);
+        for(unsigned int i = 0; i < len; ++i) peq[(unsigned char)s[i] * words + (i >> 6)] |= (1ULL << (i & 63));
+    }
+};
+
+// the edit distance of the pattern prefix of plen and text of tlen
+// this is the block based algorithm of Myers, a carry between the blocks is passed as the horizontal delta hin
+// if limit >= 0, it returns limit + 1 once the distance is known to be larger than limit:
+// the distance is never smaller than a cell on the diagonal D[j][j], which is j plus the vertical deltas of column j
+static unsigned int prefix_distance(PatternMap const &pm, unsigned int const plen, char const *text, unsigned int const tlen,
+        vector<uint64_t> &pv, vector<uint64_t> &mv, int const limit = -1) {
+    if(plen == 0) return tlen;
+    unsigned int const words = (plen + 63) >> 6;
+    unsigned int const last = words - 1;
+    uint64_t const high = 1ULL << ((plen - 1) & 63);
+    uint64_t const lmb = 1ULL << 63;
+    unsigned int score = plen;
+    for(unsigned int w = 0; w < words; ++w) {
+        pv[w] = ~0ULL;
+        mv[w] = 0;
+    }
+    for(unsigned int j = 0; j < tlen; ++j) {
+        uint64_t const *eqs = &pm.peq[(unsigned char)text[j] * pm.words];
+        int hin = 1;
+        for(unsigned int w = 0; w < words; ++w) {
+            uint64_t Pv = pv[w];
+            uint64_t Mv = mv[w];
+            uint64_t Eq = eqs[w];
+            uint64_t Xv = Eq | Mv;
+            if(hin < 0) Eq |= 1ULL;
+            uint64_t Xh = (((Eq & Pv) + Pv) ^ Pv) | Eq;
+            uint64_t Ph = Mv | ~(Xh | Pv);
+            uint64_t Mh = Pv & Xh;
+            uint64_t top = w == last ? high : lmb;
+            int hout = 0;
+            if(Ph & top) hout = 1;
+            else if(Mh & top) hout = -1;
+            Ph <<= 1;
+            Mh <<= 1;
+            if(hin < 0) Mh |= 1ULL;
+            else if(hin > 0) Ph |= 1ULL;
+            pv[w] = Mh | ~(Xv | Ph);
+            mv[w] = Ph & Xv;
+            hin = hout;
+        }
+        score += hin;
+        if(limit >= 0 && j < plen) {
+            unsigned int const rows = j + 1;
+            int diagonal = rows;
+            for(unsigned int w = 0; w < (rows >> 6); ++w) diagonal += __builtin_popcountll(pv[w]) - __builtin_popcountll(mv[w]);
+            if(rows & 63) {
+                uint64_t const mask = (1ULL << (rows & 63)) - 1;
+                diagonal += __builtin_popcountll(pv[rows >> 6] & mask) - __builtin_popcountll(mv[rows >> 6] & mask);
+            }
+            if(diagonal > limit) return limit + 1;
+        }
+    }
+    return score;
+}
+
+static double distance_threshold(int const overlap_len) {
+    double threshold = overlap_len / 10.0;
+    return threshold < 3 ? threshold : 3;
+}
+
+static int step(unsigned int const distance, double const threshold) {
+    int s = ((int)distance - (int)threshold) / 2;
+    return s > 1 ? s : 1;
+}
+
+static void reverse_complement(const char *r2, int const l2, vector<char> &reverse_r2) {
+    reverse_r2.resize(l2 + 1);
+    for(int i = 0; i < l2; ++i) reverse_r2[i] = complement(r2[l2 - i - 1]);
+}
+
+static void set_result(int *result, int const offset, int const overlap_len, unsigned int const distance) {
+    result[0] = offset;
+    result[1] = overlap_len;
+    result[2] = distance;
+}
+
+// the overlap of two reads, it has the pattern map of the reverse complement of r2 for the positive offsets
+struct Overlap {
+    const char *r1;
+    const char *rr2;
+    int l1;
+    int l2;
+    PatternMap pm;
+    vector<uint64_t> pv;
+    vector<uint64_t> mv;
+
+    Overlap(const char *r1_, int const l1_, const char *rr2_, int const l2_) : r1(r1_), rr2(rr2_), l1(l1_), l2(l2_), pm(rr2_, l2_) {
+        unsigned int const words = ((l1 > l2 ? l1 : l2) + 63) >> 6;
+        pv.resize(words + 1);
+        mv.resize(words + 1);
+    }
+
+    int overlap_len(int const offset) {
+        return min(l1 - offset, l2);
+    }
+
+    // if limit >= 0, it is only exact if it is within limit
+    unsigned int distance(int const offset, int const limit = -1) {
+        int const len = overlap_len(offset);
+        return prefix_distance(pm, len, r1 + offset, len, pv, mv, limit);
+    }
+
+    // the candidate at offset has a distance within the threshold, move r2 right while the distance is getting smaller
+    // returns false if the offset reaches the end of r1 before the distance stops getting smaller
+    // only a smaller distance has to be exact
+    bool refine(int &offset, int &len, unsigned int &dist) {
+        while(offset < l1 - 10) {
+            int next_offset = offset + 1;
+            if(dist == 0) return true;
+            unsigned int next_distance = distance(next_offset, dist - 1);
+            if(dist <= next_distance) return true;
+            offset = next_offset;
+            dist = next_distance;
+            len = overlap_len(next_offset);
+        }
+        return false;
+    }
+
+    // the scan of negative offsets after an overlap is found at offset 0, it maps r1
+    void negative(int *result) {
+        PatternMap pm1(r1, l1);
+        int offset = 0;
+        while(offset > -(l2 - 10)) {
+            int len = min(l1, l2 - abs(offset));
+            unsigned int dist = prefix_distance(pm1, len, rr2 - offset, len, pv, mv);
+            double threshold = distance_threshold(len);
+            if(dist <= threshold) {
+                while(offset > -(l2 - 10)) {
+                    int next_offset = offset - 1;
+                    int next_len = min(l1, l2 - abs(next_offset));
+                    if(dist == 0) {
+                        set_result(result, offset, len, dist);
+                        return;
+                    }
+                    unsigned int next_distance = prefix_distance(pm1, next_len, rr2 - next_offset, next_len, pv, mv, dist - 1);
+                    if(dist <= next_distance) {
+                        set_result(result, offset, len, dist);
+                        return;
+                    }
+                    dist = next_distance;
+                    len = next_len;
+                    offset = next_offset;
+                }
+            } else {
+                offset -= step(dist, threshold);
+            }
+        }
+    }
+
+    // a candidate is found at offset, set the result like the scan
+    void found(int offset, int len, unsigned int dist, int *result) {
+        if(!refine(offset, len, dist)) return;
+        if(offset == 0) negative(result);
+        else set_result(result, offset, len, dist);
+    }
+
+    void scan(int *result) {
+        int offset = 0;
+        while(offset < l1 - 10) {
+            int len = overlap_len(offset);
+            unsigned int dist = distance(offset);
+            double threshold = distance_threshold(len);
+            if(dist <= threshold) {
+                found(offset, len, dist, result);
+                return;
+            }
+            offset += step(dist, threshold);
+        }
+    }
+};
+
+void find_overlap(const char *r1, const unsigned int len1, const char *r2, const unsigned int len2, int *result) {
+    set_result(result, 0, 0, 0);
+    vector<char> reverse_r2;
+    reverse_complement(r2, len2, reverse_r2);
+    Overlap ov(r1, len1, &reverse_r2[0], len2);
+    ov.scan(result);
+}
+
+// the k-mer seeded overlap, same as util.overlapSeededPython
+
+static unsigned int const SEED_BUCKETS = 1024;
+
+static int base_code(char const base) {
+    switch(base) {
+        case 'A': return 0;
+        case 'C': return 1;
+        case 'G': return 2;
+        case 'T': return 3;
+    }
+    return -1;
+}
+
+// the 2 bit codes of the k-mers of seq, returns false if seq has a base other than ACGT
+static bool kmer_codes(const char *seq, int const len, unsigned int const k, vector<uint32_t> &codes) {
+    uint32_t const mask = (k < 16) ? ((1U << (2 * k)) - 1) : ~0U;
+    uint32_t code = 0;
+    codes.clear();
+    for(int i = 0; i < len; ++i) {
+        int c = base_code(seq[i]);
+        if(c < 0) return false;
+        code = ((code << 2) | c) & mask;
+        if(i + 1 >= (int)k) codes.push_back(code);
+    }
+    return true;
+}
+
+// if an overlap of overlap_len has a distance within the threshold, r1 and reverse_r2 share k bases in it
+// at most t edits leave at least overlap_len - t matched bases in at most t + 1 runs,
+// so the longest run has at least ceil((overlap_len - t) / (t + 1)) = overlap_len / (t + 1) bases
+static bool seed_guaranteed(int const overlap_len, unsigned int const k) {
+    int t = (int)distance_threshold(overlap_len);
+    return overlap_len / (t + 1) >= (int)k;
+}
+
+void find_overlap_seeded(const char *r1, const unsigned int len1, const char *r2, const unsigned int len2,
+        const unsigned int k, const unsigned int max_diagonals, const unsigned int shift, int *result) {
+    set_result(result, 0, 0, 0);
+    int const l1 = len1;
+    int const l2 = len2;
+    vector<char> reverse_r2;
+    reverse_complement(r2, l2, reverse_r2);
+    const char *rr2 = &reverse_r2[0];
+
+    vector<uint32_t> codes1, codes2;
+    if(!kmer_codes(r1, l1, k, codes1) || !kmer_codes(rr2, l2, k, codes2)) {
+        Overlap ov(r1, l1, rr2, l2);
+        ov.scan(result);
+        return;
+    }
+
+    // the diagonals offset = i - j of the k-mers shared by r1 at i and reverse_r2 at j
+    // the k-mers of reverse_r2 are in a hash table of SEED_BUCKETS chains
+    vector<int> head(SEED_BUCKETS, -1);
+    vector<int> next(codes2.size());
+    for(size_t j = 0; j < codes2.size(); ++j) {
+        uint32_t bucket = codes2[j] & (SEED_BUCKETS - 1);
+        next[j] = head[bucket];
+        head[bucket] = j;
+    }
+    int const last = l1 - 11;
+    vector<int> diagonals;
+    for(size_t i = 0; i < codes1.size(); ++i) {
+        for(int j = head[codes1[i] & (SEED_BUCKETS - 1)]; j >= 0; j = next[j]) {
+            if(codes2[j] != codes1[i]) continue;
+            int diagonal = (int)i - j;
+            if(diagonal >= -(int)shift && diagonal <= last + (int)shift) diagonals.push_back(diagonal);
+        }
+    }
+    sort(diagonals.begin(), diagonals.end());
+    diagonals.erase(unique(diagonals.begin(), diagonals.end()), diagonals.end());
+    if(diagonals.size() > max_diagonals) {
+        Overlap ov(r1, l1, rr2, l2);
+        ov.scan(result);
+        return;
+    }
+
+    if(last < 0) return;
+    vector<char> candidate(last + 1, 0);
+    for(size_t d = 0; d < diagonals.size(); ++d) {
+        for(int offset = diagonals[d] - (int)shift; offset <= diagonals[d] + (int)shift; ++offset) {
+            if(offset >= 0 && offset <= last) candidate[offset] = 1;
+        }
+    }
+    for(int offset = 0; offset <= last; ++offset) {
+        if(!seed_guaranteed(min(l1 - offset, l2), k)) candidate[offset] = 1;
+    }
+
+    Overlap ov(r1, l1, rr2, l2);
+    for(int offset = 0; offset <= last; ++offset) {
+        if(!candidate[offset]) continue;
+        int len = ov.overlap_len(offset);
+        double threshold = distance_threshold(len);
+        unsigned int dist = ov.distance(offset, (int)threshold);
+        if(dist <= threshold) {
+            ov.found(offset, len, dist, result);
+            return;
+        }
+    }
+}
@@ -0,0 +1,21 @@
+#ifndef ___OVERLAP__H__
+#define ___OVERLAP__H__
+
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// same as util.overlap of AfterQC, result is set to {offset, overlap_len, distance}
+void find_overlap(const char *r1, const unsigned int len1, const char *r2, const unsigned int len2, int *result);
+
+// same as util.overlapSeededPython of AfterQC, k, max_diagonals and shift are util.SEED_K, util.MAX_SEED_DIAGONALS and util.SEED_SHIFT
+void find_overlap_seeded(const char *r1, const unsigned int len1, const char *r2, const unsigned int len2,
+        const unsigned int k, const unsigned int max_diagonals, const unsigned int shift, int *result);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
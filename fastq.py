@@ -1,7 +1,13 @@
  #!/usr/bin/env python
   
 import gzip
+import mmap
 import os,sys
+import signal
+import subprocess
+import zlib
+from collections import deque
+import readbatch
 
 def isFastq(f):
     fqext = (".fq", ".fastq", "fq.gz", ".fastq.gz")
@@ -10,22 +16,134 @@ def isFastq(f):
             return True
     return False
 
+################################
+#decompression of .gz files
+#an external decompressor runs in a separate process, so the inflating is done in another core
+#in parallel with the filtering in python
+
+#the external decompressors to try when decompressor is auto, in the order of preference
+DECOMPRESSORS = ("pigz", "igzip", "gzip")
+#the buffer size of the pipe from the external decompressor
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+def findExecutable(name):
+    for folder in os.environ.get("PATH", "").split(os.pathsep):
+        exe = os.path.join(folder, name)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+    return None
+
+def findDecompressor(decompressor = "auto"):
+    #python means the in-process gzip module
+    if decompressor == "python":
+        return None
+    if decompressor == "auto":
+        for name in DECOMPRESSORS:
+            exe = findExecutable(name)
+            if exe != None:
+                return exe
+        return None
+    exe = findExecutable(decompressor)
+    if exe == None:
+        print("Decompressor " + decompressor + " is not found in PATH, use python gzip module instead")
+    return exe
+
+def restoreSigpipe():
+    #python ignores SIGPIPE, restore it so that the decompressor exits quietly when we stop reading early
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+class DecompressorPipe:
+
+    def __init__(self, exe, fname):
+        self.filename = fname
+        self.__input = open(fname, "rb")
+        self.__process = subprocess.Popen([exe, "-dc"], stdin = self.__input, stdout = subprocess.PIPE,
+            bufsize = PIPE_BUFFER_SIZE, preexec_fn = restoreSigpipe, close_fds = True)
+        self.__output = self.__process.stdout
+
+    def __checkExit(self):
+        #the decompressor must exit normally when all data is read, otherwise the file is broken
+        if self.__process.wait() != 0:
+            raise IOError("Failed to decompress file " + self.filename)
+
+    def read(self, size = -1):
+        data = self.__output.read(size)
+        if len(data) == 0:
+            self.__checkExit()
+        return data
+
+    def readline(self):
+        line = self.__output.readline()
+        if len(line) == 0:
+            self.__checkExit()
+        return line
+
+    def close(self):
+        self.__output.close()
+        self.__process.wait()
+        self.__input.close()
+
+    #the decompressor shares the file offset of the input, which is the position in the compressed file
+    def position(self):
+        return os.lseek(self.__input.fileno(), 0, os.SEEK_CUR)
+
+################################
+#standard input and output
+#the file name - means stdin for input files and stdout for output files
+#the stream is duplicated, so closing a reader or writer doesn't close stdin/stdout of the process
+
+STDIO = "-"
+#the file descriptor to write the reads when the output file is -
+STDOUT_FD = 1
+
+#move the logs to stderr, so they are not mixed with the reads written to stdout
+#the original stdout is kept in STDOUT_FD, child processes inherit the redirection
+def redirectStdout():
+    global STDOUT_FD
+    sys.stdout.flush()
+    STDOUT_FD = os.dup(1)
+    os.dup2(2, 1)
+
+def openInput(fname, decompressor = "auto"):
+    #stdin is read as uncompressed data
+    if fname == STDIO:
+        return os.fdopen(os.dup(0), "r")
+    if not fname.endswith(".gz"):
+        return open(fname, "r")
+    exe = findDecompressor(decompressor)
+    if exe == None:
+        return gzip.open(fname, "r")
+    return DecompressorPipe(exe, fname)
+
+#the count of bytes read from an input opened by openInput, it is the position in the compressed file for .gz files
+#returns None if it is unknown, like a pipe
+def inputPosition(f):
+    try:
+        if isinstance(f, DecompressorPipe):
+            return f.position()
+        if isinstance(f, gzip.GzipFile):
+            return f.fileobj.tell()
+        return f.tell()
+    except (IOError, OSError, AttributeError):
+        return None
+
+#the size of an input file, None for stdin
+def inputSize(fname):
+    if fname == STDIO:
+        return None
+    return os.path.getsize(fname)
+
 ################################
 #fastq.reader
 
 class Reader:
 
-    def __init__(self, fname):
+    def __init__(self, fname, decompressor = "auto"):
         self.__file = None
-        self.__gz = False
         self.__eof = False
         self.filename = fname
-        if self.filename.endswith(".gz"):
-            self.__gz = True
-            self.__file = gzip.open(self.filename, "r")
-        else:
-            self.__gz = False
-            self.__file = open(self.filename, "r")
+        self.__gz = self.filename.endswith(".gz")
+        self.__file = openInput(self.filename, decompressor)
         if self.__file == None:
             print("Failed to open file " + self.filename)
             sys.exit(1)
@@ -51,8 +169,493 @@ class Reader:
     def isEOF(self):
         return False
 
+################################
+#fastq.blockreader
+#reads a large block of data each time and splits it into records in bulk
+#this is much faster than calling readline() four times for each read
+#with compact = True, the reads of a block are returned as readbatch.BatchRead views of one buffer
+
+#the size of data to read from the file each time
+BLOCK_SIZE = 4 * 1024 * 1024
+
+class BlockReader:
+
+    def __init__(self, fname, blockSize = BLOCK_SIZE, decompressor = "auto", compact = False):
+        self.__file = None
+        self.__eof = False
+        #partial lines at the end of last block, which are not a complete read
+        self.__tail = ""
+        self.__reads = []
+        self.__pos = 0
+        self.filename = fname
+        self.blockSize = blockSize
+        self.compact = compact
+        self.__gz = self.filename.endswith(".gz")
+        self.__file = openInput(self.filename, decompressor)
+        if self.__file == None:
+            print("Failed to open file " + self.filename)
+            sys.exit(1)
+        self.__size = inputSize(self.filename)
+
+    def __del__(self):
+        if self.__file != None:
+            self.__file.close()
+
+    def __readBlock(self):
+        data = self.__file.read(self.blockSize)
+        if self.compact:
+            return self.__readBatch(data)
+        if len(data) == 0:
+            #the last line may have no line break
+            lines = self.__tail.split("\n")
+            self.__tail = ""
+            self.__eof = True
+        else:
+            lines = (self.__tail + data).split("\n")
+            #the last line is not complete, together with the lines of an incomplete read
+            #they are carried to next block
+            recordLines = ((len(lines) - 1) >> 2) << 2
+            self.__tail = "\n".join(lines[recordLines:])
+            del lines[recordLines:]
+        lines = map(str.rstrip, lines)
+        #an empty line means the end of the file, same as Reader
+        if "" in lines:
+            del lines[lines.index(""):]
+            self.__eof = True
+        recordLines = (len(lines) >> 2) << 2
+        return [lines[i:i+4] for i in xrange(0, recordLines, 4)]
+
+    def __readBatch(self, data):
+        final = len(data) == 0
+        data = self.__tail + data
+        batch, consumed, eof = readbatch.parseBlock(data, final)
+        self.__tail = data[consumed:]
+        if final or eof:
+            self.__tail = ""
+            self.__eof = True
+        return batch.reads()
+
+    def nextBatch(self):
+        #return the reads buffered by nextRead first
+        if self.__pos < len(self.__reads):
+            reads = self.__reads[self.__pos:]
+            self.__reads = []
+            self.__pos = 0
+            return reads
+
+        if self.__file == None:
+            return None
+
+        while not self.__eof:
+            reads = self.__readBlock()
+            if len(reads) > 0:
+                return reads
+        return None
+
+    def nextRead(self):
+        if self.__pos >= len(self.__reads):
+            self.__reads = self.nextBatch()
+            self.__pos = 0
+            if self.__reads == None:
+                self.__reads = []
+                return None
+        read = self.__reads[self.__pos]
+        self.__pos += 1
+        return read
+
+    def isEOF(self):
+        return self.__eof and self.__pos >= len(self.__reads)
+
+    #returns (bytes read, size of the file), the bytes are compressed bytes for .gz files, None if unknown
+    def position(self):
+        return (inputPosition(self.__file), self.__size)
+
+    #continue reading from stream, which is positioned at a record start
+    #for example, a gzindex.CheckpointStream which decompresses a .gz file from a checkpoint
+    def resume(self, stream):
+        if self.__file != None:
+            self.__file.close()
+        self.__file = stream
+        self.__tail = ""
+        self.__reads = []
+        self.__pos = 0
+        self.__eof = False
+
+    #move to a record start at offset, which can be got from fastqindex
+    #only uncompressed files can be seeked
+    def seek(self, offset):
+        if self.__gz:
+            raise IOError("cannot seek in compressed file " + self.filename)
+        self.__file.seek(offset)
+        self.__tail = ""
+        self.__reads = []
+        self.__pos = 0
+        self.__eof = False
+
+################################
+#fastq.mmapreader
+#maps an uncompressed fastq file into memory and finds the record boundaries in the mapped buffer
+#a read is returned as a ReadView, which only keeps the offsets of its lines
+#the strings are created when they are accessed, and the pages can be dropped by the OS at any time
+
+#how many reads to return by nextBatch
+MMAP_BATCH_SIZE = 10000
+WHITESPACES = " \t\r\n\x0b\x0c"
+
+class ReadView(object):
+
+    __slots__ = ("buffer", "bounds", "lines")
+
+    #bounds are the positions of the line breaks before and after each line
+    #so line i is buffer[bounds[i]+1 : bounds[i+1]]
+    def __init__(self, buffer, bounds):
+        self.buffer = buffer
+        self.bounds = bounds
+        self.lines = [None, None, None, None]
+
+    def __getitem__(self, i):
+        line = self.lines[i]
+        if line == None:
+            if i < 0:
+                i += 4
+            line = self.buffer[self.bounds[i]+1 : self.bounds[i+1]].rstrip()
+            self.lines[i] = line
+        return line
+
+    def __setitem__(self, i, line):
+        self.lines[i] = line
+
+    def __len__(self):
+        return 4
+
+    def __iter__(self):
+        for i in xrange(4):
+            yield self[i]
+
+class MmapReader:
+
+    def __init__(self, fname, batchSize = MMAP_BATCH_SIZE):
+        self.__buffer = None
+        self.__size = 0
+        self.__pos = 0
+        self.__eof = False
+        self.filename = fname
+        self.batchSize = batchSize
+        f = open(self.filename, "rb")
+        self.__size = os.fstat(f.fileno()).st_size
+        #an empty file cannot be mapped
+        if self.__size > 0:
+            self.__buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.__eof = True
+        #the mapping is kept after the file is closed
+        f.close()
+
+    def nextRead(self):
+        if self.__eof:
+            return None
+        buf = self.__buffer
+        size = self.__size
+        bounds = [self.__pos - 1]
+        for i in xrange(4):
+            start = bounds[i] + 1
+            if start >= size:
+                self.__eof = True
+                return None
+            end = buf.find("\n", start)
+            #the last line may have no line break
+            if end < 0:
+                end = size
+            #an empty line means the end of the file, same as Reader
+            #the first char of a line with only white spaces must be a white space
+            if end == start or (buf[start] in WHITESPACES and len(buf[start:end].rstrip()) == 0):
+                self.__eof = True
+                return None
+            bounds.append(end)
+        self.__pos = bounds[4] + 1
+        return ReadView(buf, bounds)
+
+    def nextBatch(self):
+        reads = []
+        while len(reads) < self.batchSize:
+            read = self.nextRead()
+            if read == None:
+                break
+            reads.append(read)
+        if len(reads) == 0:
+            return None
+        return reads
+
+    def isEOF(self):
+        return self.__eof
+
+    def position(self):
+        return (self.__pos, self.__size)
+
+    #move to a record start at offset, which can be got from fastqindex
+    def seek(self, offset):
+        self.__pos = offset
+        self.__eof = self.__size == 0
+
+def openReader(fname, decompressor = "auto", useMmap = False, compact = False):
+    #.gz files and stdin cannot be mapped
+    if useMmap and fname != STDIO and not fname.endswith(".gz"):
+        return MmapReader(fname)
+    return BlockReader(fname, decompressor = decompressor, compact = compact)
+
+################################
+#fastq.pairedreader
+#reads read1/read2/index1/index2 files in lockstep and returns aligned batches
+#the read names of each batch are checked, so a desynchronized pair fails fast instead of being processed silently
+
+class PairingError(Exception):
+    pass
+
+#the read name up to the first space, without the /1 /2 suffix of old illumina format
+def readId(name):
+    rid = name.split(" ", 1)[0]
+    if len(rid) > 2 and rid[-2] == "/":
+        rid = rid[:-2]
+    return rid
+
+class PairedReader:
+
+    #readers are the readers of read1, read2, index1 and index2, absent files are None
+    def __init__(self, readers, checkNames = True):
+        self.readers = readers
+        self.checkNames = checkNames
+        self.__buffers = [[] for r in readers]
+        self.__eof = [r == None for r in readers]
+        self.__present = [i for i in xrange(len(readers)) if readers[i] != None]
+        #the count of records returned
+        self.records = 0
+
+    #returns (bytes read, total size) of all files, None if unknown for any file
+    def position(self):
+        position = 0
+        size = 0
+        for i in self.__present:
+            (p, s) = self.readers[i].position()
+            if position == None or p == None:
+                position = None
+            else:
+                position += p
+            if size == None or s == None:
+                size = None
+            else:
+                size += s
+        return (position, size)
+
+    def __checkNames(self, batch):
+        first = self.__present[0]
+        ids = [readId(read[0]) for read in batch[first]]
+        for i in self.__present[1:]:
+            other = [readId(read[0]) for read in batch[i]]
+            if other != ids:
+                for r in xrange(len(ids)):
+                    if ids[r] != other[r]:
+                        raise PairingError("read names don't match at record " + str(self.records + r + 1) + ": " +
+                            batch[first][r][0] + " in " + self.readers[first].filename + ", " +
+                            batch[i][r][0] + " in " + self.readers[i].filename)
+
+    def nextBatch(self):
+        for i in self.__present:
+            if len(self.__buffers[i]) == 0 and not self.__eof[i]:
+                reads = self.readers[i].nextBatch()
+                if reads == None:
+                    self.__eof[i] = True
+                else:
+                    self.__buffers[i] = reads
+
+        size = min([len(self.__buffers[i]) for i in self.__present])
+        if size == 0:
+            #some files are finished while others still have reads
+            ended = [self.readers[i].filename for i in self.__present if len(self.__buffers[i]) == 0]
+            if len(ended) < len(self.__present):
+                raise PairingError(", ".join(ended) + " ended after " + str(self.records) + " records, while other files have more reads, the input is truncated")
+            return None
+
+        batch = [None for r in self.readers]
+        for i in self.__present:
+            batch[i] = self.__buffers[i][0:size]
+            self.__buffers[i] = self.__buffers[i][size:]
+        if self.checkNames and len(self.__present) > 1:
+            self.__checkNames(batch)
+        self.records += size
+        return batch
+
+    #iterate the records as tuples of (read1, read2, index1, index2)
+    def reads(self):
+        empty = None
+        while True:
+            batch = self.nextBatch()
+            if batch == None:
+                return
+            size = len(batch[self.__present[0]])
+            if empty == None or len(empty) != size:
+                empty = [None] * size
+            columns = [reads if reads != None else empty for reads in batch]
+            for record in zip(*columns):
+                yield record
+
+################################
+#fastq.interleavedreader
+#splits an interleaved file, in which read1 and read2 of a pair are two successive records
+#mate(0) and mate(1) return the readers of read1 and read2, which can be given to PairedReader
+
+class InterleavedReader:
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.filename = reader.filename
+        self.__buffers = [[], []]
+        #the last record of a batch when the batch has an odd count of records
+        self.__carry = []
+        self.__eof = False
+
+    def __fill(self):
+        reads = self.reader.nextBatch()
+        if reads == None:
+            self.__eof = True
+            #an unpaired record at the end, PairedReader reports it as truncated
+            self.__buffers[0] += self.__carry
+            self.__carry = []
+            return
+        reads = self.__carry + reads
+        self.__carry = []
+        if len(reads) % 2 == 1:
+            self.__carry = reads[-1:]
+            del reads[-1]
+        self.__buffers[0] += reads[0::2]
+        self.__buffers[1] += reads[1::2]
+
+    def nextBatch(self, mate):
+        while len(self.__buffers[mate]) == 0 and not self.__eof:
+            self.__fill()
+        if len(self.__buffers[mate]) == 0:
+            return None
+        reads = self.__buffers[mate]
+        self.__buffers[mate] = []
+        return reads
+
+    def mate(self, mate):
+        return InterleavedMate(self, mate)
+
+    def position(self):
+        return self.reader.position()
+
+class InterleavedMate:
+
+    def __init__(self, interleaved, mate):
+        self.interleaved = interleaved
+        self.mate = mate
+        self.filename = interleaved.filename + " (read" + str(mate + 1) + ")"
+
+    def nextBatch(self):
+        return self.interleaved.nextBatch(self.mate)
+
+    #the file is counted once by read1, so the positions of the mates can be added up
+    def position(self):
+        if self.mate == 1:
+            return (0, 0)
+        return self.interleaved.position()
+
+################################
+#fastq.replayreader
+#reads the head of a stream ahead, and then returns the head again followed by the rest of the stream
+#so the head can be used for QC of a stream like stdin, which cannot be read twice
+
+class ReplayReader:
+
+    #count is the count of reads to read ahead, None means all reads
+    def __init__(self, reader, count):
+        self.reader = reader
+        self.filename = reader.filename
+        self.head = []
+        while count == None or len(self.head) < count:
+            reads = reader.nextBatch()
+            if reads == None:
+                break
+            self.head += reads
+        self.__replay = self.head
+
+    def nextBatch(self):
+        if len(self.__replay) > 0:
+            reads = self.__replay
+            self.__replay = []
+            return reads
+        return self.reader.nextBatch()
+
+    def position(self):
+        return self.reader.position()
+
+################################
+#parallel gzip compression
+#the data is cut into blocks, and each block is compressed as an independent gzip member by a thread pool
+#zlib releases the GIL when compressing, so the blocks are compressed concurrently
+#the members are written in order, and the concatenated members are still a valid gzip file
+
+#the size of uncompressed data in a gzip member
+GZIP_MEMBER_SIZE = 1024 * 1024
+
+def compressMember(data, level):
+    #wbits 31 means gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+class ParallelGzipFile:
+
+    def __init__(self, fname, level, pool, threads):
+        self.filename = fname
+        self.__level = level
+        self.__pool = pool
+        #limit the compressed blocks waiting to be written, so the memory is bounded
+        self.__maxPending = 2 * threads
+        self.__pending = deque()
+        self.__buffer = []
+        self.__bufferSize = 0
+        self.__members = 0
+        self.__file = open(fname, "wb")
+
+    def __submit(self):
+        data = "".join(self.__buffer)
+        self.__buffer = []
+        self.__bufferSize = 0
+        self.__pending.append(self.__pool.apply_async(compressMember, (data, self.__level)))
+        self.__members += 1
+        while len(self.__pending) > self.__maxPending:
+            self.__file.write(self.__pending.popleft().get())
+
+    def write(self, data):
+        self.__buffer.append(data)
+        self.__bufferSize += len(data)
+        if self.__bufferSize >= GZIP_MEMBER_SIZE:
+            self.__submit()
+
+    def flush(self):
+        if self.__bufferSize > 0:
+            self.__submit()
+        while len(self.__pending) > 0:
+            self.__file.write(self.__pending.popleft().get())
+        self.__file.flush()
+
+    def close(self):
+        if self.__file == None:
+            return
+        self.flush()
+        #an empty file is not a valid gzip file, so write an empty member
+        if self.__members == 0:
+            self.__file.write(compressMember("", self.__level))
+        self.__file.close()
+        self.__file = None
+
 ################################
 #fastq.writer
+#the reads are accumulated in a buffer, and written to the file when the buffer is full
+#so there is one write call for lots of reads, instead of one for each line
+
+#how many bytes to buffer before writing to the file
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 class Writer:
     
@@ -61,11 +664,22 @@ class Writer:
     __file = None
     __gz = False
     
-    def __init__(self, fname):
+    #compressLevel is used for .gz files
+    #if a thread pool is given, the .gz file is compressed by the threads of this pool
+    def __init__(self, fname, compressLevel = 9, pool = None, threads = 1, bufferSize = WRITE_BUFFER_SIZE):
         self.filename = fname
+        self.bufferSize = bufferSize
+        self.__buffer = []
+        self.__buffered = 0
         if self.filename.endswith(".gz"):
             self.__gz = True
-            self.__file = gzip.open(self.filename, "w")
+            if pool != None:
+                self.__file = ParallelGzipFile(self.filename, compressLevel, pool, threads)
+            else:
+                self.__file = gzip.open(self.filename, "w", compressLevel)
+        elif self.filename == STDIO:
+            self.__gz = False
+            self.__file = os.fdopen(os.dup(STDOUT_FD), "w")
         else:
             self.__gz = False
             self.__file = open(self.filename, "w")
@@ -74,29 +688,51 @@ class Writer:
             sys.exit(1)
             
     def __del__(self):
-        if self.__file != None:
-            self.__file.flush()
-            self.__file.close()
+        self.close()
+
+    def __write(self, data):
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        if self.__buffered >= self.bufferSize:
+            self.__writeBuffer()
+
+    def __writeBuffer(self):
+        if self.__buffered > 0:
+            self.__file.write("".join(self.__buffer))
+            self.__buffer = []
+            self.__buffered = 0
 
     def flush(self):
         if self.__file !=None:
+            self.__writeBuffer()
             self.__file.flush()
+
+    #the buffered reads are written when the writer is closed
+    #a writer should always be closed, instead of relying on __del__
+    def close(self):
+        if self.__file != None:
+            self.flush()
+            self.__file.close()
+            self.__file = None
  
     def writeLines(self, lines):
         if self.__file == None:
             return False
-            
-        for line in lines:
-            self.__file.write(line+"\n")
+        if len(lines) > 0:
+            self.__write("\n".join(lines) + "\n")
+        return True
+
+    def writeBatch(self, reads):
+        if self.__file == None:
+            return False
+        if len(reads) > 0:
+            self.__write("".join(["\n".join(read) + "\n" for read in reads]))
         return True
             
     def writeRead(self, name, seqence, strand, quality):
         if self.__file == None:
             return False
             
-        self.__file.write(name+"\n")
-        self.__file.write(seqence+"\n")
-        self.__file.write(strand+"\n")
-        self.__file.write(quality+"\n")
+        self.__write(name + "\n" + seqence + "\n" + strand + "\n" + quality + "\n")
         
         return True
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os,sys
+import struct
+from optparse import OptionParser
+import time
+
+#offset index of fastq files
+#the byte offset of every <interval> records is stored in a sidecar file <fastq>.fqi
+#so a reader can seek to any record directly, without reading everything before it
+#the sidecar is reused as long as the size and modification time of the fastq file are not changed
+
+INDEX_EXT = ".fqi"
+INDEX_MAGIC = "FQI1"
+#magic, interval, file size, file mtime, record count, offset count
+INDEX_HEADER = "<4sQQQQQ"
+DEFAULT_INTERVAL = 10000
+#the size of data to read from the file each time
+BLOCK_SIZE = 4 * 1024 * 1024
+#the size of data to count line breaks in one call
+COUNT_CHUNK_SIZE = 64 * 1024
+
+class FastqIndex:
+
+    def __init__(self, filename, interval, size, mtime, records, offsets):
+        self.filename = filename
+        self.interval = interval
+        self.size = size
+        self.mtime = mtime
+        self.records = records
+        self.offsets = offsets
+
+    def isValid(self):
+        st = os.stat(self.filename)
+        return st.st_size == self.size and int(st.st_mtime) == self.mtime
+
+    #returns the offset of the nearest indexed record before record, and how many reads to skip after it
+    def locate(self, record):
+        if record < 0 or record > self.records:
+            raise IndexError("record " + str(record) + " is out of range of " + self.filename)
+        if len(self.offsets) == 0:
+            return (0, 0)
+        i = min(record / self.interval, len(self.offsets) - 1)
+        return (self.offsets[i], record - i * self.interval)
+
+    #split the records into n ranges of (first record, record count, byte offset)
+    #the ranges start at indexed records, so each range can be reached by a seek
+    def ranges(self, n):
+        blocks = len(self.offsets)
+        n = max(1, min(n, blocks))
+        result = []
+        for i in xrange(n):
+            first = (blocks * i / n) * self.interval
+            last = min((blocks * (i+1) / n) * self.interval, self.records)
+            if last > first:
+                result.append((first, last - first, self.offsets[first / self.interval]))
+        return result
+
+    def save(self, indexFile):
+        f = open(indexFile, "wb")
+        f.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, self.interval, self.size, self.mtime, self.records, len(self.offsets)))
+        f.write(struct.pack("<" + str(len(self.offsets)) + "Q", *self.offsets))
+        f.close()
+
+def indexFileName(filename):
+    return filename + INDEX_EXT
+
+def loadIndex(filename):
+    indexFile = indexFileName(filename)
+    if not os.path.exists(indexFile):
+        return None
+    f = open(indexFile, "rb")
+    data = f.read()
+    f.close()
+    headerSize = struct.calcsize(INDEX_HEADER)
+    if len(data) < headerSize:
+        return None
+    magic, interval, size, mtime, records, count = struct.unpack(INDEX_HEADER, data[0:headerSize])
+    if magic != INDEX_MAGIC or len(data) != headerSize + 8 * count:
+        return None
+    offsets = list(struct.unpack("<" + str(count) + "Q", data[headerSize:]))
+    index = FastqIndex(filename, interval, size, mtime, records, offsets)
+    if not index.isValid():
+        return None
+    return index
+
+#move the reader to record, the reader must be opened on the indexed file
+def seekRecord(reader, index, record):
+    offset, skip = index.locate(record)
+    reader.seek(offset)
+    for i in xrange(skip):
+        if reader.nextRead() == None:
+            break
+
+#find the position after the n-th line break from start
+#returns (position, 0) if found, or (end of buffer, lines still needed) if the buffer has less line breaks
+def skipLines(buf, start, n):
+    size = len(buf)
+    pos = start
+    #skip the chunks by counting, then find the line breaks one by one in the last chunk
+    while n > 0 and pos < size:
+        end = min(pos + COUNT_CHUNK_SIZE, size)
+        count = buf.count("\n", pos, end)
+        if count < n:
+            n -= count
+            pos = end
+            continue
+        while n > 0:
+            pos = buf.find("\n", pos, end) + 1
+            n -= 1
+    return (pos, n)
+
+def buildIndex(filename, interval = DEFAULT_INTERVAL):
+    if filename.endswith(".gz"):
+        raise ValueError("cannot build offset index for compressed file " + filename)
+    st = os.stat(filename)
+    offsets = []
+    f = open(filename, "rb")
+    #the offset of the current block in the file
+    base = 0
+    lines = 0
+    lastChar = "\n"
+    #lines to skip before the next record to index
+    need = 0
+    while True:
+        data = f.read(BLOCK_SIZE)
+        if len(data) == 0:
+            break
+        pos = 0
+        while True:
+            if need == 0:
+                if pos >= len(data):
+                    break
+                offsets.append(base + pos)
+                need = 4 * interval
+            pos, need = skipLines(data, pos, need)
+            if need > 0:
+                break
+        lines += data.count("\n")
+        lastChar = data[-1]
+        base += len(data)
+    f.close()
+    #the last line may have no line break
+    if lastChar != "\n":
+        lines += 1
+    return FastqIndex(filename, interval, st.st_size, int(st.st_mtime), lines / 4, offsets)
+
+#reuse the sidecar index if it is still valid, otherwise build it and store it next to the fastq file
+def loadOrBuildIndex(filename, interval = DEFAULT_INTERVAL):
+    index = loadIndex(filename)
+    if index != None and index.interval == interval:
+        return index
+    index = buildIndex(filename, interval)
+    try:
+        index.save(indexFileName(filename))
+    except IOError:
+        print("Failed to write index file " + indexFileName(filename) + ", the index is not stored")
+    return index
+
+def parseCommand():
+    usage = "usage: %prog <fastq_files> [options]\n\nbuild offset index files (<fastq>.fqi) for uncompressed fastq files"
+    version = "%prog 1.0"
+    parser = OptionParser(usage = usage, version = version)
+    parser.add_option("-i", "--interval", dest = "interval", default = DEFAULT_INTERVAL, type = "int",
+        help = "store the offset of every <interval> records. Default is " + str(DEFAULT_INTERVAL))
+    parser.add_option("-f", "--force", dest = "force", action = "store_true", default = False,
+        help = "rebuild the index even if a valid one exists")
+    return parser.parse_args()
+
+def main():
+    (options, args) = parseCommand()
+    if len(args) == 0:
+        print("no fastq files specified, see -h for help")
+        sys.exit(1)
+    for filename in args:
+        time1 = time.time()
+        if options.force:
+            index = buildIndex(filename, options.interval)
+            index.save(indexFileName(filename))
+        else:
+            index = loadOrBuildIndex(filename, options.interval)
+        time2 = time.time()
+        print(filename + ": " + str(index.records) + " records, " + str(len(index.offsets)) + " offsets, " + "%.3f" % (time2-time1) + " s")
+
+if __name__  == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os,sys
+import time
+
+#the filters of seqFilter which only check a record are stages of a pipeline
+#a stage returns the flag of a bad record or None, and never changes the reads
+#barcode, trim and adapter trimming change the reads, so they always run before the stages
+#overlap and error correction are the most expensive and change the reads, so they always run after the stages
+
+#stage_order precedence runs the stages in the order of STAGE_PRECEDENCE, which is the order AfterQC always used,
+#so a record failing several stages is always flagged by the first of them in this list
+#stage_order adaptive runs the stage with the least cost per rejected record first, and reorders the stages as the
+#rejection rates are updated, the good reads are same, but a record failing several stages may get another flag
+#the records are split into windows by their number in the input, each window starts with the order of precedence
+#and is reordered by the rates of its own records only, so the flags only depend on the input,
+#not on how the records are split into batches or which process of filter_processes filters them
+STAGE_ORDERS = ("precedence", "adaptive")
+STAGE_PRECEDENCE = ("bubble", "length", "polyX", "low_quality", "too_many_N")
+
+#the stages are reordered after every REORDER_INTERVAL records of a window in adaptive mode
+REORDER_INTERVAL = 1000
+
+class FilterStage:
+
+    #cost is the estimated time to check a record, relative to the length check
+    #check(r1, r2, counts) returns a flag or None, counts are the precomputed counts of preprocesser.batchCounts or None
+    def __init__(self, name, cost, check):
+        self.name = name
+        self.cost = cost
+        self.check = check
+        self.precedence = STAGE_PRECEDENCE.index(name)
+        self.checked = 0
+        self.rejected = 0
+
+    #smoothed, so a stage which has checked no record is neither ruled in nor out
+    def rejectionRate(self):
+        return (self.rejected + 1.0) / (self.checked + 2.0)
+
+    #the expected cost to reject a record by this stage
+    def score(self):
+        return self.cost / self.rejectionRate()
+
+class StagePipeline:
+
+    #stages can be in any order, they are sorted by precedence first
+    #window is the records of a window in adaptive mode, all records of a window must be run by this pipeline in order,
+    #the chunks of parallel filtering are split at the windows for this
+    def __init__(self, stages, order, window):
+        if order not in STAGE_ORDERS:
+            raise ValueError("stage_order should be precedence or adaptive, got " + order)
+        self.stages = sorted(stages, key = lambda stage: stage.precedence)
+        self.adaptive = order == "adaptive"
+        self.window = window
+        self.currentWindow = -1
+        self.records = 0
+
+    #returns the flag of the first stage rejecting the record, or None if it passes all stages
+    #recordNumber is the number of the record in the input starting from 1
+    #stageCounts is a dict of stage name -> [checked, rejected] for the report
+    #perf is the perfstats.Performance to time the stages of this record, or None if it is not sampled
+    def run(self, r1, r2, counts, recordNumber, stageCounts, perf = None):
+        if self.adaptive:
+            self.advance(recordNumber)
+        for stage in self.stages:
+            stage.checked += 1
+            if perf != None:
+                time1 = time.time()
+                flag = stage.check(r1, r2, counts)
+                perf.sample("filter." + stage.name, time.time() - time1)
+            else:
+                flag = stage.check(r1, r2, counts)
+            stageCount = stageCounts.setdefault(stage.name, [0, 0])
+            stageCount[0] += 1
+            if flag != None:
+                stage.rejected += 1
+                stageCount[1] += 1
+                return flag
+        return None
+
+    #start again from the order of precedence at a new window, and reorder every REORDER_INTERVAL records of the window
+    def advance(self, recordNumber):
+        window = (recordNumber - 1) / self.window
+        if window != self.currentWindow:
+            self.currentWindow = window
+            self.records = 0
+            for stage in self.stages:
+                stage.checked = 0
+                stage.rejected = 0
+            self.stages.sort(key = lambda stage: stage.precedence)
+        self.records += 1
+        if self.records % REORDER_INTERVAL == 0:
+            self.reorder()
+
+    #the ties are broken by precedence, so the order only depends on the records checked in the window
+    def reorder(self):
+        self.stages.sort(key = lambda stage: (stage.score(), stage.precedence))
+
+    def order(self):
+        return [stage.name for stage in self.stages]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import os,sys
+import json
+
+#sharded output of good reads
+#the good reads are written into several shard files, so they can be aligned in parallel without splitting them again
+#roundrobin:N writes the records to N shards in turn, count:M starts a new shard every M records
+#the shards of read1/read2/index1/index2 always contain the same records in the same order
+
+SHARD_POLICIES = ("none", "roundrobin", "count")
+
+#returns (policy, number), raises ValueError for an invalid policy
+def parsePolicy(policy):
+    if policy == "none":
+        return ("none", 0)
+    name, sep, number = policy.partition(":")
+    if name not in SHARD_POLICIES or sep == "":
+        raise ValueError("good_shards should be none, roundrobin:N or count:M, got " + policy)
+    try:
+        number = int(number)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise ValueError("the number of good_shards should be a positive number, like roundrobin:8 or count:1000000")
+    return (name, number)
+
+def shardKind(shard):
+    return "good.shard%04d" % (shard + 1)
+
+class ShardedOutput:
+
+    #files are the input files of read1, read2, index1 and index2, None if absent
+    #openWriter(filename, kind) opens the writer of an input file, kind is like good.shard0001
+    #writeReads(r1, r2, i1, i2, r1_file, r2_file, i1_file, i2_file, flag) writes a record
+    def __init__(self, policy, files, openWriter, writeReads):
+        self.policy, self.number = parsePolicy(policy)
+        self.files = files
+        self.openWriter = openWriter
+        self.writeReads = writeReads
+        #writers of each shard, [r1, r2, i1, i2]
+        self.shards = []
+        self.counts = []
+        #the file names of the shards, which are in the same folder as the manifest
+        self.paths = []
+        self.records = 0
+        if self.policy == "roundrobin":
+            for shard in xrange(self.number):
+                self.__openShard(shard)
+
+    def __openShard(self, shard):
+        writers = []
+        for i in xrange(len(self.files)):
+            if self.files[i] == None:
+                writers.append(None)
+            elif i == 1 and self.files[1] == self.files[0]:
+                #read2 of an interleaved file is written to the same shard file as read1
+                writers.append(writers[0])
+            else:
+                writers.append(self.openWriter(self.files[i], shardKind(shard)))
+        self.shards.append(writers)
+        self.counts.append(0)
+        self.paths.append([os.path.basename(w.filename) if w != None else None for w in writers])
+
+    def write(self, r1, r2, i1, i2):
+        if self.policy == "roundrobin":
+            shard = self.records % self.number
+        else:
+            shard = self.records / self.number
+            if shard >= len(self.shards):
+                #the last shard is full, only one shard is open at a time
+                if len(self.shards) > 0:
+                    self.__closeShard(len(self.shards) - 1)
+                self.__openShard(shard)
+        w = self.shards[shard]
+        self.writeReads(r1, r2, i1, i2, w[0], w[1], w[2], w[3], None)
+        self.counts[shard] += 1
+        self.records += 1
+
+    def __closeShard(self, shard):
+        for w in self.shards[shard]:
+            if w != None:
+                w.close()
+
+    def close(self):
+        for shard in xrange(len(self.shards)):
+            self.__closeShard(shard)
+
+    #list the shards and their record counts in a json file
+    def writeManifest(self, filename):
+        names = ("read1", "read2", "index1", "index2")
+        shards = []
+        for shard in xrange(len(self.shards)):
+            item = {}
+            item["reads"] = self.counts[shard]
+            for i in xrange(len(names)):
+                if self.paths[shard][i] != None:
+                    item[names[i]] = self.paths[shard][i]
+            shards.append(item)
+        manifest = {}
+        manifest["policy"] = self.policy + ":" + str(self.number)
+        manifest["total_reads"] = self.records
+        manifest["shards"] = shards
+        f = open(filename, "w")
+        f.write(json.dumps(manifest, sort_keys=True,indent=4, separators=(',', ': ')))
+        f.close()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+import os,sys
+import gzip
+import struct
+import zlib
+from ctypes import *
+from ctypes.util import find_library
+from optparse import OptionParser
+import time
+from fastqindex import skipLines
+
+#checkpoint index of .gz fastq files, like zran.c of zlib
+#while the file is decompressed, a checkpoint is stored at a deflate block boundary every <span> bytes of output
+#a checkpoint has the compressed/uncompressed offsets and the 32K window of the decompressor at that point,
+#and the record number and the offset of the first fastq record after it
+#so the decompression can be resumed from any checkpoint, without recompressing the file as BGZF
+#python zlib module cannot prime bits or set the window of a raw inflate stream, so libz is called with ctypes
+
+INDEX_EXT = ".gzri"
+INDEX_MAGIC = "GZR1"
+#magic, span, file size, file mtime, record count, checkpoint count
+INDEX_HEADER = "<4sQQQQQ"
+#compressed offset, bits, uncompressed offset, record, skip, window size
+POINT_HEADER = "<QBQQQI"
+DEFAULT_SPAN = 32 * 1024 * 1024
+WINDOW_SIZE = 32768
+INPUT_CHUNK = 64 * 1024
+OUTPUT_CHUNK = 1024 * 1024
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+
+class ZStream(Structure):
+    _fields_ = [("next_in", c_void_p), ("avail_in", c_uint), ("total_in", c_ulong),
+        ("next_out", c_void_p), ("avail_out", c_uint), ("total_out", c_ulong),
+        ("msg", c_char_p), ("state", c_void_p),
+        ("zalloc", c_void_p), ("zfree", c_void_p), ("opaque", c_void_p),
+        ("data_type", c_int), ("adler", c_ulong), ("reserved", c_ulong)]
+
+ZLIB_LOADED = False
+try:
+    libz = cdll.LoadLibrary(find_library("z"))
+    libz.zlibVersion.restype = c_char_p
+    ZLIB_VERSION = libz.zlibVersion()
+    libz.inflateGetDictionary
+except Exception:
+    ZLIB_LOADED = False
+else:
+    ZLIB_LOADED = True
+
+class Checkpoint:
+
+    def __init__(self, inOffset, bits, outOffset, window, record = -1, skip = 0):
+        self.inOffset = inOffset
+        self.bits = bits
+        self.outOffset = outOffset
+        self.window = window
+        #the first record after this checkpoint, and the bytes before it
+        self.record = record
+        self.skip = skip
+
+class InflateStream:
+
+    #wbits is 31 for gzip stream, and -15 for raw deflate stream
+    def __init__(self, fileobj, wbits):
+        self.strm = None
+        self.file = fileobj
+        if not ZLIB_LOADED:
+            raise IOError("libz is not loaded, cannot use gzip checkpoint index")
+        self.strm = ZStream()
+        self.raw = wbits < 0
+        self.inbuf = create_string_buffer(INPUT_CHUNK)
+        self.outbuf = create_string_buffer(OUTPUT_CHUNK)
+        self.check(libz.inflateInit2_(byref(self.strm), wbits, ZLIB_VERSION, sizeof(self.strm)))
+
+    def check(self, ret):
+        if ret < 0 and ret != Z_BUF_ERROR or ret == Z_NEED_DICT:
+            raise IOError("Failed to decompress file " + self.file.name + ", zlib error " + str(ret))
+        return ret
+
+    #returns False if there is no more input
+    def fill(self):
+        if self.strm.avail_in > 0:
+            return True
+        data = self.file.read(INPUT_CHUNK)
+        if len(data) == 0:
+            return False
+        memmove(self.inbuf, data, len(data))
+        self.strm.next_in = addressof(self.inbuf)
+        self.strm.avail_in = len(data)
+        return True
+
+    #returns (zlib return code, consumed input, output)
+    def inflate(self, flush, outSize = OUTPUT_CHUNK):
+        availIn = self.strm.avail_in
+        self.strm.next_out = addressof(self.outbuf)
+        self.strm.avail_out = outSize
+        ret = self.check(libz.inflate(byref(self.strm), flush))
+        produced = outSize - self.strm.avail_out
+        return (ret, availIn - self.strm.avail_in, string_at(self.outbuf, produced))
+
+    #a gzip file can have several members, continue with next member if there is more input
+    #returns the count of input bytes skipped
+    def nextMember(self):
+        skipped = 0
+        #raw stream doesn't read the gzip trailer (crc32 and size)
+        if self.raw:
+            while skipped < 8 and self.fill():
+                n = min(8 - skipped, self.strm.avail_in)
+                self.strm.next_in += n
+                self.strm.avail_in -= n
+                skipped += n
+            self.raw = False
+        if not self.fill():
+            return -1
+        self.check(libz.inflateReset2(byref(self.strm), 31))
+        return skipped
+
+    def getWindow(self):
+        window = create_string_buffer(WINDOW_SIZE)
+        size = c_uint(0)
+        self.check(libz.inflateGetDictionary(byref(self.strm), window, byref(size)))
+        return string_at(window, size.value)
+
+    def close(self):
+        if self.strm != None:
+            libz.inflateEnd(byref(self.strm))
+            self.strm = None
+        self.file.close()
+
+    def __del__(self):
+        if self.strm != None:
+            libz.inflateEnd(byref(self.strm))
+            self.strm = None
+
+class CheckpointStream:
+
+    #a file-like object, which returns the decompressed data from the first record after the checkpoint
+    def __init__(self, filename, point):
+        self.name = filename
+        f = open(filename, "rb")
+        self.__stream = InflateStream(f, -15)
+        strm = self.__stream.strm
+        if point.bits > 0:
+            f.seek(point.inOffset - 1)
+            c = ord(f.read(1))
+            self.__stream.check(libz.inflatePrime(byref(strm), point.bits, c >> (8 - point.bits)))
+        else:
+            f.seek(point.inOffset)
+        if len(point.window) > 0:
+            window = point.window
+            self.__stream.check(libz.inflateSetDictionary(byref(strm), window, len(window)))
+        self.__skip = point.skip
+        self.__eof = False
+
+    def __readChunk(self, size):
+        while not self.__eof:
+            hasInput = self.__stream.fill()
+            ret, consumed, data = self.__stream.inflate(Z_NO_FLUSH, min(size, OUTPUT_CHUNK))
+            if ret == Z_STREAM_END:
+                if self.__stream.nextMember() < 0:
+                    self.__eof = True
+            elif len(data) == 0 and not hasInput:
+                raise IOError("Unexpected end of file " + self.name)
+            if len(data) > 0:
+                return data
+        return ""
+
+    def read(self, size = OUTPUT_CHUNK):
+        if size < 0:
+            size = OUTPUT_CHUNK
+        while self.__skip > 0:
+            data = self.__readChunk(self.__skip)
+            if len(data) == 0:
+                return ""
+            self.__skip -= len(data)
+        return self.__readChunk(size)
+
+    def close(self):
+        self.__stream.close()
+
+class GzipIndex:
+
+    def __init__(self, filename, span, size, mtime, records, points):
+        self.filename = filename
+        self.span = span
+        self.size = size
+        self.mtime = mtime
+        self.records = records
+        self.points = points
+
+    def isValid(self):
+        st = os.stat(self.filename)
+        return st.st_size == self.size and int(st.st_mtime) == self.mtime
+
+    #returns the last checkpoint at or before record
+    def locate(self, record):
+        if record < 0 or record > self.records:
+            raise IndexError("record " + str(record) + " is out of range of " + self.filename)
+        found = None
+        for point in self.points:
+            if point.record > record:
+                break
+            found = point
+        return found
+
+    #split the records into n ranges of (first record, record count), which start at checkpoints
+    def ranges(self, n):
+        starts = sorted(set([0] + [p.record for p in self.points if p.record < self.records]))
+        n = max(1, min(n, len(starts)))
+        result = []
+        for i in xrange(n):
+            first = starts[len(starts) * i / n]
+            if i == n - 1:
+                last = self.records
+            else:
+                last = starts[len(starts) * (i+1) / n]
+            if last > first:
+                result.append((first, last - first))
+        return result
+
+    def save(self, indexFile):
+        f = open(indexFile, "wb")
+        f.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, self.span, self.size, self.mtime, self.records, len(self.points)))
+        for p in self.points:
+            window = zlib.compress(p.window)
+            f.write(struct.pack(POINT_HEADER, p.inOffset, p.bits, p.outOffset, p.record, p.skip, len(window)))
+            f.write(window)
+        f.close()
+
+def indexFileName(filename):
+    return filename + INDEX_EXT
+
+def loadIndex(filename):
+    indexFile = indexFileName(filename)
+    if not os.path.exists(indexFile):
+        return None
+    f = open(indexFile, "rb")
+    data = f.read()
+    f.close()
+    headerSize = struct.calcsize(INDEX_HEADER)
+    pointSize = struct.calcsize(POINT_HEADER)
+    try:
+        magic, span, size, mtime, records, count = struct.unpack(INDEX_HEADER, data[0:headerSize])
+        if magic != INDEX_MAGIC:
+            return None
+        points = []
+        pos = headerSize
+        for i in xrange(count):
+            inOffset, bits, outOffset, record, skip, windowSize = struct.unpack(POINT_HEADER, data[pos:pos+pointSize])
+            pos += pointSize
+            window = zlib.decompress(data[pos:pos+windowSize])
+            pos += windowSize
+            points.append(Checkpoint(inOffset, bits, outOffset, window, record, skip))
+    except (struct.error, zlib.error):
+        return None
+    index = GzipIndex(filename, span, size, mtime, records, points)
+    if not index.isValid():
+        return None
+    return index
+
+def buildIndex(filename, span = DEFAULT_SPAN):
+    st = os.stat(filename)
+    stream = InflateStream(open(filename, "rb"), 31)
+    points = []
+    #checkpoints waiting for the line break before their first record
+    pending = []
+    totalIn = 0
+    totalOut = 0
+    lastOut = 0
+    lines = 0
+    lastChar = "\n"
+    while True:
+        hasInput = stream.fill()
+        ret, consumed, data = stream.inflate(Z_BLOCK)
+        if ret != Z_STREAM_END and len(data) == 0 and not hasInput:
+            raise IOError("Unexpected end of file " + filename)
+        totalIn += consumed
+        if len(data) > 0:
+            newLines = data.count("\n")
+            #the first record after a pending checkpoint starts after line break <need>
+            while len(pending) > 0 and pending[0][1] <= lines + newLines:
+                point, need = pending.pop(0)
+                pos, remain = skipLines(data, 0, need - lines)
+                point.skip = totalOut + pos - point.outOffset
+            lines += newLines
+            lastChar = data[-1]
+            totalOut += len(data)
+        if ret == Z_STREAM_END:
+            skipped = stream.nextMember()
+            if skipped < 0:
+                break
+            totalIn += skipped
+            continue
+        #bit 128 means the end of a deflate block header, bit 64 means it's the last block
+        dataType = stream.strm.data_type
+        if (dataType & 128) and not (dataType & 64) and (len(points) == 0 or totalOut - lastOut > span):
+            point = Checkpoint(totalIn, dataType & 7, totalOut, stream.getWindow())
+            points.append(point)
+            lastOut = totalOut
+            if lines % 4 == 0 and lastChar == "\n":
+                point.record = lines / 4
+            else:
+                point.record = lines / 4 + 1
+                pending.append((point, 4 * point.record))
+    stream.close()
+    #the last line may have no line break
+    if lastChar != "\n":
+        lines += 1
+    records = lines / 4
+    #drop the checkpoints after the last record
+    points = [p for p in points if p.record < records and (p, 4 * p.record) not in pending]
+    return GzipIndex(filename, span, st.st_size, int(st.st_mtime), records, points)
+
+#reuse the sidecar index if it is still valid, otherwise build it and store it next to the .gz file
+def loadOrBuildIndex(filename, span = DEFAULT_SPAN):
+    index = loadIndex(filename)
+    if index != None and index.span == span:
+        return index
+    index = buildIndex(filename, span)
+    try:
+        index.save(indexFileName(filename))
+    except IOError:
+        print("Failed to write index file " + indexFileName(filename) + ", the index is not stored")
+    return index
+
+#move a fastq.BlockReader of the indexed .gz file to record
+def seekRecord(reader, index, record):
+    point = index.locate(record)
+    skip = record
+    if point != None:
+        reader.resume(CheckpointStream(index.filename, point))
+        skip = record - point.record
+    else:
+        reader.resume(gzip.open(index.filename, "rb"))
+    for i in xrange(skip):
+        if reader.nextRead() == None:
+            break
+
+def parseCommand():
+    usage = "usage: %prog <fastq.gz files> [options]\n\nbuild gzip checkpoint index files (<fastq.gz>" + INDEX_EXT + ") for .gz fastq files"
+    version = "%prog 1.0"
+    parser = OptionParser(usage = usage, version = version)
+    parser.add_option("-s", "--span", dest = "span", default = DEFAULT_SPAN, type = "int",
+        help = "store a checkpoint every <span> bytes of decompressed data. Default is " + str(DEFAULT_SPAN))
+    parser.add_option("-f", "--force", dest = "force", action = "store_true", default = False,
+        help = "rebuild the index even if a valid one exists")
+    return parser.parse_args()
+
+def main():
+    (options, args) = parseCommand()
+    if len(args) == 0:
+        print("no .gz files specified, see -h for help")
+        sys.exit(1)
+    for filename in args:
+        time1 = time.time()
+        if options.force:
+            index = buildIndex(filename, options.span)
+            index.save(indexFileName(filename))
+        else:
+            index = loadOrBuildIndex(filename, options.span)
+        time2 = time.time()
+        print(filename + ": " + str(index.records) + " records, " + str(len(index.points)) + " checkpoints, " + "%.3f" % (time2-time1) + " s")
+
+if __name__  == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import os,sys
+import time
+import functools
+
+#the wall time, calls and reads in/out of the stages of a run, reported as the performance section of after.json
+#the stages which run once or once per batch are always timed
+#the stages which run once per read are timed only in one of every SAMPLE_INTERVAL records, so the overhead is small,
+#their calls and reads are exact, and their time is estimated from the timed calls
+SAMPLE_INTERVAL = 64
+
+def isSampled(recordNumber):
+    return recordNumber % SAMPLE_INTERVAL == 0
+
+class StageStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.timedCalls = 0
+        self.seconds = 0.0
+        self.readsIn = 0
+        self.readsOut = 0
+
+    #the time of all calls, estimated from the timed calls
+    def estimatedSeconds(self):
+        if self.timedCalls == 0 or self.timedCalls == self.calls:
+            return self.seconds
+        return self.seconds * self.calls / self.timedCalls
+
+class Performance:
+
+    def __init__(self):
+        #stage name -> StageStats
+        self.stages = {}
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return self.stages[name]
+
+    #a call of a stage which is always timed
+    def add(self, name, seconds, readsIn = 0, readsOut = 0):
+        s = self.stage(name)
+        s.calls += 1
+        s.timedCalls += 1
+        s.seconds += seconds
+        s.readsIn += readsIn
+        s.readsOut += readsOut
+
+    #a timed call of a per-read stage, its calls and reads are set by setCounts
+    def sample(self, name, seconds):
+        s = self.stage(name)
+        s.timedCalls += 1
+        s.seconds += seconds
+
+    def setCounts(self, name, calls, readsOut):
+        s = self.stage(name)
+        s.calls = calls
+        s.readsIn = calls
+        s.readsOut = readsOut
+
+    def merge(self, other):
+        for name, o in other.stages.items():
+            s = self.stage(name)
+            s.calls += o.calls
+            s.timedCalls += o.timedCalls
+            s.seconds += o.seconds
+            s.readsIn += o.readsIn
+            s.readsOut += o.readsOut
+
+    def summary(self):
+        stages = {}
+        for name, s in self.stages.items():
+            item = {}
+            item['calls'] = s.calls
+            item['timed_calls'] = s.timedCalls
+            item['seconds'] = round(s.estimatedSeconds(), 6)
+            item['reads_in'] = s.readsIn
+            item['reads_out'] = s.readsOut
+            stages[name] = item
+        result = {}
+        result['sample_interval'] = SAMPLE_INTERVAL
+        result['stages'] = stages
+        return result
+
+#the performance of the current run of this process, seqFilter.run starts a new one
+RUN = Performance()
+
+def reset():
+    global RUN
+    RUN = Performance()
+
+#decorate a method to time all its calls as a stage of RUN
+#reads(self) returns the count of reads the object has processed, the difference is recorded as reads in/out
+def timed(name, reads = None):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            readsBefore = 0
+            if reads != None:
+                readsBefore = reads(self)
+            time1 = time.time()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                time2 = time.time()
+                count = 0
+                if reads != None:
+                    count = reads(self) - readsBefore
+                RUN.add(name, time2 - time1, count, count)
+        return wrapper
+    return decorate
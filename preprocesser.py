@@ -5,18 +5,37 @@ import re
 from optparse import OptionParser
 import time
 import fastq
+import readbatch
 import util
+import seqkernel
 import barcodeprocesser
+import adaptertrim
+import badsink
+import batchkernels
+import filterstages
+import perfstats
+import progress
+import goodshards
 import json
+from multiprocessing import Pool, Process, Queue
+from Queue import Empty
+from multiprocessing.pool import ThreadPool
+from collections import deque
 from qualitycontrol import QualityControl
 from qcreporter import QCReporter
 
 def getMainName(filename):
+    if filename == fastq.STDIO:
+        return "stdin"
     baseName = os.path.basename(filename)
     mainName = baseName.replace(".fastq", "").replace(".fq", "").replace(".gz", "")
     return mainName
 
 def trim(read, front, tail):
+    #a read of a ReadBatch is trimmed by moving its offsets, no string is copied
+    if isinstance(read, readbatch.BatchRead):
+        read.trim(front, tail)
+        return read
     if tail>0:
         #\n will be trimmed, so add it back
         read[1] = read[1][front:-tail]
@@ -27,12 +46,45 @@ def trim(read, front, tail):
         
     return read
     
+POLY_BASES = ("A", "T", "C", "G", "a", "t", "c", "g", "N")
+
+#(maxPoly, mismatch) -> the runs which a read must contain to have a polyX, None if any read can have one
+POLY_RUNS = {}
+
+#a window of maxPoly bases with at least maxPoly - mismatch same bases has at most mismatch other bases,
+#which split the same bases into at most mismatch + 1 runs, so one run is at least ceil((maxPoly - mismatch) / (mismatch + 1)) long
+def polyRuns(maxPoly, mismatch):
+    key = (maxPoly, mismatch)
+    if key not in POLY_RUNS:
+        runs = None
+        if mismatch >= 0:
+            same = maxPoly - mismatch
+            #ceil(same / (mismatch + 1))
+            runLen = (same + mismatch) / (mismatch + 1)
+            if runLen > 1:
+                runs = [base * runLen for base in POLY_BASES]
+        POLY_RUNS[key] = runs
+    return POLY_RUNS[key]
+
+#most reads have no long run of a base, they are ruled out by a few substring searches before the exact check
 def hasPolyX(seq, maxPoly, mismatch):
+    if(len(seq)<maxPoly):
+        return None
+    runs = polyRuns(maxPoly, mismatch)
+    if runs != None:
+        for run in runs:
+            if run in seq:
+                break
+        else:
+            return None
+    return hasPolyXExact(seq, maxPoly, mismatch)
+
+def hasPolyXExact(seq, maxPoly, mismatch):
     if(len(seq)<maxPoly):
         return None
     
     polyCount = {}
-    polyArray = ("A", "T", "C", "G", "a", "t", "c", "g", "N")
+    polyArray = POLY_BASES
     for poly in polyArray: polyCount[poly] = 0
     
     for x in xrange(len(seq)):
@@ -68,6 +120,8 @@ def lowQualityNum(read, qual):
     return lowQualNum
     
 def nNumber(read):
+    if isinstance(read, readbatch.BatchRead):
+        return read.count(1, 'N')
     seqStr = read[1]
     nNum = 0
     for s in seqStr:
@@ -118,16 +172,184 @@ def makeDict(opt):
         'bad_output_folder': opt.bad_output_folder,
         'qc_only': opt.qc_only,
         'qc_sample': opt.qc_sample,
-        'qc_kmer': opt.qc_kmer
+        'qc_kmer': opt.qc_kmer,
+        'decompressor': opt.decompressor,
+        'compression_level': opt.compression_level,
+        'compression_threads': opt.compression_threads,
+        'mmap': opt.mmap,
+        'pair_name_check': opt.pair_name_check,
+        'compact_reads': opt.compact_reads,
+        'interleaved': opt.interleaved,
+        'good_output_file': opt.good_output_file,
+        'bad_sink': opt.bad_sink,
+        'good_shards': opt.good_shards,
+        'filter_processes': opt.filter_processes,
+        'filter_order': opt.filter_order,
+        'stage_order': opt.stage_order,
+        'overlap_engine': opt.overlap_engine,
+        'adapter_trim': opt.adapter_trim,
+        'adapter_fasta': opt.adapter_fasta,
+        'adapter_min_partial': opt.adapter_min_partial,
+        'progress_interval': opt.progress_interval,
+        'jobs': opt.jobs,
+        'memory_budget': opt.memory_budget
     }
     return d
     
 ########################### seqFilter
+#the count of records in a chunk of parallel filtering, and in a window of stage_order adaptive
+FILTER_CHUNK_SIZE = 5000
+FILTER_COUNTERS = ("TOTAL_BASES", "GOOD_BASES", "TOTAL_READS", "GOOD_READS", "BADBCD1", "BADBCD2", "BADTRIM1", "BADTRIM2",
+    "BADBBL", "BADLEN", "BADPOL", "BADLQC", "BADNCT", "BADOL", "BADINDEL", "BADMISMATCH", "BASE_CORRECTED", "OVERLAPPED", "OVERLAP_LEN_SUM", "POSTFILTER_QC_READS",
+    "ADAPTER_READS", "ADAPTER_BASES", "ADAPTER_PARTIAL", "ADAPTER_SHORT")
+
+#the counters, histograms and post-filter QC of filtering
+#each chunk of parallel filtering has its own FilterStats, which are merged into one
+class FilterStats:
+
+    def __init__(self, readLen, qc_sample, qc_kmer):
+        self.counters = {}
+        for name in FILTER_COUNTERS:
+            self.counters[name] = 0
+        self.overlap_histgram = [0 for x in xrange(readLen+1)]
+        self.distance_histgram = [0 for x in xrange(readLen+1)]
+        self.r1qc = QualityControl(qc_sample, qc_kmer)
+        self.r2qc = QualityControl(qc_sample, qc_kmer)
+        #stage name -> [checked, rejected] of the filter stages
+        self.stages = {}
+        #adapter name -> count of reads trimmed at it
+        self.adapters = {}
+        self.perf = perfstats.Performance()
+
+    def merge(self, other):
+        for name in FILTER_COUNTERS:
+            self.counters[name] += other.counters[name]
+        for i in xrange(len(self.overlap_histgram)):
+            self.overlap_histgram[i] += other.overlap_histgram[i]
+            self.distance_histgram[i] += other.distance_histgram[i]
+        self.r1qc.merge(other.r1qc)
+        self.r2qc.merge(other.r2qc)
+        for name, (checked, rejected) in other.stages.items():
+            stageCount = self.stages.setdefault(name, [0, 0])
+            stageCount[0] += checked
+            stageCount[1] += rejected
+        for name, count in other.adapters.items():
+            self.adapters[name] = self.adapters.get(name, 0) + count
+        self.perf.merge(other.perf)
+
+#reads from BlockReader(compact) or MmapReader are views of a buffer, they are sent to the workers as lists
+def toLists(reads):
+    return [r if type(r) == list else list(r) for r in reads]
+
+#the seqFilter of a worker process of parallel filtering
+workerFilter = None
+
+def initWorker(options):
+    global workerFilter
+    workerFilter = seqFilter(options)
+    if options.debubble:
+        workerFilter.loadBubbleCircles()
+
+def filterChunk(args):
+    (first, columns, readLen) = args
+    options = workerFilter.options
+    stats = FilterStats(readLen, options.qc_sample, options.qc_kmer)
+    size = max([len(reads) for reads in columns if reads != None])
+    r1s, r2s, i1s, i2s = [reads if reads != None else [None] * size for reads in columns]
+    time1 = time.time()
+    results = workerFilter.filterBatch(r1s, r2s, i1s, i2s, stats, first + 1)
+    stats.perf.add("filter", time.time() - time1, size, size)
+    return (first, columns, results, stats)
+
+#the chunks of parallel filtering, as lists of the reads of read1, read2, index1 and index2 (None for a missing file)
+#the k-th chunk always has the records from k * FILTER_CHUNK_SIZE + 1, so a window of stage_order adaptive is in one chunk
+#the records after the last full chunk of a batch of the reader are carried to the next batch
+def alignedChunks(pairedReader):
+    carry = None
+    while True:
+        time1 = time.time()
+        batch = pairedReader.nextBatch()
+        if batch == None:
+            break
+        size = max([len(reads) for reads in batch if reads != None])
+        perfstats.RUN.add("input.read", time.time() - time1, size, size)
+        columns = [toLists(reads) if reads != None else None for reads in batch]
+        if carry != None:
+            columns = [carry[i] + columns[i] if columns[i] != None else None for i in xrange(len(columns))]
+            size = max([len(reads) for reads in columns if reads != None])
+        start = 0
+        while size - start >= FILTER_CHUNK_SIZE:
+            yield [reads[start:start + FILTER_CHUNK_SIZE] if reads != None else None for reads in columns]
+            start += FILTER_CHUNK_SIZE
+        carry = None
+        if start < size:
+            carry = [reads[start:] if reads != None else None for reads in columns]
+    if carry != None:
+        yield carry
+
+#returns the result of the first chunk if ordered, otherwise any finished chunk
+def nextFinished(pending, ordered):
+    if ordered:
+        return pending.popleft().get()
+    while True:
+        for result in pending:
+            if result.ready():
+                pending.remove(result)
+                return result.get()
+        pending[0].wait(0.01)
+
+#seconds to wait for the result of a child process before checking if it is alive
+STAT_READS_POLL = 1.0
+
+#stat reads by a QualityControl in a child process, so it runs in parallel with the parent
+#the child gets the reads by fork, and sends back the QualityControl with the stats and the performance of the child
+def statReadsWorker(qc, reads, queue):
+    perfstats.reset()
+    try:
+        qc.statReads(reads)
+    except:
+        queue.put(None)
+        raise
+    queue.put((qc, perfstats.RUN))
+
+def startStatReads(qc, reads):
+    queue = Queue()
+    process = Process(target = statReadsWorker, args = (qc, reads, queue))
+    process.start()
+    return (process, queue)
+
+#wait for the result of the child, and check if it is still alive every STAT_READS_POLL seconds
+#a child killed by a signal or the OOM killer sends nothing, so the parent would wait forever
+def finishStatReads(job):
+    (process, queue) = job
+    while True:
+        try:
+            result = queue.get(timeout = STAT_READS_POLL)
+            break
+        except Empty:
+            if process.is_alive():
+                continue
+            #the result can be sent just before the child exits
+            try:
+                result = queue.get(timeout = STAT_READS_POLL)
+                break
+            except Empty:
+                process.join()
+                raise Exception("Failed to stat the reads in child process, exit code " + str(process.exitcode))
+    process.join()
+    if result == None:
+        raise Exception("Failed to stat the reads in child process, exit code " + str(process.exitcode))
+    (qc, perf) = result
+    perfstats.RUN.merge(perf)
+    return qc
+
 class seqFilter:
     
     #opt is an object contains lots of parameters
-    def __init__(self, opt):
+    #the progress is sent to progressQueue if it is not None, see progress.ProgressReporter
+    def __init__(self, opt, progressQueue = None):
         self.options = opt
+        self.progressQueue = progressQueue
         self.bubbleCircles = {}
         self.bubbleTiles = []
         
@@ -138,6 +360,29 @@ class seqFilter:
             self.hasIndex = True
 
         self.pattern = re.compile(r'\S+\:\d+\:\S+\:\d+\:\d+\:\d+\:\d+')
+        self.pipeline = self.makePipeline()
+        self.overlap = util.overlapEngine(self.options.overlap_engine)
+        self.adapterTrimmer = None
+        adapters = adaptertrim.loadAdapters(self.options.adapter_trim, self.options.adapter_fasta)
+        if len(adapters) > 0:
+            self.adapterTrimmer = adaptertrim.AdapterTrimmer(adapters, self.options.adapter_min_partial)
+
+    #the stages of the enabled filters, the costs are relative to the length check
+    #the low quality and N counts are precomputed by batchkernels if numpy is available
+    def makePipeline(self):
+        countCost = 1.0
+        if not batchkernels.HAVE_NUMPY:
+            countCost = 20.0
+        stages = [filterstages.FilterStage("length", 1.0, self.checkLength)]
+        if self.options.debubble:
+            stages.append(filterstages.FilterStage("bubble", 10.0, self.checkBubble))
+        if self.options.poly_size_limit > 0:
+            stages.append(filterstages.FilterStage("polyX", 5.0, self.checkPolyX))
+        if self.options.unqualified_base_limit > 0:
+            stages.append(filterstages.FilterStage("low_quality", countCost, self.checkLowQuality))
+        if self.options.n_base_limit > 0:
+            stages.append(filterstages.FilterStage("too_many_N", countCost, self.checkN))
+        return filterstages.StagePipeline(stages, self.options.stage_order, FILTER_CHUNK_SIZE)
 
     def loadBubbleCircles(self):
         bubbleCircleFile = os.path.join(self.options.debubble_dir, "circles.csv")
@@ -216,18 +461,513 @@ class seqFilter:
                 i2[0] = "@" + flag + i2[0][1:]
             i2_file.writeLines(i2)
 
+    def openWriter(self, folder, filename, kind, level = None):
+        #kind is good, bad or overlap
+        if level == None:
+            level = self.options.compression_level
+        ext = "." + kind + ".fq"
+        if level > 0:
+            ext += ".gz"
+        return fastq.Writer(os.path.join(folder, getMainName(filename) + ext), level, self.compressPool, self.options.compression_threads)
+
+    #write a filtered record to the bad, overlap and good outputs
+    #record is the number of the record in the input starting from 1
+    def writeResult(self, r1, r2, i1, i2, flag, overlap, record):
+        if flag != None:
+            self.badSink.write(r1, r2, i1, i2, flag, record)
+            return
+        if overlap != None:
+            o = self.overlapWriters
+            self.writeReads(overlap[0], overlap[1], i1, i2, o[0], o[1], o[2], o[3], None)
+        if self.goodShards != None:
+            self.goodShards.write(r1, r2, i1, i2)
+        else:
+            g = self.goodWriters
+            self.writeReads(r1, r2, i1, i2, g[0], g[1], g[2], g[3], None)
+
+    #write the filtered records of a chunk, the good and overlapped reads are written by one Writer.writeBatch for each file
+    #the bad reads go to the bad-read sink and the sharded good reads to their shards one by one
+    #first is the number of the first record in the input
+    def writeResults(self, r1s, r2s, i1s, i2s, results, first):
+        good = []
+        overlapped = []
+        for k in xrange(len(results)):
+            flag, overlap = results[k]
+            if flag != None:
+                self.badSink.write(r1s[k], r2s[k], i1s[k], i2s[k], flag, first + k)
+                continue
+            if overlap != None:
+                overlapped.append((overlap[0], overlap[1], i1s[k], i2s[k]))
+            if self.goodShards != None:
+                self.goodShards.write(r1s[k], r2s[k], i1s[k], i2s[k])
+            else:
+                good.append((r1s[k], r2s[k], i1s[k], i2s[k]))
+        self.writeRecords(self.overlapWriters, overlapped)
+        self.writeRecords(self.goodWriters, good)
+
+    #write records of (r1, r2, i1, i2) by one Writer.writeBatch for each writer
+    #a writer can be shared by several files, like read1 and read2 of interleaved outputs,
+    #then the reads of a record are put into its batch in turn, so the records are still written in pairs
+    def writeRecords(self, writers, records):
+        if len(records) == 0:
+            return
+        batches = []
+        #the index in batches of each file, None if the file is not written
+        owners = [None, None, None, None]
+        for j in xrange(4):
+            if writers[j] == None or records[0][j] == None:
+                continue
+            for b in xrange(len(batches)):
+                if batches[b][0] is writers[j]:
+                    owners[j] = b
+            if owners[j] == None:
+                owners[j] = len(batches)
+                batches.append((writers[j], []))
+        columns = [(j, batches[owners[j]][1]) for j in xrange(4) if owners[j] != None]
+        for record in records:
+            for j, reads in columns:
+                reads.append(record[j])
+        for writer, reads in batches:
+            writer.writeBatch(reads)
+
+    #filter a record, r1/r2/i1/i2 are changed in place by trimming and error correction
+    #recordNumber is the number of the record in the input starting from 1, the first qc_sample records are used by post-filter QC
+    #returns (flag, overlap), flag is the reason of a bad record or None for a good one
+    #overlap is the overlapped (read1, read2) to store, or None
+    def filterRecord(self, r1, r2, i1, i2, stats, recordNumber):
+        perf = None
+        if perfstats.isSampled(recordNumber):
+            perf = stats.perf
+        flag = self.__filterHead(r1, r2, i1, i2, stats, perf)
+        if flag == None:
+            flag = self.pipeline.run(r1, r2, None, recordNumber, stats.stages, perf)
+        overlap = None
+        if flag == None:
+            flag, overlap = self.__filterOverlap(r1, r2, i1, i2, stats, perf)
+        return self.__countResult(r1, r2, i1, i2, stats, recordNumber, flag, overlap)
+
+    #filter a batch of records like filterRecord, first is the number of the first record in the input
+    #the filters are run in phases, so the low quality and N counts of the reads passing barcode, trim and adapter trimming
+    #can be computed in bulk by batchkernels, the reason of each bad record is same as filterRecord
+    #returns the list of (flag, overlap)
+    def filterBatch(self, r1s, r2s, i1s, i2s, stats, first):
+        size = len(r1s)
+        results = [None] * size
+        #barcode, trim and adapter trimming
+        passed = []
+        for k in xrange(size):
+            perf = None
+            if perfstats.isSampled(first + k):
+                perf = stats.perf
+            flag = self.__filterHead(r1s[k], r2s[k], i1s[k], i2s[k], stats, perf)
+            if flag != None:
+                results[k] = self.__countResult(r1s[k], r2s[k], i1s[k], i2s[k], stats, first + k, flag, None)
+            else:
+                passed.append(k)
+        #low quality and N counts of the passed reads
+        time1 = time.time()
+        counts = self.batchCounts([r1s[k] for k in passed], [r2s[k] for k in passed] if r2s[0] != None else None)
+        if counts != None:
+            stats.perf.add("filter.batch_counts", time.time() - time1, len(passed), len(passed))
+        #filter stages, overlap and error correction
+        for j in xrange(len(passed)):
+            k = passed[j]
+            readCounts = None
+            if counts != None:
+                readCounts = [values[j] if values != None else None for values in counts]
+            perf = None
+            if perfstats.isSampled(first + k):
+                perf = stats.perf
+            flag = self.pipeline.run(r1s[k], r2s[k], readCounts, first + k, stats.stages, perf)
+            overlap = None
+            if flag == None:
+                flag, overlap = self.__filterOverlap(r1s[k], r2s[k], i1s[k], i2s[k], stats, perf)
+            results[k] = self.__countResult(r1s[k], r2s[k], i1s[k], i2s[k], stats, first + k, flag, overlap)
+        return results
+
+    #returns [lowQual1, lowQual2, nNum1, nNum2, length1, length2] lists of the reads, or None if numpy is not available
+    def batchCounts(self, r1s, r2s):
+        if not batchkernels.HAVE_NUMPY or len(r1s) == 0:
+            return None
+        qual = self.options.qualified_quality_phred
+        needLowQual = self.options.unqualified_base_limit > 0
+        needN = self.options.n_base_limit > 0
+        if not needLowQual and not needN:
+            return None
+        lowQual1, nNum1, length1 = batchkernels.readCounts(r1s, qual, needLowQual, needN)
+        lowQual2, nNum2, length2 = (None, None, None)
+        if r2s != None:
+            lowQual2, nNum2, length2 = batchkernels.readCounts(r2s, qual, needLowQual, needN)
+        return [lowQual1, lowQual2, nNum1, nNum2, length1, length2]
+
+    #the checked and rejected records of each enabled stage, in the order of precedence
+    def stageSummary(self, stats):
+        stages = []
+        enabled = self.pipeline.order()
+        for name in filterstages.STAGE_PRECEDENCE:
+            if name not in enabled:
+                continue
+            checked, rejected = stats.stages.get(name, [0, 0])
+            stage = {}
+            stage['name'] = name
+            stage['checked_reads'] = checked
+            stage['rejected_reads'] = rejected
+            stage['rejection_rate'] = 0.0
+            if checked > 0:
+                stage['rejection_rate'] = float(rejected) / checked
+            stages.append(stage)
+        result = {}
+        result['order'] = self.options.stage_order
+        result['stages'] = stages
+        return result
+
+    #the reads and bases trimmed at the adapters
+    def adapterSummary(self, stats):
+        c = stats.counters
+        result = {}
+        result['adapters'] = len(self.adapterTrimmer.names)
+        result['min_partial'] = self.adapterTrimmer.minPartial
+        result['trimmed_reads'] = c["ADAPTER_READS"]
+        result['trimmed_bases'] = c["ADAPTER_BASES"]
+        result['partial_adapter_reads'] = c["ADAPTER_PARTIAL"]
+        result['trimmed_reads_by_adapter'] = stats.adapters
+        return result
+
+    #the performance of the run, the calls and reads of the per-read stages are got from the exact counters
+    def performanceSummary(self, stats, seconds):
+        perf = perfstats.RUN
+        perf.merge(stats.perf)
+        c = stats.counters
+        headOut = c["TOTAL_READS"] - c["BADBCD1"] - c["BADBCD2"] - c["BADTRIM1"] - c["BADTRIM2"]
+        perf.setCounts("filter.barcode_trim", c["TOTAL_READS"], headOut + c["ADAPTER_SHORT"])
+        if self.adapterTrimmer != None:
+            perf.setCounts("filter.adapter_trim", headOut + c["ADAPTER_SHORT"], headOut)
+        for name, (checked, rejected) in stats.stages.items():
+            perf.setCounts("filter." + name, checked, checked - rejected)
+        if self.options.read2_file != None:
+            overlapIn = c["GOOD_READS"] + c["BADOL"] + c["BADINDEL"] + c["BADMISMATCH"]
+            perf.setCounts("filter.overlap", overlapIn, overlapIn - c["BADOL"])
+            corrections = c["BASE_CORRECTED"] + c["BADINDEL"] + c["BADMISMATCH"]
+            perf.setCounts("filter.error_correction", corrections, c["BASE_CORRECTED"])
+        perf.setCounts("filter.postfilter_qc", c["POSTFILTER_QC_READS"], c["POSTFILTER_QC_READS"])
+        result = perf.summary()
+        result['total_seconds'] = round(seconds, 6)
+        return result
+
+    def __countResult(self, r1, r2, i1, i2, stats, recordNumber, flag, overlap):
+        c = stats.counters
+        if flag != None:
+            c[flag] += 1
+            return (flag, None)
+        c["GOOD_BASES"] += len(r1[1])
+        if i2 != None:
+            c["GOOD_BASES"] += len(r2[1])
+        if self.options.qc_sample <=0 or recordNumber < self.options.qc_sample:
+            sampled = perfstats.isSampled(recordNumber)
+            if sampled:
+                time1 = time.time()
+            stats.r1qc.statRead(r1)
+            if r2 != None:
+                stats.r2qc.statRead(r2)
+            if sampled:
+                stats.perf.sample("filter.postfilter_qc", time.time() - time1)
+            c["POSTFILTER_QC_READS"] += 1
+        c["GOOD_READS"] += 1
+        return (None, overlap)
+
+    #barcode, trim and adapter trimming, returns the flag of a bad record or None
+    #perf is the Performance to time this record, or None if it is not sampled
+    def __filterHead(self, r1, r2, i1, i2, stats, perf):
+        if perf == None:
+            flag = self.__barcodeAndTrim(r1, r2, i1, i2, stats)
+            if flag == None and self.adapterTrimmer != None:
+                flag = self.__trimAdapters(r1, r2, stats)
+            return flag
+        time1 = time.time()
+        flag = self.__barcodeAndTrim(r1, r2, i1, i2, stats)
+        perf.sample("filter.barcode_trim", time.time() - time1)
+        if flag == None and self.adapterTrimmer != None:
+            time1 = time.time()
+            flag = self.__trimAdapters(r1, r2, stats)
+            perf.sample("filter.adapter_trim", time.time() - time1)
+        return flag
+
+    #trim the reads at the adapters, the reads of a pair are trimmed separately
+    #a read shorter than 5 bases after trimming is a bad read like in trim, other short reads are filtered by the length stage
+    def __trimAdapters(self, r1, r2, stats):
+        for (r, flag) in ((r1, "BADTRIM1"), (r2, "BADTRIM2")):
+            if r == None:
+                continue
+            (position, adapter, partial) = self.adapterTrimmer.scan(r[1])
+            if position < len(r[1]):
+                c = stats.counters
+                c["ADAPTER_READS"] += 1
+                c["ADAPTER_BASES"] += len(r[1]) - position
+                if partial:
+                    c["ADAPTER_PARTIAL"] += 1
+                name = self.adapterTrimmer.names[adapter]
+                stats.adapters[name] = stats.adapters.get(name, 0) + 1
+                r[1] = r[1][0:position]
+                r[3] = r[3][0:position]
+                if position < 5:
+                    c["ADAPTER_SHORT"] += 1
+                    return flag
+        return None
+
+    def __barcodeAndTrim(self, r1, r2, i1, i2, stats):
+        c = stats.counters
+        c["TOTAL_BASES"] += len(r1[1])
+        if i2 != None:
+            c["TOTAL_BASES"] += len(r2[1])
+
+        c["TOTAL_READS"] += 1
+                
+        #barcode processing
+        if self.options.barcode:
+            barcodeLen1 = barcodeprocesser.detectBarcode(r1[1], self.options.barcode_length, self.options.barcode_verify)
+            if barcodeLen1 == 0:
+                return "BADBCD1"
+            else:
+                if r2 == None:
+                    barcodeprocesser.moveBarcodeToName(r1, self.options.barcode_length, self.options.barcode_verify)
+                else:
+                    barcodeLen2 = barcodeprocesser.detectBarcode(r2[1], self.options.barcode_length, self.options.barcode_verify)
+                    if barcodeLen2 == 0:
+                        return "BADBCD2"
+                    else:
+                        barcodeprocesser.moveAndTrimPair(r1, r2, barcodeLen1, barcodeLen2, self.options.barcode_verify)
+        
+        #trim
+        if self.options.trim_front > 0 or self.options.trim_tail > 0:
+            r1 = trim(r1, self.options.trim_front, self.options.trim_tail)
+            if len(r1[1]) < 5:
+                return "BADTRIM1"
+            if r2 != None:
+                r2 = trim(r2, self.options.trim_front2, self.options.trim_tail2)
+                if len(r2[1]) < 5:
+                    return "BADTRIM2"
+
+        return None
+
+    #the filter stages, counts is [lowQual1, lowQual2, nNum1, nNum2, length1, length2] computed by batchCounts, or None to count them here
+    def checkBubble(self, r1, r2, counts):
+        if self.isInBubble(r1[0]):
+            return "BADBBL"
+        return None
+
+    def checkLength(self, r1, r2, counts):
+        if counts != None:
+            length1 = counts[4]
+        else:
+            length1 = len(r1[1])
+        if length1<self.options.seq_len_req:
+            return "BADLEN"
+        return None
+
+    def checkPolyX(self, r1, r2, counts):
+        poly1 = hasPolyX(r1[1], self.options.poly_size_limit, self.options.allow_mismatch_in_poly)
+        poly2 = None
+        if r2!=None:
+            poly2 = hasPolyX(r2[1], self.options.poly_size_limit, self.options.allow_mismatch_in_poly)
+        if poly1!=None or poly2!=None:
+            return "BADPOL"
+        return None
+
+    def checkLowQuality(self, r1, r2, counts):
+        if counts != None:
+            lowQual1 = counts[0]
+            lowQual2 = counts[1] or 0
+        else:
+            lowQual1 = lowQualityNum(r1, self.options.qualified_quality_phred)
+            lowQual2 = 0
+            if r2!=None:
+                lowQual2 = lowQualityNum(r2, self.options.qualified_quality_phred)
+        if lowQual1 > self.options.unqualified_base_limit or lowQual1 > self.options.unqualified_base_limit:
+            return "BADLQC"
+        return None
+
+    def checkN(self, r1, r2, counts):
+        if counts != None:
+            nNum1 = counts[2]
+            nNum2 = counts[3] or 0
+        else:
+            nNum1 = nNumber(r1)
+            nNum2 = 0
+            if r2!=None:
+                nNum2 = nNumber(r2)
+        if nNum1 > self.options.n_base_limit or nNum2 > self.options.n_base_limit:
+            return "BADNCT"
+        return None
+
+    #overlap and error correction, returns (flag, overlap) like filterRecord
+    #perf is the Performance to time this record, or None if it is not sampled
+    def __filterOverlap(self, r1, r2, i1, i2, stats, perf):
+        c = stats.counters
+        overlap = None
+
+        #check overlap and do error correction
+        if r2!=None:
+            if perf != None:
+                time1 = time.time()
+            (offset, overlap_len, distance) = self.overlap(r1[1], r2[1])
+            stats.overlap_histgram[overlap_len] += 1
+            # deal with the case insert DNA is shorter than read length and cause offset is negative
+            if offset <0 and overlap_len > 30:
+                # shift the junk bases
+                r1[1] = r1[1][0:overlap_len]
+                r1[3] = r1[3][0:overlap_len]
+                r2[1] = r2[1][-offset:-offset+overlap_len]
+                r2[3] = r2[3][-offset:-offset+overlap_len]
+                # then calc overlap again
+                (offset, overlap_len, distance) = self.overlap(r1[1], r2[1])
+            if perf != None:
+                perf.sample("filter.overlap", time.time() - time1)
+            if overlap_len>30:
+                c["OVERLAPPED"] += 1
+                stats.distance_histgram[distance] += 1
+                c["OVERLAP_LEN_SUM"] += overlap_len
+                if distance > 3:
+                    return ("BADOL", None)
+                elif distance>0:
+                    if perf != None:
+                        time1 = time.time()
+                    flag = self.__correctMismatches(r1, r2, overlap_len, distance)
+                    if perf != None:
+                        perf.sample("filter.error_correction", time.time() - time1)
+                    if flag != None:
+                        return (flag, None)
+                    c["BASE_CORRECTED"] += 1
+                if self.options.store_overlap:
+                    overlap = (getOverlap(r1, overlap_len), getOverlap(r2, overlap_len))
+
+
+        return (None, overlap)
+
+    #correct the mismatches in the overlapped area by the base of higher quality
+    #returns BADINDEL or BADMISMATCH if the mismatches cannot be corrected, otherwise None
+    #the decision of a mismatch doesn't depend on the others, so all decisions are made first,
+    #and then the bases and qualities of each read are changed in one bytearray
+    #the corrections are applied even if the pair is BADMISMATCH, so the bad reads are same as before
+    def __correctMismatches(self, r1, r2, overlap_len, distance):
+        #the overlapped area of r1 and the reverse complement of r2's, the mismatches are the positions to correct
+        seqStart1 = len(r1[1]) - overlap_len
+        qualStart1 = len(r1[3]) - overlap_len
+        bases1 = r1[1][seqStart1:]
+        bases2 = seqkernel.reverseComplement(r2[1][len(r2[1]) - overlap_len:])
+        mismatches = seqkernel.mismatchPositions(bases1, bases2)
+        if len(mismatches) != distance:
+            return "BADINDEL"
+        #the positions, bases and qualities to change in r1 and r2
+        seqFix1 = []
+        qualFix1 = []
+        seqFix2 = []
+        qualFix2 = []
+        for o in mismatches:
+            q1 = r1[3][qualStart1 + o]
+            q2 = r2[3][-o-1]
+            if util.qualNum(q1) >= 27 and util.qualNum(q2) <= 16:
+                seqFix2.append((-o-1, seqkernel.complement(bases1[o])))
+                qualFix2.append((-o-1, q1))
+            elif util.qualNum(q2) >= 27 and util.qualNum(q1) <= 16:
+                seqFix1.append((seqStart1 + o, bases2[o]))
+                qualFix1.append((qualStart1 + o, q2))
+        if len(seqFix1) > 0:
+            r1[1] = seqkernel.substitute(r1[1], seqFix1)
+            r1[3] = seqkernel.substitute(r1[3], qualFix1)
+        if len(seqFix2) > 0:
+            r2[1] = seqkernel.substitute(r2[1], seqFix2)
+            r2[3] = seqkernel.substitute(r2[3], qualFix2)
+        if len(seqFix1) + len(seqFix2) != distance:
+            return "BADMISMATCH"
+        return None
+
+    #the records are split into chunks, which are filtered by worker processes
+    #the results are written in input order with filter_order ordered, otherwise in the order the chunks are finished
+    #the stats of the chunks are merged, so they are identical to a serial run in both modes
+    def filterParallel(self, pairedReader, stats, readLen):
+        processes = self.options.filter_processes
+        ordered = self.options.filter_order == "ordered"
+        pool = Pool(processes, initWorker, (self.options,))
+        #limit the chunks in flight, so the memory is bounded
+        maxPending = 2 * processes
+        pending = deque()
+        first = 0
+        try:
+            for columns in alignedChunks(pairedReader):
+                pending.append(pool.apply_async(filterChunk, ((first, columns, readLen), )))
+                first += max([len(reads) for reads in columns if reads != None])
+                if len(pending) >= maxPending:
+                    self.writeChunk(nextFinished(pending, ordered), stats)
+            while len(pending) > 0:
+                self.writeChunk(nextFinished(pending, ordered), stats)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def writeChunk(self, chunk, stats):
+        (first, columns, results, chunkStats) = chunk
+        time1 = time.time()
+        r1s, r2s, i1s, i2s = [reads if reads != None else [None] * len(results) for reads in columns]
+        #first of a chunk starts from 0
+        self.writeResults(r1s, r2s, i1s, i2s, results, first + 1)
+        perfstats.RUN.add("output.write", time.time() - time1, len(results), len(results))
+        stats.merge(chunkStats)
+        self.progress.update(stats.counters["TOTAL_READS"], self.pairedReader)
+
+    #the good reads are written by goodshards.ShardedOutput if good_shards is set
+    def openGoodWriter(self, folder, filename):
+        if self.options.good_shards != "none":
+            return None
+        return self.openWriter(folder, filename, "good")
+
+    #the bad reads are not written with bad_sink none, and always compressed with bad_sink gzip
+    def openBadWriter(self, folder, filename):
+        policy, sampleSize = badsink.parsePolicy(self.options.bad_sink)
+        if policy == "none":
+            return None
+        if policy == "gzip" and self.options.compression_level <= 0:
+            return self.openWriter(folder, filename, "bad", badsink.GZIP_LEVEL)
+        return self.openWriter(folder, filename, "bad")
+
+    #the good reads are written to one file, which can be - for stdout or a named pipe
+    def openGoodOutput(self):
+        #compression_level 0 means the default level of a .gz file
+        level = self.options.compression_level
+        if level <= 0:
+            level = 9
+        return fastq.Writer(self.options.good_output_file, level, self.compressPool, self.options.compression_threads)
+
     def run(self):
+        #the performance of this run, the stages of the QC and the report are timed by perfstats.timed
+        perfstats.reset()
+        runTime = time.time()
         if self.options.debubble:
             self.loadBubbleCircles()
 
+        #an interleaved file contains both read1 and read2
+        if self.options.interleaved:
+            self.options.read2_file = self.options.read1_file
+        #stdin and interleaved files are read only once, the QC is done with the buffered head of the stream
+        streaming = self.options.read1_file == fastq.STDIO or self.options.interleaved
+
         #read1_file is required
-        read1_file = fastq.Reader(self.options.read1_file)
+        read1_file = fastq.openReader(self.options.read1_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
+        read2_file = None
+        if self.options.interleaved:
+            interleaved = fastq.InterleavedReader(read1_file)
+            read1_file = interleaved.mate(0)
+            read2_file = interleaved.mate(1)
+        elif self.options.read2_file != None:
+            read2_file = fastq.openReader(self.options.read2_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
         #create a QC folder to contains QC results
         qc_base_folder = os.path.join(os.path.dirname(self.options.read1_file), "QC")
         if not os.path.exists(qc_base_folder):
             os.makedirs(qc_base_folder)
         #QC result of this file/pair
-        qc_dir =  os.path.join(qc_base_folder, os.path.basename(self.options.read1_file))
+        qc_name = os.path.basename(self.options.read1_file)
+        if self.options.read1_file == fastq.STDIO:
+            qc_name = "stdin"
+        qc_dir =  os.path.join(qc_base_folder, qc_name)
         if not os.path.exists(qc_dir):
             os.makedirs(qc_dir)
 
@@ -239,18 +979,36 @@ class seqFilter:
 
         r1qc_prefilter = QualityControl(self.options.qc_sample, self.options.qc_kmer)
         r2qc_prefilter = QualityControl(self.options.qc_sample, self.options.qc_kmer)
-        r1qc_prefilter.statFile(self.options.read1_file)
+        #the pre-filter QC is done with the head of the inputs, which is buffered and then replayed to the filter
+        #so each input is read only once, a file is read twice only if all its reads are sampled (qc_sample 0)
+        singlePass = self.options.qc_sample > 0
+        time1 = time.time()
+        if streaming or singlePass:
+            read1_file = fastq.ReplayReader(read1_file, r1qc_prefilter.headSize())
+        if self.options.read2_file != None and (self.options.interleaved or singlePass):
+            read2_file = fastq.ReplayReader(read2_file, r2qc_prefilter.headSize())
+        if isinstance(read1_file, fastq.ReplayReader):
+            headReads = len(read1_file.head)
+            perfstats.RUN.add("input.read_head", time.time() - time1, headReads, headReads)
+        #read2 is stated by a child process at the same time as read1
+        r2job = None
+        if isinstance(read2_file, fastq.ReplayReader):
+            r2job = startStatReads(r2qc_prefilter, read2_file.head)
+            read2_file.head = None
+        if isinstance(read1_file, fastq.ReplayReader):
+            r1qc_prefilter.statReads(read1_file.head)
+            read1_file.head = None
+        else:
+            r1qc_prefilter.statFile(self.options.read1_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
         r1qc_prefilter.plot(qc_dir, "R1-prefilter")
         if self.options.read2_file != None:
-            r2qc_prefilter.statFile(self.options.read2_file)
+            if r2job != None:
+                r2qc_prefilter = finishStatReads(r2job)
+            else:
+                r2qc_prefilter.statFile(self.options.read2_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
             r2qc_prefilter.plot(qc_dir, "R2-prefilter")
 
-        r1qc_postfilter = QualityControl(self.options.qc_sample, self.options.qc_kmer)
-        r2qc_postfilter = QualityControl(self.options.qc_sample, self.options.qc_kmer)
-
         readLen = r1qc_prefilter.readLen
-        overlap_histgram = [0 for x in xrange(readLen+1)]
-        distance_histgram = [0 for x in xrange(readLen+1)]
 
         #auto detect trim front and trim tail
         if self.options.trim_front == -1 or self.options.trim_tail == -1:
@@ -300,20 +1058,28 @@ class seqFilter:
 
         if self.options.store_overlap and self.options.read2_file != None and (not os.path.exists(overlap_dir)):
             os.makedirs(overlap_dir)
+
+        #the outputs are compressed by a thread pool shared by all writers
+        self.compressPool = None
+        compressed = self.options.compression_level > 0 or self.options.bad_sink == "gzip"
+        if compressed and self.options.compression_threads > 0 and not self.options.qc_only:
+            self.compressPool = ThreadPool(self.options.compression_threads)
         
         good_read1_file = None
         bad_read1_file = None
         overlap_read1_file = None
         if not self.options.qc_only:
-            good_read1_file = fastq.Writer(os.path.join(good_dir, getMainName(self.options.read1_file)+".good.fq"))
-            bad_read1_file = fastq.Writer(os.path.join(bad_dir, getMainName(self.options.read1_file)+".bad.fq"))
+            if self.options.good_output_file != None:
+                good_read1_file = self.openGoodOutput()
+            else:
+                good_read1_file = self.openGoodWriter(good_dir, self.options.read1_file)
+            bad_read1_file = self.openBadWriter(bad_dir, self.options.read1_file)
 
             overlap_read1_file = None
             if self.options.store_overlap:
-                overlap_read1_file = fastq.Writer(os.path.join(overlap_dir, getMainName(self.options.read1_file)+".overlap.fq"))
+                overlap_read1_file = self.openWriter(overlap_dir, self.options.read1_file, "overlap")
         
         #other files are optional
-        read2_file = None
         good_read2_file = None
         bad_read2_file = None
         overlap_read2_file = None
@@ -330,296 +1096,162 @@ class seqFilter:
         
         #if other files are specified, then read them
         if self.options.read2_file != None:
-            read2_file = fastq.Reader(self.options.read2_file)
             if not self.options.qc_only:
-                good_read2_file = fastq.Writer(os.path.join(good_dir, getMainName(self.options.read2_file)+".good.fq"))
-                bad_read2_file = fastq.Writer(os.path.join(bad_dir, getMainName(self.options.read2_file)+".bad.fq"))
-                if self.options.store_overlap and self.options.read2_file != None:
-                    overlap_read2_file = fastq.Writer(os.path.join(overlap_dir, getMainName(self.options.read2_file)+".overlap.fq"))
+                if self.options.interleaved:
+                    #the outputs of an interleaved file are interleaved too
+                    good_read2_file = good_read1_file
+                    bad_read2_file = bad_read1_file
+                    overlap_read2_file = overlap_read1_file
+                else:
+                    good_read2_file = self.openGoodWriter(good_dir, self.options.read2_file)
+                    bad_read2_file = self.openBadWriter(bad_dir, self.options.read2_file)
+                    if self.options.store_overlap and self.options.read2_file != None:
+                        overlap_read2_file = self.openWriter(overlap_dir, self.options.read2_file, "overlap")
+                #read1 and read2 of a pair are written to good_output_file in turn
+                if self.options.good_output_file != None:
+                    good_read2_file = good_read1_file
         if self.options.index1_file != None:
-            index1_file = fastq.Reader(self.options.index1_file)
+            index1_file = fastq.openReader(self.options.index1_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
             if not self.options.qc_only:
-                good_index1_file = fastq.Writer(os.path.join(good_dir, getMainName(self.options.index1_file)+".good.fq"))
-                bad_index1_file = fastq.Writer(os.path.join(bad_dir, getMainName(self.options.index1_file)+".bad.fq"))
+                good_index1_file = self.openGoodWriter(good_dir, self.options.index1_file)
+                bad_index1_file = self.openBadWriter(bad_dir, self.options.index1_file)
                 if self.options.store_overlap and self.options.read2_file != None:
-                    overlap_index1_file = fastq.Writer(os.path.join(overlap_dir, getMainName(self.options.index1_file)+".overlap.fq"))
+                    overlap_index1_file = self.openWriter(overlap_dir, self.options.index1_file, "overlap")
         if self.options.index2_file != None:
-            index2_file = fastq.Reader(self.options.index2_file)
+            index2_file = fastq.openReader(self.options.index2_file, self.options.decompressor, self.options.mmap, self.options.compact_reads)
             if not self.options.qc_only:
-                good_index2_file = fastq.Writer(os.path.join(good_dir, getMainName(self.options.index2_file)+".good.fq"))
-                bad_index2_file = fastq.Writer(os.path.join(bad_dir, getMainName(self.options.index2_file)+".bad.fq"))
+                good_index2_file = self.openGoodWriter(good_dir, self.options.index2_file)
+                bad_index2_file = self.openBadWriter(bad_dir, self.options.index2_file)
                 if self.options.store_overlap and self.options.read2_file != None:
-                    overlap_index2_file = fastq.Writer(os.path.join(overlap_dir, getMainName(self.options.index2_file)+".overlap.fq"))
+                    overlap_index2_file = self.openWriter(overlap_dir, self.options.index2_file, "overlap")
             
-        r1 = None
-        r2 = None
-        i1 = None
-        i2 = None
-
-        # stat numbers
-        TOTAL_BASES = 0
-        GOOD_BASES = 0
-        TOTAL_READS = 0
-        GOOD_READS = 0
-        BAD_READS = 0
-        BADBCD1 = 0
-        BADBCD2 = 0
-        BADTRIM1 = 0
-        BADTRIM2 = 0
-        BADBBL = 0
-        BADLEN = 0
-        BADPOL = 0
-        BADLQC = 0
-        BADNCT = 0
-        BADOL = 0
-        BADINDEL = 0
-        BADMISMATCH = 0
-        BASE_CORRECTED = 0
-        OVERLAPPED = 0
-        OVERLAP_LEN_SUM = 0
-
-        while True:
-            r1 = read1_file.nextRead()
-            if r1==None:
-                break
-            else:
-                TOTAL_BASES += len(r1[1])
-                
-            if read2_file != None:
-                r2 = read2_file.nextRead()
-                if r2==None:
-                    break
-            if index1_file != None:
-                i1 = index1_file.nextRead()
-                if i1==None:
+        goodShards = None
+        if self.options.good_shards != "none" and not self.options.qc_only:
+            goodShards = goodshards.ShardedOutput(self.options.good_shards,
+                [self.options.read1_file, self.options.read2_file, self.options.index1_file, self.options.index2_file],
+                lambda filename, kind: self.openWriter(good_dir, filename, kind), self.writeReads)
+
+        #the bad reads are written, sampled or only counted according to bad_sink
+        badSink = badsink.BadReadSink(self.options.bad_sink, [bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file], self.writeReads)
+
+        stats = FilterStats(readLen, self.options.qc_sample, self.options.qc_kmer)
+        self.badSink = badSink
+        self.goodShards = goodShards
+        self.goodWriters = (good_read1_file, good_read2_file, good_index1_file, good_index2_file)
+        self.overlapWriters = (overlap_read1_file, overlap_read2_file, overlap_index1_file, overlap_index2_file)
+
+        #read all files in lockstep, a truncated file or mismatched read names raise fastq.PairingError
+        pairedReader = fastq.PairedReader([read1_file, read2_file, index1_file, index2_file], self.options.pair_name_check)
+        self.pairedReader = pairedReader
+        self.progress = progress.ProgressReporter(self.options.read1_file, os.path.join(qc_dir, progress.STATUS_FILE),
+            self.options.progress_interval, self.progressQueue)
+        if self.options.filter_processes > 1 and not self.options.qc_only:
+            self.filterParallel(pairedReader, stats, readLen)
+        elif self.options.qc_only:
+            #stop at the qc_sample-th record, so the records are filtered one by one
+            for (r1, r2, i1, i2) in pairedReader.reads():
+                record = stats.counters["TOTAL_READS"] + 1
+                flag, overlap = self.filterRecord(r1, r2, i1, i2, stats, record)
+                self.writeResult(r1, r2, i1, i2, flag, overlap, record)
+                self.progress.update(stats.counters["TOTAL_READS"], pairedReader)
+                if flag == None and stats.counters["TOTAL_READS"] >= self.options.qc_sample:
                     break
-            if index2_file != None:
-                i2 = index2_file.nextRead()
-                if i2==None:
+        else:
+            while True:
+                time1 = time.time()
+                batch = pairedReader.nextBatch()
+                if batch == None:
                     break
-                else:
-                    TOTAL_BASES += len(r2[1])
-
-            TOTAL_READS += 1
-                    
-            #barcode processing
-            if self.options.barcode:
-                barcodeLen1 = barcodeprocesser.detectBarcode(r1[1], self.options.barcode_length, self.options.barcode_verify)
-                if barcodeLen1 == 0:
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADBCD1")
-                    BADBCD1 += 1
-                    continue
-                else:
-                    if r2 == None:
-                        barcodeprocesser.moveBarcodeToName(r1, self.options.barcode_length, self.options.barcode_verify)
-                    else:
-                        barcodeLen2 = barcodeprocesser.detectBarcode(r2[1], self.options.barcode_length, self.options.barcode_verify)
-                        if barcodeLen2 == 0:
-                            self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADBCD2")
-                            BADBCD2 += 1
-                            continue
-                        else:
-                            barcodeprocesser.moveAndTrimPair(r1, r2, barcodeLen1, barcodeLen2, self.options.barcode_verify)
-            
-            #trim
-            if self.options.trim_front > 0 or self.options.trim_tail > 0:
-                r1 = trim(r1, self.options.trim_front, self.options.trim_tail)
-                if len(r1[1]) < 5:
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADTRIM1")
-                    BADTRIM1 += 1
-                    continue
-                if r2 != None:
-                    r2 = trim(r2, self.options.trim_front2, self.options.trim_tail2)
-                    if len(r2[1]) < 5:
-                        self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADTRIM2")
-                        BADTRIM2 += 1
-                        continue
-
-            #filter debubble
-            if self.options.debubble:
-                if self.isInBubble(r1[0]):
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADBBL")
-                    BADBBL += 1
-                    continue
-            
-            #filter sequence length
-            if len(r1[1])<self.options.seq_len_req:
-                self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADLEN")
-                BADLEN += 1
-                continue
-                    
-            #check polyX
-            if self.options.poly_size_limit > 0:
-                poly1 = hasPolyX(r1[1], self.options.poly_size_limit, self.options.allow_mismatch_in_poly)
-                poly2 = None
-                if r2!=None:
-                    poly2 = hasPolyX(r2[1], self.options.poly_size_limit, self.options.allow_mismatch_in_poly)
-                if poly1!=None or poly2!=None:
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADPOL")
-                    BADPOL += 1
-                    continue
-            
-            #check low quality count
-            if self.options.unqualified_base_limit > 0:
-                lowQual1 = lowQualityNum(r1, self.options.qualified_quality_phred)
-                lowQual2 = 0
-                if r2!=None:
-                    lowQual2 = lowQualityNum(r2, self.options.qualified_quality_phred)
-                if lowQual1 > self.options.unqualified_base_limit or lowQual1 > self.options.unqualified_base_limit:
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADLQC")
-                    BADLQC += 1
-                    continue
-            
-            #check N number
-            if self.options.n_base_limit > 0:
-                nNum1 = nNumber(r1)
-                nNum2 = 0
-                if r2!=None:
-                    nNum2 = nNumber(r2)
-                if nNum1 > self.options.n_base_limit or nNum2 > self.options.n_base_limit:
-                    self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADNCT")
-                    BADNCT += 1
-                    continue
-
-            #check overlap and do error correction
-            if r2!=None:
-                (offset, overlap_len, distance) = util.overlap(r1[1], r2[1])
-                overlap_histgram[overlap_len] += 1
-                # deal with the case insert DNA is shorter than read length and cause offset is negative
-                if offset <0 and overlap_len > 30:
-                    # shift the junk bases
-                    r1[1] = r1[1][0:overlap_len]
-                    r1[3] = r1[3][0:overlap_len]
-                    r2[1] = r2[1][-offset:-offset+overlap_len]
-                    r2[3] = r2[3][-offset:-offset+overlap_len]
-                    # then calc overlap again
-                    (offset, overlap_len, distance) = util.overlap(r1[1], r2[1])
-                if overlap_len>30:
-                    OVERLAPPED += 1
-                    distance_histgram[distance] += 1
-                    OVERLAP_LEN_SUM += overlap_len
-                    corrected = 0
-                    if distance > 3:
-                        self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADOL")
-                        BADOL += 1
-                        continue
-                    elif distance>0:
-                        #try to fix low quality base
-                        hamming = util.hammingDistance(r1[1][len(r1[1]) - overlap_len:], util.reverseComplement(r2[1][len(r2[1]) - overlap_len:]))
-                        if hamming != distance:
-                            self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADINDEL")
-                            BADINDEL += 1
-                            continue
-                        #print(r1[1][len(r1[1]) - overlap_len:])
-                        #print(util.reverseComplement(r2[1][len(r2[1]) - overlap_len:]))
-                        #print(r1[3][len(r1[1]) - overlap_len:])
-                        #print(util.reverse(r2[3][len(r2[1]) - overlap_len:]))
-                        for o in xrange(overlap_len):
-                            b1 = r1[1][len(r1[1]) - overlap_len + o]
-                            b2 = util.complement(r2[1][-o-1])
-                            q1 = r1[3][len(r1[3]) - overlap_len + o]
-                            q2 = r2[3][-o-1]
-                            if b1 != b2:
-                                # print(TOTAL_READS, o, b1, b2, q1, q2)
-                                if util.qualNum(q1) >= 27 and util.qualNum(q2) <= 16:
-                                    r2[1] = util.changeString(r2[1], -o-1, util.complement(b1))
-                                    r2[3] = util.changeString(r2[3], -o-1, q1)
-                                    corrected += 1
-                                elif util.qualNum(q2) >= 27 and util.qualNum(q1) <= 16:
-                                    r1[1]= util.changeString(r1[1], len(r1[1]) - overlap_len + o, b2)
-                                    r1[3] = util.changeString(r1[3], len(r1[3]) - overlap_len + o, q2)
-                                    corrected += 1
-                                if corrected >= distance:
-                                    break
-                        #print(r1[1][len(r1[1]) - overlap_len:])
-                        #print(util.reverseComplement(r2[1][len(r2[1]) - overlap_len:]))
-                        #print(r1[3][len(r1[1]) - overlap_len:])
-                        #print(util.reverse(r2[3][len(r2[1]) - overlap_len:]))
-                        if corrected == distance:
-                            BASE_CORRECTED += 1
-                        else:
-                            self.writeReads(r1, r2, i1, i2, bad_read1_file, bad_read2_file, bad_index1_file, bad_index2_file, "BADMISMATCH")
-                            BADMISMATCH += 1
-                            continue
-                    if distance == 0 or distance == corrected:
-                        if self.options.store_overlap:
-                            self.writeReads(getOverlap(r1, overlap_len), getOverlap(r2, overlap_len), i1, i2, overlap_read1_file, overlap_read2_file, overlap_index1_file, overlap_index2_file, None)
-
-            #write to good       
-            self.writeReads(r1, r2, i1, i2, good_read1_file, good_read2_file, good_index1_file, good_index2_file, None)
-            GOOD_BASES += len(r1[1])
-            if i2 != None:
-                GOOD_BASES += len(r2[1])
-            if self.options.qc_sample <=0 or TOTAL_READS < self.options.qc_sample:
-                r1qc_postfilter.statRead(r1)
-                if r2 != None:
-                    r2qc_postfilter.statRead(r2)
-
-            GOOD_READS += 1
-            if self.options.qc_only and TOTAL_READS >= self.options.qc_sample:
-                break
+                size = max([len(reads) for reads in batch if reads != None])
+                perfstats.RUN.add("input.read", time.time() - time1, size, size)
+                #a batch of the reader can be very large, it is filtered by chunks so the progress is updated often
+                for start in xrange(0, size, FILTER_CHUNK_SIZE):
+                    end = min(start + FILTER_CHUNK_SIZE, size)
+                    time2 = time.time()
+                    r1s, r2s, i1s, i2s = [reads[start:end] if reads != None else [None] * (end - start) for reads in batch]
+                    first = stats.counters["TOTAL_READS"] + 1
+                    results = self.filterBatch(r1s, r2s, i1s, i2s, stats, first)
+                    time3 = time.time()
+                    stats.perf.add("filter", time3 - time2, end - start, end - start)
+                    self.writeResults(r1s, r2s, i1s, i2s, results, first)
+                    perfstats.RUN.add("output.write", time.time() - time3, end - start, end - start)
+                    self.progress.update(stats.counters["TOTAL_READS"], pairedReader)
+        self.progress.finish(stats.counters["TOTAL_READS"], pairedReader)
 
+        r1qc_postfilter = stats.r1qc
+        r2qc_postfilter = stats.r2qc
+        overlap_histgram = stats.overlap_histgram
+        distance_histgram = stats.distance_histgram
+        c = stats.counters
         r1qc_postfilter.qc()
         r1qc_postfilter.plot(qc_dir, "R1-postfilter")
         if self.options.read2_file != None:
             r2qc_postfilter.qc()
             r2qc_postfilter.plot(qc_dir, "R2-postfilter")
         
-        #close all files
+        badSink.finish()
+        if goodShards != None:
+            goodShards.close()
+            goodShards.writeManifest(os.path.join(good_dir, getMainName(self.options.read1_file) + ".good.shards.json"))
+        #close all files, the buffered outputs are flushed
+        time1 = time.time()
         if not self.options.qc_only:
-            good_read1_file.flush()
-            bad_read1_file.flush()
-            if self.options.read2_file != None:
-                good_read2_file.flush()
-                bad_read2_file.flush()
-            if self.options.index1_file != None:
-                good_index1_file.flush()
-                bad_index1_file.flush()
-            if self.options.index2_file != None:
-                good_index2_file.flush()
-                bad_index2_file.flush()
+            for writer in (good_read1_file, bad_read1_file, overlap_read1_file,
+                    good_read2_file, bad_read2_file, overlap_read2_file,
+                    good_index1_file, bad_index1_file, overlap_index1_file,
+                    good_index2_file, bad_index2_file, overlap_index2_file):
+                if writer != None:
+                    writer.close()
+        if self.compressPool != None:
+            self.compressPool.close()
+            self.compressPool.join()
+        perfstats.RUN.add("output.close", time.time() - time1)
 
         # print stat numbers
-        BAD_READS = TOTAL_READS - GOOD_READS
+        BAD_READS = c["TOTAL_READS"] - c["GOOD_READS"]
         result = {}
-        result['total_bases']=TOTAL_BASES
-        result['good_bases']=GOOD_BASES
-        result['total_reads']=TOTAL_READS
-        result['good_reads']=GOOD_READS
+        result['total_bases']=c["TOTAL_BASES"]
+        result['good_bases']=c["GOOD_BASES"]
+        result['total_reads']=c["TOTAL_READS"]
+        result['good_reads']=c["GOOD_READS"]
         result['bad_reads']=BAD_READS
-        result['bad_reads_with_bad_barcode']= BADBCD1 + BADBCD2
-        result['bad_reads_with_reads_in_bubble']= BADBBL
-        result['bad_reads_with_bad_read_length']= BADLEN + BADTRIM1 + BADTRIM2
-        result['bad_reads_with_polyX']= BADPOL
-        result['bad_reads_with_low_quality']=BADLQC
-        result['bad_reads_with_too_many_N']= BADNCT
-        result['bad_reads_with_bad_overlap']= BADOL + BADMISMATCH + BADINDEL
+        result['bad_reads_with_bad_barcode']= c["BADBCD1"] + c["BADBCD2"]
+        result['bad_reads_with_reads_in_bubble']= c["BADBBL"]
+        result['bad_reads_with_bad_read_length']= c["BADLEN"] + c["BADTRIM1"] + c["BADTRIM2"]
+        result['bad_reads_with_polyX']= c["BADPOL"]
+        result['bad_reads_with_low_quality']=c["BADLQC"]
+        result['bad_reads_with_too_many_N']= c["BADNCT"]
+        result['bad_reads_with_bad_overlap']= c["BADOL"] + c["BADMISMATCH"] + c["BADINDEL"]
 
         # plot result bar figure
         labels = ['good reads', 'has_polyX', 'low_quality', 'too_short', 'too_many_N']
-        counts = [GOOD_READS, BADPOL, BADLQC, BADLEN + BADTRIM1 + BADTRIM2, BADNCT]
+        counts = [c["GOOD_READS"], c["BADPOL"], c["BADLQC"], c["BADLEN"] + c["BADTRIM1"] + c["BADTRIM2"], c["BADNCT"]]
         colors = ['#66BB11', '#FF33AF', '#FFD3F2', '#FFA322', '#FF8899']
         if self.options.read2_file != None:
             labels.append('bad_overlap')
-            counts.append(BADOL + BADMISMATCH + BADINDEL)
+            counts.append(c["BADOL"] + c["BADMISMATCH"] + c["BADINDEL"])
             colors.append('#FF6600')
         if self.options.debubble:
             labels.append('in_bubble')
-            counts.append(BADBBL)
+            counts.append(c["BADBBL"])
             colors.append('#EEBB00')
         if self.options.barcode:
             labels.append('bad_barcode')
-            counts.append(BADBCD1 + BADBCD2)
+            counts.append(c["BADBCD1"] + c["BADBCD2"])
             colors.append('#CCDD22')
 
         for i in xrange(len(counts)):
-            labels[i] = labels[i] + ": " + str(counts[i]) + "(" + str(100.0 * float(counts[i])/TOTAL_READS) + "%)"
+            labels[i] = labels[i] + ": " + str(counts[i]) + "(" + str(100.0 * float(counts[i])/c["TOTAL_READS"]) + "%)"
 
-        r1qc_prefilter.plotFilterStats(labels, counts, colors, TOTAL_READS, os.path.join(qc_dir, "filter-stat.png"))
+        r1qc_prefilter.plotFilterStats(labels, counts, colors, c["TOTAL_READS"], os.path.join(qc_dir, "filter-stat.png"))
 
         stat={}
         # stat["options"]=self.options
         stat["summary"]=result
+        stat["bad_reads"]=badSink.summary()
+        stat["filter_stages"]=self.stageSummary(stats)
+        if self.adapterTrimmer != None:
+            stat["adapter_trimming"]=self.adapterSummary(stats)
         stat["command"]=makeDict(self.options)
         stat["kmer_content"] = {}
         stat["kmer_content"]["read1_prefilter"] = r1qc_prefilter.topKmerCount[0:10]
@@ -628,25 +1260,28 @@ class seqFilter:
             stat["kmer_content"]["read2_prefilter"] = r2qc_prefilter.topKmerCount[0:10]
             stat["kmer_content"]["read2_postfilter"] = r2qc_postfilter.topKmerCount[0:10]
             stat["overlap"]={}
-            stat["overlap"]['overlapped_pairs']=OVERLAPPED
-            if OVERLAPPED > 0:
-                stat["overlap"]['average_overlap_length']=float(OVERLAP_LEN_SUM/OVERLAPPED)
+            stat["overlap"]['overlapped_pairs']=c["OVERLAPPED"]
+            if c["OVERLAPPED"] > 0:
+                stat["overlap"]['average_overlap_length']=float(c["OVERLAP_LEN_SUM"]/c["OVERLAPPED"])
             else:
                 stat["overlap"]['average_overlap_length']=0.0
-            stat["overlap"]['bad_edit_distance']=BADOL
-            stat["overlap"]['bad_mismatch_bases']=BADMISMATCH
-            stat["overlap"]['bad_indel']=BADINDEL
-            stat["overlap"]['reads_with_corrected_mismatch_bases']=BASE_CORRECTED
+            stat["overlap"]['bad_edit_distance']=c["BADOL"]
+            stat["overlap"]['bad_mismatch_bases']=c["BADMISMATCH"]
+            stat["overlap"]['bad_indel']=c["BADINDEL"]
+            stat["overlap"]['reads_with_corrected_mismatch_bases']=c["BASE_CORRECTED"]
             stat["overlap"]['overlapped_area_edit_distance_histogram']=distance_histgram[0:10]
-            r1qc_prefilter.plotOverlapHistgram(overlap_histgram, readLen, TOTAL_READS, os.path.join(qc_dir, "overlap.png"))
+            r1qc_prefilter.plotOverlapHistgram(overlap_histgram, readLen, c["TOTAL_READS"], os.path.join(qc_dir, "overlap.png"))
+
+        #the report is written first, so its time is in after.json
+        self.addFiguresToReport(reporter)
+        reporter.output(os.path.join(qc_dir, "report.html"))
 
+        stat["performance"]=self.performanceSummary(stats, time.time() - runTime)
         stat_file = open(os.path.join(qc_dir, "after.json"), "w")
         stat_json = json.dumps(stat, sort_keys=True,indent=4, separators=(',', ': '))
         stat_file.write(stat_json)
         stat_file.close()
-
-        self.addFiguresToReport(reporter)
-        reporter.output(os.path.join(qc_dir, "report.html"))
+        return stat
 
     def addFiguresToReport(self, reporter):
         reporter.addFigure('Good reads and bad reads after filtering', 'filter-stat.png')
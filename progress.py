@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os,sys
+import time
+import json
+
+#progress of long runs
+#seqFilter reports the reads processed, the speed and the position in the input file every progress_interval seconds
+#the position of a .gz file is the position in the compressed file, so the percent and ETA are right for .gz files too
+#the status is also written to status.json in the QC folder, it is replaced atomically so a reader never gets a partial file
+#in processDir mode, the status of each file is sent to the scheduler, which prints one line for all files
+
+STATUS_FILE = "status.json"
+
+def formatSeconds(seconds):
+    if seconds == None:
+        return "unknown"
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+#write the status to a temporary file, and then rename it to filename
+def writeStatus(filename, status):
+    tmp = filename + ".tmp"
+    f = open(tmp, "w")
+    f.write(json.dumps(status, sort_keys=True,indent=4, separators=(',', ': ')))
+    f.close()
+    os.rename(tmp, filename)
+
+#the speed, percent and ETA of reads processed in elapsed seconds, position and size are in bytes of input
+def makeStatus(name, state, reads, position, size, elapsed):
+    status = {}
+    status['file'] = name
+    status['state'] = state
+    status['reads'] = reads
+    status['input_bytes'] = position
+    status['input_size'] = size
+    status['elapsed_seconds'] = round(elapsed, 1)
+    status['reads_per_second'] = 0.0
+    status['mb_per_second'] = 0.0
+    status['percent'] = None
+    status['eta_seconds'] = None
+    if elapsed > 0:
+        status['reads_per_second'] = round(reads / elapsed, 1)
+        if position != None:
+            status['mb_per_second'] = round(position / elapsed / 1024.0 / 1024.0, 2)
+    if position != None and size != None and size > 0:
+        status['percent'] = round(min(100.0, 100.0 * position / size), 1)
+        if state == "done":
+            status['eta_seconds'] = 0
+        elif position > 0:
+            status['eta_seconds'] = int(elapsed * (size - position) / position)
+    status['updated'] = time.time()
+    return status
+
+def formatStatus(status):
+    line = status['file'] + ": " + str(status['reads']) + " reads, " + "%.0f" % status['reads_per_second'] + " reads/s, "
+    line += "%.2f" % status['mb_per_second'] + " MB/s"
+    if status['percent'] != None:
+        line += ", " + "%.1f" % status['percent'] + "%, ETA " + formatSeconds(status['eta_seconds'])
+    if status['state'] == "done":
+        line += ", done"
+    return line
+
+class ProgressReporter:
+
+    #the progress is printed and written to statusFile every interval seconds
+    #if queue is not None, the status is sent to the queue instead of printed
+    #the done status is always sent to the queue, the scheduler starts the next job when it is received
+    def __init__(self, name, statusFile, interval, queue = None):
+        self.name = name
+        self.statusFile = statusFile
+        self.interval = interval
+        self.queue = queue
+        self.start = time.time()
+        self.last = self.start
+
+    #called after each chunk of reads is filtered, reads is the count of reads filtered
+    #reader is the fastq.PairedReader of the run, which gives the position in the input files
+    def update(self, reads, reader):
+        if self.interval <= 0:
+            return
+        now = time.time()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        self.report("running", reads, reader)
+
+    def finish(self, reads, reader):
+        if self.interval <= 0 and self.queue == None:
+            return
+        self.report("done", reads, reader)
+
+    def report(self, state, reads, reader):
+        (position, size) = reader.position()
+        #the reader reads ahead of the filter, so the position of the filtered reads is estimated
+        #by the ratio of the reads filtered to the reads read
+        if position != None and reader.records > 0:
+            position = position * min(reads, reader.records) / reader.records
+        status = makeStatus(self.name, state, reads, position, size, time.time() - self.start)
+        if self.queue != None:
+            self.queue.put(status)
+        elif self.interval > 0:
+            print(formatStatus(status))
+            sys.stdout.flush()
+        if self.interval > 0:
+            writeStatus(self.statusFile, status)
+
+class ProgressAggregator:
+
+    #sizes is a dict of file name -> input size of all files, so the percent counts the files not started yet
+    def __init__(self, sizes, statusFile, interval):
+        self.sizes = sizes
+        self.statusFile = statusFile
+        self.interval = interval
+        self.start = time.time()
+        self.last = self.start
+        self.statuses = {}
+
+    def update(self, status):
+        self.statuses[status['file']] = status
+
+    def status(self):
+        reads = 0
+        position = 0
+        for status in self.statuses.values():
+            reads += status['reads']
+            position += status['input_bytes'] or 0
+        size = sum(self.sizes.values())
+        done = len([s for s in self.statuses.values() if s['state'] == "done"])
+        state = "running"
+        if done == len(self.sizes):
+            state = "done"
+        status = makeStatus(str(done) + "/" + str(len(self.sizes)) + " files", state, reads, position, size, time.time() - self.start)
+        status['files'] = self.statuses
+        return status
+
+    #print the aggregated progress if it is not printed in interval seconds
+    def tick(self):
+        if self.interval <= 0:
+            return
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def finish(self):
+        if self.interval > 0:
+            self.report()
+
+    def report(self):
+        status = self.status()
+        print(formatStatus(status))
+        sys.stdout.flush()
+        writeStatus(self.statusFile, status)
@@ -1,4 +1,5 @@
 import os,sys
+import perfstats
 
 def formatDivID(str):
     str = str.replace(" ", "-")
@@ -14,6 +15,7 @@ class QCReporter:
     def addFigure(self, title, figure, summary=''):
         self.figures.append((title, figure, summary))
 
+    @perfstats.timed("report.output")
     def output(self, filename):
         io = open(filename, "w")
         self.outputHeader(io)
@@ -3,6 +3,8 @@ from optparse import OptionParser
 import time
 import fastq
 import util
+import seqkernel
+import perfstats
 
 HAVE_MATPLOTLIB = True
 WARNED_PLOT_FAILURE = False
@@ -22,6 +24,8 @@ if sys.executable.endswith("pypy"):
 MAX_LEN = 1000
 ALL_BASES = ("A", "T", "C", "G");
 KMER_TOP = 10
+# the first reads are skipped by statFile because usually they are not stable
+READ_TO_SKIP = 1000
 
 ########################### QualityControl
 class QualityControl:
@@ -91,10 +95,26 @@ class QualityControl:
                 self.kmerCount[kmer] += 1
             else:
                 self.kmerCount[kmer] = 1
-                rcKmer = util.reverseComplement(kmer)
+                rcKmer = seqkernel.reverseComplement(kmer)
                 if rcKmer not in self.kmerCount:
                     self.kmerCount[rcKmer] = 0
 
+    #add the stats of another QualityControl, which has stated other reads
+    def merge(self, other):
+        self.readCount += other.readCount
+        self.totalKmer += other.totalKmer
+        for i in xrange(MAX_LEN):
+            self.totalQual[i] += other.totalQual[i]
+            self.totalNum[i] += other.totalNum[i]
+            self.gcHistogram[i] += other.gcHistogram[i]
+            self.totalDiscontinuity[i] += other.totalDiscontinuity[i]
+        for base in ALL_BASES:
+            for i in xrange(MAX_LEN):
+                self.baseCounts[base][i] += other.baseCounts[base][i]
+                self.baseTotalQual[base][i] += other.baseTotalQual[base][i]
+        for kmer, count in other.kmerCount.iteritems():
+            self.kmerCount[kmer] = self.kmerCount.get(kmer, 0) + count
+
     def calcReadLen(self):
         for pos in xrange(MAX_LEN):
             hasData = False
@@ -127,7 +147,8 @@ class QualityControl:
             self.meanDiscontinuity[pos] = float(self.totalDiscontinuity[pos])/float(self.totalNum[pos])
 
     def sortKmer(self):
-        self.topKmerCount = sorted(self.kmerCount.items(), key=lambda x: x[1], reverse=True)
+        #the kmers with the same count are sorted by name, so the order doesn't depend on the order of counting
+        self.topKmerCount = sorted(self.kmerCount.items(), key=lambda x: (-x[1], x[0]))
 
     def plotQuality(self, filename, prefix=""):
         colors = {'A':'red', 'T':'purple', 'C':'blue', 'G':'green'}
@@ -195,10 +216,11 @@ class QualityControl:
         forward = [0 for i in xrange(top)]
         reverse = [0 for i in xrange(top)]
         maxValue = 0
+        kmers = [self.topKmerCount[i+shift][0] for i in xrange(top)]
+        rcKmers = seqkernel.batchReverseComplement(kmers)
         for i in xrange(top):
-            kmer = self.topKmerCount[i+shift][0]
-            forward[i] = self.kmerCount[kmer]
-            reverse[i] = self.kmerCount[util.reverseComplement(kmer)]
+            forward[i] = self.kmerCount[kmers[i]]
+            reverse[i] = self.kmerCount[rcKmers[i]]
             maxValue = max(max(forward[i], reverse[i]), maxValue)
 
         plt.figure(1)
@@ -212,6 +234,7 @@ class QualityControl:
         plt.savefig(filename)
         plt.close(1)
 
+    @perfstats.timed("qc.plot")
     def plot(self, folder=".", prefix=""):
         if self.readLen == 0:
             return
@@ -266,6 +289,7 @@ class QualityControl:
                 WARNED_PLOT_FAILURE = True
                 print("Failed to plot figures, please check your settings...")
 
+    @perfstats.timed("qc.qc")
     def qc(self): 
         self.calcReadLen()
         self.calcPercents()
@@ -273,16 +297,29 @@ class QualityControl:
         self.calcDiscontinuity()
         self.sortKmer()
         
-    def statFile(self, filename):
-        READ_TO_SKIP = 1000
-        reader = fastq.Reader(filename)
+    #not timed itself, the reading and stat are timed once as qc.statReads
+    def statFile(self, filename, decompressor = "auto", useMmap = False, compact = False):
+        reader = fastq.openReader(filename, decompressor, useMmap, compact)
+        self.statReads(iter(reader.nextRead, None))
+
+    #how many reads statReads() consumes, None means all reads
+    def headSize(self):
+        if self.sampleLimit > 0:
+            return READ_TO_SKIP + self.sampleLimit
+        return None
+
+    #stat the reads like statFile(), reads can be the buffered head of a stream
+    #the sampling and qc() are timed separately as qc.statReads and qc.qc, so no time is counted twice
+    def statReads(self, reads):
+        self.sampleReads(reads)
+        self.qc()
+
+    @perfstats.timed("qc.statReads", lambda self: self.readCount)
+    def sampleReads(self, reads):
         stat_reads_num = 0
         skipped_reads = []
         #sample up to maxSample reads for stat
-        while True:
-            read = reader.nextRead()
-            if read==None:
-                break
+        for read in reads:
             self.readCount += 1
             # here we skip the first 1000 reads because usually they are usually not stable
             if self.readCount < READ_TO_SKIP:
@@ -298,8 +335,6 @@ class QualityControl:
             for read in skipped_reads:
                 self.statRead(read)
 
-        self.qc()
-
     def autoTrim(self):
         #use (center-5, center+5) as initial good segment        
         center = int(self.readLen/2)
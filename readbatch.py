@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import os,sys
+from array import array
+
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+#compact representation of a batch of reads
+#the records of a block stay in the block buffer, and each line of a record is a (start, end) offset range of it
+#a read is a BatchRead view of (batch, index), the line strings are only sliced out when they are accessed
+#a sliced line is cached, so the stages reading the same line again don't slice it again
+#trimming a read moves its offsets, and only the lines assigned by a stage are stored as strings
+
+WHITESPACES = " \t\r\n\x0b\x0c"
+
+class ReadBatch:
+
+    #line j of record i is buffer[starts[4*i+j] : ends[4*i+j]]
+    def __init__(self, buffer, starts, ends):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts) / 4
+
+    def __getitem__(self, i):
+        return BatchRead(self, i)
+
+    def reads(self):
+        return [BatchRead(self, i) for i in xrange(len(self))]
+
+class BatchRead(object):
+
+    __slots__ = ("batch", "index", "lines", "cached")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        #the lines assigned by the stages, None means the line is still in the buffer
+        self.lines = None
+        #the lines sliced out of the buffer, None means the line is not sliced yet
+        self.cached = None
+
+    def __getitem__(self, j):
+        if self.lines != None and self.lines[j] != None:
+            return self.lines[j]
+        if j < 0:
+            j += 4
+        if self.cached == None:
+            self.cached = [None, None, None, None]
+        elif self.cached[j] != None:
+            return self.cached[j]
+        k = 4 * self.index + j
+        line = self.batch.buffer[self.batch.starts[k] : self.batch.ends[k]]
+        self.cached[j] = line
+        return line
+
+    def __setitem__(self, j, line):
+        if self.lines == None:
+            self.lines = [None, None, None, None]
+        self.lines[j] = line
+
+    def __len__(self):
+        return 4
+
+    def __iter__(self):
+        for j in xrange(4):
+            yield self[j]
+
+    #same as read[j] = read[j][front:-tail], or read[j][front:] if tail is 0, for sequence and quality
+    def trim(self, front, tail):
+        for j in (1, 3):
+            if self.lines != None and self.lines[j] != None:
+                if tail > 0:
+                    self.lines[j] = self.lines[j][front:-tail]
+                else:
+                    self.lines[j] = self.lines[j][front:]
+                continue
+            #the cached line is sliced again from the moved offsets when it is accessed
+            if self.cached != None:
+                self.cached[j] = None
+            k = 4 * self.index + j
+            start = min(self.batch.starts[k] + front, self.batch.ends[k])
+            if tail > 0:
+                self.batch.ends[k] = max(self.batch.ends[k] - tail, start)
+            self.batch.starts[k] = start
+
+    #count sub in line j without slicing it out
+    def count(self, j, sub):
+        if self.lines != None and self.lines[j] != None:
+            return self.lines[j].count(sub)
+        if self.cached != None and self.cached[j] != None:
+            return self.cached[j].count(sub)
+        k = 4 * self.index + j
+        return self.batch.buffer.count(sub, self.batch.starts[k], self.batch.ends[k])
+
+#parse the complete records in data
+#final means data is the end of the file, then the last line may have no line break
+#returns (batch, consumed bytes, eof), eof is True if an empty line is met, which means the end of the file
+def parseBlock(data, final):
+    if HAVE_NUMPY:
+        return parseBlockNumpy(data, final)
+    starts = array("l")
+    ends = array("l")
+    size = len(data)
+    find = data.find
+    pos = 0
+    eof = False
+    complete = True
+    while complete and not eof:
+        recordStart = pos
+        for j in xrange(4):
+            if pos >= size:
+                complete = False
+                break
+            end = find("\n", pos)
+            if end < 0:
+                if not final:
+                    complete = False
+                    break
+                end = size
+            nextLine = end + 1
+            #same as rstrip()
+            while end > pos and data[end-1] in WHITESPACES:
+                end -= 1
+            #an empty line means the end of the file, same as fastq.Reader
+            if end == pos:
+                eof = True
+                break
+            starts.append(pos)
+            ends.append(end)
+            pos = nextLine
+        if not complete or eof:
+            records = len(starts) / 4
+            del starts[4*records:]
+            del ends[4*records:]
+            pos = recordStart
+    return (ReadBatch(data, starts, ends), min(pos, size), eof)
+
+if HAVE_NUMPY:
+    WHITESPACE_TABLE = numpy.zeros(256, dtype=bool)
+    for c in WHITESPACES:
+        WHITESPACE_TABLE[ord(c)] = True
+
+def parseBlockNumpy(data, final):
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    size = len(data)
+    breaks = numpy.flatnonzero(buf == 10)
+    lineStarts = numpy.concatenate(([0], breaks + 1))
+    lineEnds = breaks
+    #the last line may have no line break
+    if final and lineStarts[-1] < size:
+        lineEnds = numpy.concatenate((breaks, [size]))
+        lineStarts = numpy.concatenate((lineStarts, [size]))
+    starts = lineStarts[0:len(lineEnds)]
+    ends = lineEnds.copy()
+    #same as rstrip()
+    while True:
+        strip = (ends > starts) & WHITESPACE_TABLE[buf[numpy.maximum(ends - 1, 0)]]
+        if not strip.any():
+            break
+        ends[strip] -= 1
+    #an empty line means the end of the file, same as fastq.Reader
+    eof = False
+    empty = numpy.flatnonzero(ends == starts)
+    lines = len(ends)
+    if len(empty) > 0:
+        eof = True
+        lines = empty[0]
+    records = lines / 4
+    consumed = min(int(lineStarts[4*records]), size)
+    return (ReadBatch(data, array("l", starts[0:4*records].tolist()), array("l", ends[0:4*records].tolist())), consumed, eof)
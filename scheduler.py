@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import os,sys
+import time
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+#the scheduler of the jobs of processDir, each job filters a file/pair in a child process
+#at most maxJobs jobs are filtering at the same time, and the estimated memory of the running jobs is within memoryBudget
+#the largest jobs are started first, so a large job started last doesn't make the whole run longer
+#a job sends a done status when its filtering is finished, then the next job is started while it writes the QC and report,
+#so the next file is opened and decompressed before the slot is free, this job still counts in memoryBudget until it exits
+#only one job can be started early like this, so at most maxJobs + 1 jobs run at the same time
+#a job sends its summary to the scheduler before it exits, the summaries and exit codes are collected by the scheduler
+
+#the estimated memory of a filtering process in MB
+PROCESS_MEMORY = 300
+
+#the estimated memory of a job in MB, each filter process has its own reads and stats
+def estimateMemory(options):
+    return PROCESS_MEMORY * (1 + max(0, options.filter_processes - 1))
+
+class Job:
+
+    #target(args..., queue) runs in the child process
+    def __init__(self, name, size, memory, target, args):
+        self.name = name
+        self.size = size
+        self.memory = memory
+        self.target = target
+        self.args = args
+        self.process = None
+        self.finishing = False
+        self.summary = None
+        self.exitCode = None
+        self.startTime = None
+        self.seconds = None
+
+class JobScheduler:
+
+    #progress is a progress.ProgressAggregator, which gets the status of the jobs
+    def __init__(self, jobs, maxJobs, memoryBudget, progress):
+        self.jobs = jobs
+        self.maxJobs = max(1, maxJobs)
+        self.memoryBudget = memoryBudget
+        self.progress = progress
+        self.queue = Queue()
+        self.running = []
+
+    def canStart(self, job):
+        if len(self.running) == 0:
+            return True
+        #the finishing jobs count too, so a slow QC and report of several jobs doesn't start more jobs
+        if len(self.running) > self.maxJobs:
+            return False
+        filtering = len([j for j in self.running if not j.finishing])
+        if filtering >= self.maxJobs:
+            return False
+        if self.memoryBudget > 0:
+            memory = sum([j.memory for j in self.running])
+            if memory + job.memory > self.memoryBudget:
+                return False
+        return True
+
+    def start(self, job):
+        job.startTime = time.time()
+        job.process = Process(target = job.target, args = job.args + (self.queue, ))
+        job.process.start()
+        self.running.append(job)
+
+    def handle(self, status):
+        for job in self.running:
+            if job.name == status['file']:
+                if status['state'] == "done":
+                    job.finishing = True
+                elif status['state'] == "finished":
+                    job.summary = status['summary']
+                    return
+        self.progress.update(status)
+
+    #read all messages in the queue
+    def drain(self):
+        while True:
+            try:
+                self.handle(self.queue.get_nowait())
+            except Empty:
+                return
+
+    def reap(self):
+        for job in list(self.running):
+            if not job.process.is_alive():
+                #the messages sent before the job exits
+                self.drain()
+                job.process.join()
+                job.exitCode = job.process.exitcode
+                job.seconds = time.time() - job.startTime
+                self.running.remove(job)
+
+    #run all jobs, returns the jobs with their summaries and exit codes
+    def run(self):
+        pending = sorted(self.jobs, key = lambda job: job.size, reverse = True)
+        while len(pending) > 0 or len(self.running) > 0:
+            while len(pending) > 0 and self.canStart(pending[0]):
+                self.start(pending.pop(0))
+            try:
+                self.handle(self.queue.get(timeout = 0.5))
+            except Empty:
+                pass
+            self.reap()
+            self.progress.tick()
+        self.progress.finish()
+        return self.jobs
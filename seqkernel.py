@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os,sys
+import string
+import batchkernels
+
+HAVE_NUMPY = True
+try:
+    import numpy
+except ImportError:
+    HAVE_NUMPY = False
+
+#table driven sequence primitives, which are called many times for each pair
+#reverse complement translates the bases with a table of 256 characters and reverses the string, both are done by str in C
+#a base not in COMP is translated to N
+#hamming distance and mismatch positions compare the strings as uint8 buffers with numpy,
+#a loop in python is used without numpy, or for short strings which are faster to compare in python
+
+COMP = {"A" : "T", "T" : "A", "C" : "G", "G" : "C", "a" : "t", "t" : "a", "c" : "g", "g" : "c", "N":"N", "\n":"\n"}
+
+ALL_CHARS = "".join([chr(i) for i in xrange(256)])
+COMP_TABLE = string.maketrans(ALL_CHARS, "".join([COMP.get(c, "N") for c in ALL_CHARS]))
+
+#the strings shorter than this are compared in python
+NUMPY_MIN_LEN = 32
+
+def complement(base):
+    return base.translate(COMP_TABLE)
+
+def reverseComplement(seq):
+    return seq.translate(COMP_TABLE)[::-1]
+
+#the reverse complements of many reads, by one translate of all reads
+#the reverse of the joined reads has the reverse complement of the last read first
+def batchReverseComplement(seqs):
+    joined = "".join(seqs).translate(COMP_TABLE)[::-1]
+    result = [None for s in seqs]
+    pos = 0
+    for i in xrange(len(seqs)-1, -1, -1):
+        length = len(seqs[i])
+        result[i] = joined[pos:pos+length]
+        pos += length
+    return result
+
+#the count of different characters in the first min(len(s1), len(s2)) characters, s1 and s2 can be str or bytearray
+def hammingDistance(s1, s2):
+    length = min(len(s1), len(s2))
+    if HAVE_NUMPY and length >= NUMPY_MIN_LEN:
+        return int(numpy.count_nonzero(numpy.frombuffer(s1, numpy.uint8, length) != numpy.frombuffer(s2, numpy.uint8, length)))
+    d = 0
+    for i in xrange(length):
+        if s1[i] != s2[i]:
+            d += 1
+    return d
+
+#the positions of the different characters in the first min(len(s1), len(s2)) characters, in increasing order
+def mismatchPositions(s1, s2):
+    length = min(len(s1), len(s2))
+    if HAVE_NUMPY and length >= NUMPY_MIN_LEN:
+        return numpy.flatnonzero(numpy.frombuffer(s1, numpy.uint8, length) != numpy.frombuffer(s2, numpy.uint8, length)).tolist()
+    return [i for i in xrange(length) if s1[i] != s2[i]]
+
+#change the characters of s at the positions, changes is a list of (position, character), a position can be negative
+#s is copied to a bytearray once, instead of a list for each character
+def substitute(s, changes):
+    buf = bytearray(s)
+    for pos, c in changes:
+        buf[pos] = c
+    return str(buf)
+
+#the hamming distances of many pairs of strings, as a list of int
+#with numpy, the strings are packed into two padded matrices and compared at once
+def hammingDistances(seqs1, seqs2):
+    if not HAVE_NUMPY or len(seqs1) == 0:
+        return [hammingDistance(s1, s2) for s1, s2 in zip(seqs1, seqs2)]
+    matrix1, lengths1 = batchkernels.toMatrix(seqs1, 0)
+    matrix2, lengths2 = batchkernels.toMatrix(seqs2, 0)
+    width = min(matrix1.shape[1], matrix2.shape[1])
+    lengths = numpy.minimum(lengths1, lengths2)
+    mask = numpy.arange(width) < lengths[:, None]
+    return ((matrix1[:, 0:width] != matrix2[:, 0:width]) & mask).sum(axis=1).tolist()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import os,sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import testdata
+import util
+import adaptertrim
+
+#the python and native scans of AdapterTrimmer must both give the result of a plain search of each adapter,
+#and after.py --adapter_trim must trim the reads and count them in after.json like this search
+
+AFTER_PY = os.path.join(testdata.ROOT, "after.py")
+MIN_PARTIAL = 5
+
+#the (position, adapter, partial) of a read by searching each adapter, same as AdapterTrimmer.scan
+#the read is trimmed at the first full adapter in it, or else at the longest suffix which is a prefix of an adapter
+def searchAdapters(adapters, seq, minPartial):
+    seq = seq.upper()
+    best = len(seq)
+    bestAdapter = -1
+    for k in xrange(len(adapters)):
+        position = seq.find(adapters[k][1])
+        if position >= 0 and position < best:
+            best = position
+            bestAdapter = k
+    if bestAdapter >= 0:
+        return (best, bestAdapter, False)
+    for position in xrange(max(0, len(seq) - minPartial + 1)):
+        for k in xrange(len(adapters)):
+            if adapters[k][1].startswith(seq[position:]):
+                return (position, k, True)
+    return (len(seq), -1, False)
+
+#random reads with a full adapter, a partial adapter at the 3' end, a mutated adapter or no adapter,
+#with N bases and lower case bases
+def randomReads(rand, adapters, number):
+    reads = []
+    for i in xrange(number):
+        length = rand.randint(20, 150)
+        seq = "".join([rand.choice("ACGTN" if rand.random() < 0.05 else "ACGT") for x in xrange(length)])
+        adapter = rand.choice(adapters)[1]
+        kind = rand.randint(0, 3)
+        position = rand.randint(0, length)
+        if kind == 0:
+            seq = (seq[0:position] + adapter + seq)[0:max(length, position + len(adapter))]
+        elif kind == 1:
+            seq = seq[0:position] + adapter[0:length - position]
+        elif kind == 2:
+            mutated = list(adapter)
+            mutated[rand.randint(0, len(mutated) - 1)] = "N"
+            seq = (seq[0:position] + "".join(mutated) + seq)[0:length]
+        if rand.random() < 0.1:
+            seq = seq.lower()
+        reads.append(seq)
+    return reads
+
+class AdapterScanTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.adapters = adaptertrim.loadAdapters("all", None)
+        cls.trimmer = adaptertrim.AdapterTrimmer(cls.adapters, MIN_PARTIAL)
+        cls.reads = randomReads(random.Random(0), cls.adapters, 5000)
+        cls.expected = [searchAdapters(cls.adapters, seq, MIN_PARTIAL) for seq in cls.reads]
+
+    def testReadsCoverAllCases(self):
+        self.assertTrue(len([r for r in self.expected if r[1] >= 0 and not r[2]]) > 1000)
+        self.assertTrue(len([r for r in self.expected if r[2]]) > 500)
+        self.assertTrue(len([r for r in self.expected if r[1] < 0]) > 500)
+
+    def checkScan(self, scanName, scan):
+        different = []
+        for k in xrange(len(self.reads)):
+            result = scan(self.reads[k])
+            if result != self.expected[k]:
+                different.append((self.reads[k], self.expected[k], result))
+        if len(different) > 0:
+            self.fail(scanName + " differs from searchAdapters for " + str(len(different)) + " reads, the first is " +
+                different[0][0] + ": " + str(different[0][1]) + " != " + str(different[0][2]))
+
+    def testScanPython(self):
+        self.checkScan("scanPython", self.trimmer.scanPython)
+
+    @unittest.skipUnless(util.ADAPTER_CTYPES_LOADED, "the native adapter scan is not loaded, run make to build editdistance/libed.so")
+    def testScanNative(self):
+        self.checkScan("scanNative", self.trimmer.scanNative)
+
+class AdapterTrimRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def afterJson(self, name):
+        return json.load(open(os.path.join(self.folder, "QC", name, "after.json")))
+
+    def runAfter(self, args):
+        code = testdata.runAfter(AFTER_PY, self.folder, args)
+        if code != 0:
+            self.fail("after.py " + " ".join(args) + " exited with " + str(code) + ":\n" + open(os.path.join(self.folder, "log.txt")).read())
+
+    #the reads of the testdata set are trimmed at testdata.ADAPTER, which starts with TruSeq_Read1
+    #no front and tail trimming, so every read is scanned as it is in the input
+    def testAdapterCounts(self):
+        testdata.writePairs(self.folder, testdata.PAIRS)
+        self.runAfter(["-1", "S_R1.fq", "-2", "S_R2.fq", "--adapter_trim", "all", "--trim_front", "0", "--trim_tail", "0", "--draw", "off"])
+        adapters = adaptertrim.loadAdapters("all", None)
+        reads = 0
+        bases = 0
+        partial = 0
+        byAdapter = {}
+        for name in ("S_R1.fq", "S_R2.fq"):
+            for record in testdata.readRecords(os.path.join(self.folder, name)):
+                seq = record.split("\n")[1]
+                (position, adapter, isPartial) = searchAdapters(adapters, seq, MIN_PARTIAL)
+                if adapter >= 0:
+                    reads += 1
+                    bases += len(seq) - position
+                    if isPartial:
+                        partial += 1
+                    byAdapter[adapters[adapter][0]] = byAdapter.get(adapters[adapter][0], 0) + 1
+        self.assertTrue(byAdapter.get("TruSeq_Read1", 0) > 100)
+        result = self.afterJson("S_R1.fq")["adapter_trimming"]
+        self.assertEqual(result["adapters"], len(adapters))
+        self.assertEqual(result["min_partial"], MIN_PARTIAL)
+        self.assertEqual(result["trimmed_reads"], reads)
+        self.assertEqual(result["trimmed_bases"], bases)
+        self.assertEqual(result["partial_adapter_reads"], partial)
+        self.assertEqual(result["trimmed_reads_by_adapter"], byAdapter)
+
+    #a read shorter than 5 bp after trimming is BADTRIM1/BADTRIM2, a longer short read is filtered by the length filter
+    def testShortReads(self):
+        adapter = testdata.ADAPTER
+        rand = random.Random(2)
+        names = ["A_R1.fq", "A_R2.fq"]
+        files = [open(os.path.join(self.folder, name), "w") for name in names]
+        #the adapter position in read1 and read2 of the pairs, and the expected flag
+        pairs = [(4, 101, "BADTRIM1"), (0, 101, "BADTRIM1"), (101, 3, "BADTRIM2"), (5, 101, "BADLEN"), (101, 101, None)] * 20
+        for k in xrange(len(pairs)):
+            name = "@A:%d" % k
+            for (mate, position) in ((0, pairs[k][0]), (1, pairs[k][1])):
+                seq = "".join([rand.choice("ACGT") for x in xrange(testdata.READ_LEN)])
+                seq = (seq[0:position] + adapter + seq)[0:testdata.READ_LEN]
+                files[mate].write(name + " " + str(mate + 1) + ":N:0:ACGT\n" + seq + "\n+\n" + "I" * testdata.READ_LEN + "\n")
+        for f in files:
+            f.close()
+        self.runAfter(["-1", "A_R1.fq", "-2", "A_R2.fq", "--adapter_trim", "truseq", "--trim_front", "0", "--trim_tail", "0", "--draw", "off"])
+        flags = {}
+        for record in testdata.readRecords(os.path.join(self.folder, "bad", "A_R1.bad.fq")):
+            #the flag is prepended to the read name A:k
+            (flag, k) = record.split("\n")[0].split(" ")[0][1:].split(":")
+            flags[int(k)] = flag[0:-len("A")]
+        for k in xrange(len(pairs)):
+            self.assertEqual(flags.get(k), pairs[k][2], "pair " + str(k))
+        summary = self.afterJson("A_R1.fq")["summary"]
+        self.assertEqual(summary["bad_reads_with_bad_read_length"], 80)
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import os,sys
+import shutil
+import tempfile
+import unittest
+import testdata
+import fastq
+import fastqindex
+
+#a record reached by seeking with the sidecar index must be the same record as read from the start of the file,
+#and a sidecar of a modified file must not be used
+
+#a small interval, so the 1000 records have many indexed records
+INTERVAL = 7
+#the records to seek to: the first, around indexed records, in the middle and at the end
+RECORDS = [0, 1, 6, 7, 8, 13, 14, 500, 993, 994, 998, 999]
+
+def readAll(reader):
+    records = []
+    while True:
+        read = reader.nextRead()
+        if read == None:
+            break
+        records.append(list(read))
+    return records
+
+class FastqIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        testdata.writePairs(self.folder, testdata.PAIRS)
+        self.filename = os.path.join(self.folder, "S_R1.fq")
+        self.records = readAll(fastq.BlockReader(self.filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    #readers of the indexed file, with small blocks so the records after a seek cross the blocks
+    def readers(self):
+        return {
+            "BlockReader" : fastq.BlockReader(self.filename, blockSize = 1000),
+            "BlockReader compact" : fastq.BlockReader(self.filename, blockSize = 1000, compact = True),
+            "MmapReader" : fastq.MmapReader(self.filename, batchSize = 5),
+        }
+
+    def testBuildIndex(self):
+        index = fastqindex.buildIndex(self.filename, INTERVAL)
+        self.assertEqual(index.records, testdata.PAIRS)
+        self.assertEqual(len(index.offsets), (testdata.PAIRS + INTERVAL - 1) / INTERVAL)
+        data = open(self.filename, "rb").read()
+        for i in xrange(len(index.offsets)):
+            self.assertEqual(data[index.offsets[i]:].split("\n")[0:4], self.records[i * INTERVAL])
+        #the offsets are same when the file is read in blocks smaller than a record
+        blockSize = fastqindex.BLOCK_SIZE
+        chunkSize = fastqindex.COUNT_CHUNK_SIZE
+        try:
+            fastqindex.BLOCK_SIZE = 1000
+            fastqindex.COUNT_CHUNK_SIZE = 100
+            self.assertEqual(fastqindex.buildIndex(self.filename, INTERVAL).offsets, index.offsets)
+        finally:
+            fastqindex.BLOCK_SIZE = blockSize
+            fastqindex.COUNT_CHUNK_SIZE = chunkSize
+
+    def testLocate(self):
+        index = fastqindex.buildIndex(self.filename, INTERVAL)
+        self.assertEqual(index.locate(0), (0, 0))
+        self.assertEqual(index.locate(15), (index.offsets[2], 1))
+        self.assertEqual(index.locate(testdata.PAIRS), (index.offsets[-1], testdata.PAIRS - (len(index.offsets) - 1) * INTERVAL))
+        self.assertRaises(IndexError, index.locate, -1)
+        self.assertRaises(IndexError, index.locate, testdata.PAIRS + 1)
+
+    def testSeekRecord(self):
+        index = fastqindex.buildIndex(self.filename, INTERVAL)
+        for name, reader in self.readers().items():
+            for record in RECORDS + [3, 999, 0]:
+                fastqindex.seekRecord(reader, index, record)
+                expected = self.records[record:record + 10]
+                reads = [list(reader.nextRead()) for k in xrange(len(expected))]
+                self.assertEqual(reads, expected, name + " at record " + str(record))
+            fastqindex.seekRecord(reader, index, testdata.PAIRS)
+            self.assertEqual(reader.nextRead(), None, name)
+
+    def testRanges(self):
+        index = fastqindex.buildIndex(self.filename, INTERVAL)
+        for n in (1, 3, 4, 1000):
+            ranges = index.ranges(n)
+            self.assertEqual(len(ranges), min(n, len(index.offsets)))
+            self.assertEqual(sum([count for (first, count, offset) in ranges]), testdata.PAIRS)
+            for name, reader in self.readers().items():
+                next = 0
+                for (first, count, offset) in ranges:
+                    self.assertEqual(first, next)
+                    self.assertEqual(first % INTERVAL, 0)
+                    reader.seek(offset)
+                    reads = [list(reader.nextRead()) for k in xrange(count)]
+                    self.assertEqual(reads, self.records[first:first + count], name + " range at record " + str(first))
+                    next = first + count
+
+    def testSidecar(self):
+        indexFile = fastqindex.indexFileName(self.filename)
+        index = fastqindex.loadOrBuildIndex(self.filename, INTERVAL)
+        self.assertTrue(os.path.exists(indexFile))
+        loaded = fastqindex.loadIndex(self.filename)
+        self.assertEqual((loaded.interval, loaded.records, loaded.offsets), (INTERVAL, index.records, index.offsets))
+        #another interval is rebuilt
+        self.assertEqual(fastqindex.loadOrBuildIndex(self.filename, INTERVAL + 1).interval, INTERVAL + 1)
+        fastqindex.loadOrBuildIndex(self.filename, INTERVAL)
+
+        #the modification time is changed, but not the size
+        st = os.stat(self.filename)
+        os.utime(self.filename, (st.st_atime, st.st_mtime - 10))
+        self.assertEqual(fastqindex.loadIndex(self.filename), None)
+        fastqindex.loadOrBuildIndex(self.filename, INTERVAL)
+        self.assertNotEqual(fastqindex.loadIndex(self.filename), None)
+
+        #records are appended, the index is rebuilt with them
+        f = open(self.filename, "a")
+        for record in self.records[0:20]:
+            f.write("\n".join(record) + "\n")
+        f.close()
+        self.assertEqual(fastqindex.loadIndex(self.filename), None)
+        index = fastqindex.loadOrBuildIndex(self.filename, INTERVAL)
+        self.assertEqual(index.records, testdata.PAIRS + 20)
+        self.assertEqual(fastqindex.loadIndex(self.filename).records, testdata.PAIRS + 20)
+        reader = fastq.BlockReader(self.filename)
+        fastqindex.seekRecord(reader, index, testdata.PAIRS + 5)
+        self.assertEqual(list(reader.nextRead()), self.records[5])
+
+        #a broken sidecar is not used
+        open(indexFile, "wb").write("FQI1")
+        self.assertEqual(fastqindex.loadIndex(self.filename), None)
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import os,sys
+import random
+import unittest
+import testdata
+import filterstages
+import preprocesser
+
+#stage_order adaptive must give every record the same flag whichever way the records are split into chunks
+#and filtered by processes, since each window of records is filtered from the order of precedence
+
+#a record is (polyX, lowQual, N) of booleans, each stage rejects the records with its boolean set
+def makePipeline(order, window):
+    stages = [filterstages.FilterStage("polyX", 5.0, lambda r1, r2, counts: "BADPOL" if r1[0] else None),
+        filterstages.FilterStage("low_quality", 1.0, lambda r1, r2, counts: "BADLQC" if r1[1] else None),
+        filterstages.FilterStage("too_many_N", 1.0, lambda r1, r2, counts: "BADNCT" if r1[2] else None)]
+    return filterstages.StagePipeline(stages, order, window)
+
+#the rates of the stages change between the parts of the input, so the adaptive order changes too
+def randomRecords(number):
+    rand = random.Random(number)
+    records = []
+    for i in xrange(number):
+        part = (i / 700) % 3
+        records.append((rand.random() < [0.3, 0.05, 0.2][part], rand.random() < [0.05, 0.6, 0.1][part], rand.random() < [0.2, 0.1, 0.5][part]))
+    return records
+
+#a reader returning the records in batches of irregular sizes
+class BatchReader:
+
+    def __init__(self, columns, sizes):
+        self.columns = columns
+        self.sizes = sizes
+        self.pos = 0
+
+    def nextBatch(self):
+        if self.pos >= len(self.columns[0]):
+            return None
+        size = self.sizes[0]
+        self.sizes = self.sizes[1:] + [size]
+        batch = [reads[self.pos:self.pos + size] if reads != None else None for reads in self.columns]
+        self.pos += size
+        return batch
+
+class StagePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.interval = filterstages.REORDER_INTERVAL
+        filterstages.REORDER_INTERVAL = 50
+
+    def tearDown(self):
+        filterstages.REORDER_INTERVAL = self.interval
+
+    def runRecords(self, pipeline, records, first):
+        stageCounts = {}
+        return [pipeline.run(records[k], None, None, first + k + 1, stageCounts) for k in xrange(len(records))]
+
+    #the count of records with different flags, a diff of the long lists would be too slow to show
+    def differentFlags(self, flags1, flags2):
+        return len([k for k in xrange(len(flags1)) if flags1[k] != flags2[k]])
+
+    def testAdaptiveReorders(self):
+        records = randomRecords(5000)
+        precedence = self.runRecords(makePipeline("precedence", 1000), records, 0)
+        adaptive = self.runRecords(makePipeline("adaptive", 1000), records, 0)
+        #the good records are same, but some bad records are flagged by another stage
+        self.assertEqual(self.differentFlags([flag == None for flag in precedence], [flag == None for flag in adaptive]), 0)
+        self.assertTrue(self.differentFlags(precedence, adaptive) > 0)
+
+    def testAdaptiveWindowsInAnyOrder(self):
+        window = 1000
+        records = randomRecords(5500)
+        serial = self.runRecords(makePipeline("adaptive", window), records, 0)
+        #the windows are filtered by 3 processes in a random order, like the chunks of filterParallel
+        pipelines = [makePipeline("adaptive", window) for i in xrange(3)]
+        starts = range(0, len(records), window)
+        random.Random(1).shuffle(starts)
+        flags = [None] * len(records)
+        for i in xrange(len(starts)):
+            start = starts[i]
+            flags[start:start + window] = self.runRecords(pipelines[i % 3], records[start:start + window], start)
+        self.assertEqual(self.differentFlags(serial, flags), 0)
+
+    def testAlignedChunks(self):
+        number = preprocesser.FILTER_CHUNK_SIZE * 3 + 1234
+        columns = [[[str(i)] for i in xrange(number)], None, [[str(-i)] for i in xrange(number)], None]
+        reader = BatchReader(columns, [7000, 1, 4999, 12345, 3])
+        chunks = list(preprocesser.alignedChunks(reader))
+        self.assertEqual([len(chunk[0]) for chunk in chunks], [preprocesser.FILTER_CHUNK_SIZE] * 3 + [1234])
+        for i in (0, 2):
+            self.assertEqual(sum([chunk[i] for chunk in chunks], []), columns[i])
+        for i in (1, 3):
+            self.assertEqual([chunk[i] for chunk in chunks], [None] * 4)
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import os,sys
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+import testdata
+import fastq
+import gzindex
+
+#a record reached by resuming the decompression from a checkpoint must be the same record as read from the start,
+#for a .gz file of one member and for a multi-member file written by fastq.ParallelGzipFile
+
+#a small span, so the 1000 records have several checkpoints
+SPAN = 8192
+#a small member size, so the checkpoints are in different members, and the reads after them cross the members
+MEMBER_SIZE = 50000
+
+def readAll(reader):
+    records = []
+    while True:
+        read = reader.nextRead()
+        if read == None:
+            break
+        records.append(list(read))
+    return records
+
+@unittest.skipUnless(gzindex.ZLIB_LOADED, "libz cannot be loaded by ctypes")
+class GzipIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        testdata.writePairs(cls.folder, testdata.PAIRS, gz = True)
+        cls.records = readAll(fastq.BlockReader(os.path.join(cls.folder, "S_R1.fq")))
+        memberSize = fastq.GZIP_MEMBER_SIZE
+        pool = ThreadPool(2)
+        try:
+            fastq.GZIP_MEMBER_SIZE = MEMBER_SIZE
+            out = fastq.ParallelGzipFile(os.path.join(cls.folder, "S_R1.members.fq.gz"), 6, pool, 2)
+            for line in open(os.path.join(cls.folder, "S_R1.fq")):
+                out.write(line)
+            out.close()
+        finally:
+            fastq.GZIP_MEMBER_SIZE = memberSize
+            pool.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def filenames(self):
+        return [os.path.join(self.folder, name) for name in ("S_R1.fq.gz", "S_R1.members.fq.gz")]
+
+    #readers of the .gz file, with small blocks so the records after a checkpoint cross the blocks
+    def readers(self, filename):
+        return {
+            "BlockReader" : fastq.BlockReader(filename, 1000, "python"),
+            "BlockReader compact" : fastq.BlockReader(filename, 1000, "python", True),
+        }
+
+    #the records at, before and after each checkpoint, and at both ends
+    def recordsToSeek(self, index):
+        records = [0, 1, testdata.PAIRS - 1, testdata.PAIRS]
+        for point in index.points:
+            records += [point.record - 1, point.record, point.record + 1]
+        return [r for r in records if r >= 0]
+
+    def checkSeek(self, index, name, reader):
+        for record in self.recordsToSeek(index):
+            gzindex.seekRecord(reader, index, record)
+            expected = self.records[record:record + 10]
+            reads = [list(reader.nextRead()) for k in xrange(len(expected))]
+            self.assertEqual(reads, expected, os.path.basename(index.filename) + " " + name + " at record " + str(record))
+            if len(expected) < 10:
+                self.assertEqual(reader.nextRead(), None)
+
+    def testBuildIndex(self):
+        for filename in self.filenames():
+            index = gzindex.buildIndex(filename, SPAN)
+            self.assertEqual(index.records, testdata.PAIRS)
+            self.assertTrue(len(index.points) > 3, filename + " has " + str(len(index.points)) + " checkpoints")
+            #the checkpoints are resumed with primed bits and a window
+            self.assertTrue(len([p for p in index.points if p.bits > 0 and len(p.window) > 0]) > 0)
+        multiMember = gzindex.buildIndex(self.filenames()[1], SPAN)
+        self.assertTrue(len([p for p in multiMember.points if p.outOffset > MEMBER_SIZE]) > 1)
+
+    def testSeekRecord(self):
+        for filename in self.filenames():
+            index = gzindex.buildIndex(filename, SPAN)
+            for name, reader in self.readers(filename).items():
+                self.checkSeek(index, name, reader)
+
+    def testRanges(self):
+        for filename in self.filenames():
+            index = gzindex.buildIndex(filename, SPAN)
+            for n in (1, 3, 100):
+                ranges = index.ranges(n)
+                self.assertEqual(sum([count for (first, count) in ranges]), testdata.PAIRS)
+                for name, reader in self.readers(filename).items():
+                    next = 0
+                    for (first, count) in ranges:
+                        self.assertEqual(first, next)
+                        gzindex.seekRecord(reader, index, first)
+                        reads = [list(reader.nextRead()) for k in xrange(count)]
+                        self.assertEqual(reads, self.records[first:first + count], name + " range at record " + str(first))
+                        next = first + count
+
+    def testSidecar(self):
+        for filename in self.filenames():
+            index = gzindex.loadOrBuildIndex(filename, SPAN)
+            self.assertTrue(os.path.exists(gzindex.indexFileName(filename)))
+            loaded = gzindex.loadIndex(filename)
+            self.assertEqual(loaded.records, index.records)
+            self.assertEqual([(p.inOffset, p.bits, p.outOffset, p.record, p.skip, p.window) for p in loaded.points],
+                [(p.inOffset, p.bits, p.outOffset, p.record, p.skip, p.window) for p in index.points])
+            self.checkSeek(loaded, "BlockReader", fastq.BlockReader(filename, 1000, "python"))
+            #the sidecar of a modified file is not used
+            st = os.stat(filename)
+            os.utime(filename, (st.st_atime, st.st_mtime - 10))
+            self.assertEqual(gzindex.loadIndex(filename), None)
+
+if __name__  == "__main__":
+    unittest.main()
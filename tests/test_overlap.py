@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import os,sys
+import unittest
+import testdata
+import util
+from benchmark import randomPairs
+
+#differential test of the overlap engines: overlapNative, overlapSeededPython and overlapSeededNative
+#must return the same (offset, overlap_len, distance) as overlapScan, the original python overlap
+#the seeded engine can find a matching offset which overlapScan skips, this doesn't happen for these pairs,
+#so any difference is a bug
+
+#name -> (read length, min insert, max insert, pairs)
+PAIR_GROUPS = {
+    #from a few bases shorter than the read (negative offset) to mostly overlapped
+    "50 bp, short insert" : (50, 45, 70, 1000),
+    "101 bp, short insert" : (101, 96, 172, 1000),
+    "250 bp, short insert" : (250, 245, 470, 500),
+    #the reads don't overlap
+    "101 bp, long insert" : (101, 202, 404, 500),
+    "250 bp, long insert" : (250, 500, 1000, 200),
+    #the insert is shorter than the read, so the adapters are sequenced and the offset is negative
+    "101 bp, negative offset" : (101, 90, 100, 3000),
+    "150 bp, negative offset" : (150, 135, 149, 3000),
+}
+
+class OverlapTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.groups = {}
+        cls.expected = {}
+        for name, (length, minInsert, maxInsert, number) in PAIR_GROUPS.items():
+            pairs = randomPairs(length, number, minInsert, maxInsert)
+            cls.groups[name] = pairs
+            cls.expected[name] = [util.overlapScan(r1, r2) for r1, r2 in pairs]
+
+    def checkEngine(self, engineName, engine):
+        for name, pairs in sorted(self.groups.items()):
+            expected = self.expected[name]
+            different = []
+            for k in xrange(len(pairs)):
+                result = engine(pairs[k][0], pairs[k][1])
+                if result != expected[k]:
+                    different.append((pairs[k], expected[k], result))
+            if len(different) > 0:
+                self.fail(engineName + " differs from overlapScan for " + str(len(different)) + " pairs of " + name +
+                    ", the first is " + str(different[0][0]) + ": " + str(different[0][1]) + " != " + str(different[0][2]))
+
+    def testPairsCoverAllCases(self):
+        results = sum(self.expected.values(), [])
+        self.assertTrue(len([r for r in results if r[0] > 0 and r[1] > 0]) > 1000)
+        self.assertTrue(len([r for r in results if r[0] < 0]) > 100)
+        self.assertTrue(len([r for r in results if r == (0, 0, 0)]) > 1000)
+
+    def testSeededPython(self):
+        self.checkEngine("overlapSeededPython", util.overlapSeededPython)
+
+    @unittest.skipUnless(util.OVERLAP_CTYPES_LOADED, "the native overlap is not loaded, run make to build editdistance/libed.so")
+    def testNative(self):
+        self.checkEngine("overlapNative", util.overlapNative)
+
+    @unittest.skipUnless(util.OVERLAP_SEEDED_CTYPES_LOADED, "the native overlap is not loaded, run make to build editdistance/libed.so")
+    def testSeededNative(self):
+        self.checkEngine("overlapSeededNative", util.overlapSeededNative)
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import os,sys
+import shutil
+import tempfile
+import unittest
+import testdata
+import perfstats
+from qualitycontrol import QualityControl
+
+#the timed stages are not nested, so a time or a read is never counted twice in the performance section of after.json
+
+class PerformanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        perfstats.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        perfstats.reset()
+
+    def testStatFileTimedOnce(self):
+        testdata.writePairs(self.folder, 2000)
+        qc = QualityControl()
+        qc.statFile(os.path.join(self.folder, "S_R1.fq"))
+        stages = perfstats.RUN.summary()["stages"]
+        self.assertEqual(sorted(stages.keys()), ["qc.qc", "qc.statReads"])
+        self.assertEqual(stages["qc.statReads"]["calls"], 1)
+        self.assertEqual(stages["qc.statReads"]["reads_in"], 2000)
+        self.assertEqual(stages["qc.qc"]["reads_in"], 0)
+
+if __name__  == "__main__":
+    unittest.main()
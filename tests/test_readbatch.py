@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os,sys
+import random
+import unittest
+import testdata
+import readbatch
+import preprocesser
+
+#a BatchRead must behave like the list of 4 lines it stands for, when the stages trim it, read its lines back
+#and assign lines in any order
+
+def randomRecords(rand, number):
+    records = []
+    for i in xrange(number):
+        #an empty line is the end of the file
+        length = rand.randint(1, 60)
+        seq = "".join([rand.choice("ACGTN") for x in xrange(length)])
+        qual = "".join([chr(33 + rand.randint(2, 40)) for x in xrange(length)])
+        records.append(["@read" + str(i) + " 1:N:0:ACGT", seq, "+", qual])
+    return records
+
+def toBatch(records):
+    data = "".join(["\n".join(record) + "\n" for record in records])
+    batch, consumed, eof = readbatch.parseBlock(data, True)
+    return batch
+
+class BatchReadTest(unittest.TestCase):
+
+    def testLinesAreCached(self):
+        read = toBatch([["@r1", "ACGTNACGT", "+", "IIIIIIIII"]])[0]
+        self.assertTrue(read[1] is read[1])
+        self.assertEqual(read[-1], "IIIIIIIII")
+        self.assertTrue(read[3] is read[-1])
+
+    def testTrimAfterReadBack(self):
+        read = toBatch([["@r1", "ACGTNACGTN", "+", "ABCDEFGHIJ"]])[0]
+        self.assertEqual(read[1], "ACGTNACGTN")
+        self.assertEqual(read.count(1, "N"), 2)
+        read.trim(2, 3)
+        self.assertEqual(read[1], "GTNAC")
+        self.assertEqual(read[3], "CDEFG")
+        self.assertEqual(read.count(1, "N"), 1)
+        read.trim(1, 0)
+        self.assertEqual(list(read), ["@r1", "TNAC", "+", "DEFG"])
+        read[1] = "TTAC"
+        read.trim(0, 1)
+        self.assertEqual(list(read), ["@r1", "TTA", "+", "DEF"])
+        self.assertEqual(read.count(1, "N"), 0)
+
+    #random trims, read-backs, counts and assignments on BatchReads and on the lists of the same records
+    def testRandomOperations(self):
+        rand = random.Random(0)
+        records = randomRecords(rand, 300)
+        batch = toBatch(records)
+        self.assertEqual(len(batch), len(records))
+        for i in xrange(len(records)):
+            expected = list(records[i])
+            read = batch[i]
+            for step in xrange(12):
+                operation = rand.randint(0, 3)
+                if operation == 0:
+                    front = rand.randint(0, 5)
+                    tail = rand.randint(0, 5)
+                    preprocesser.trim(expected, front, tail)
+                    preprocesser.trim(read, front, tail)
+                elif operation == 1:
+                    j = rand.choice([0, 1, 3, -1, -3])
+                    self.assertEqual(read[j], expected[j])
+                elif operation == 2:
+                    self.assertEqual(read.count(1, "N"), expected[1].count("N"))
+                    self.assertEqual(preprocesser.nNumber(read), preprocesser.nNumber(expected))
+                else:
+                    j = rand.choice([0, 1, 3])
+                    line = expected[j][0:rand.randint(0, len(expected[j]))]
+                    expected[j] = line
+                    read[j] = line
+            self.assertEqual(list(read), expected)
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+import os,sys
+import json
+import shutil
+import tempfile
+import unittest
+import testdata
+import badsink
+
+#the good, bad and overlap outputs and after.json of AfterQC are compared with data/baseline.json,
+#which was recorded by the serial filter of the original AfterQC on the same reads
+#the faster ways of reading, filtering and writing (block and mmap readers, compact reads, parallel filtering,
+#gzip input and bad-read sinks) must give the same outputs
+#run in the AfterQC folder: python -m unittest discover -s tests
+
+AFTER_PY = os.path.join(testdata.ROOT, "after.py")
+#a chunk of parallel filtering has 5000 records, so the 1000 pairs are split into 5 chunks of 200 records by this
+CHUNK_SIZE = 200
+
+class RegressionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = json.load(open(testdata.BASELINE_FILE))
+        cls.folder = tempfile.mkdtemp()
+        cls.inputs = testdata.writePairs(cls.folder, testdata.PAIRS, gz = True)
+        cls.inputs.append(testdata.writeInterleaved(cls.folder, "S_R1.fq", "S_R2.fq", "S_IL.fq"))
+        cls.runs = 0
+        cls.pairFolder = None
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    #run after.py with args in a new folder with a copy of the inputs, returns the folder
+    #chunkSize changes the count of records in a chunk of parallel filtering
+    #stdin and stdout are the names of the files in the folder to give to stdin and to write stdout to
+    def runAfter(self, args, expectedCode = 0, chunkSize = None, stdin = None, stdout = None):
+        RegressionTest.runs += 1
+        folder = os.path.join(self.folder, "run" + str(self.runs))
+        os.mkdir(folder)
+        for name in self.inputs:
+            shutil.copy(os.path.join(self.folder, name), folder)
+        code = testdata.runAfter(AFTER_PY, folder, args, chunkSize = chunkSize, stdin = stdin, stdout = stdout)
+        if code != expectedCode:
+            self.fail("after.py " + " ".join(args) + " exited with " + str(code) + ":\n" + open(os.path.join(folder, "log.txt")).read())
+        return folder
+
+    #run after.py with the args of a baseline run and extra args, and compare the outputs with the baseline
+    #replace changes the args of the baseline run, like the input files
+    #ordered is False if the output files can be written in a different order, then only the parts of after.json are compared
+    def checkRun(self, baselineName, extraArgs = [], replace = {}, chunkSize = None, ordered = True):
+        args = [replace.get(arg, arg) for arg in testdata.BASELINE_RUNS[baselineName]] + extraArgs
+        expected = self.baseline[baselineName]
+        folder = self.runAfter(args, chunkSize = chunkSize)
+        result = testdata.collectRun(folder)
+        self.assertEqual(result["summary"], expected["summary"])
+        if ordered:
+            self.assertEqual(result["outputs"], expected["outputs"])
+        else:
+            self.assertEqual(dict([(k, v) for k, v in result["outputs"].items() if k.startswith("after.json/")]),
+                dict([(k, v) for k, v in expected["outputs"].items() if k.startswith("after.json/")]))
+        return folder
+
+    #the count of chunks filtered by the run in folder
+    def filteredChunks(self, folder):
+        qc = os.path.join(folder, "QC")
+        for name in os.listdir(qc):
+            jsonFile = os.path.join(qc, name, "after.json")
+            if os.path.exists(jsonFile):
+                return json.load(open(jsonFile))["performance"]["stages"]["filter"]["calls"]
+
+    #the pe baseline run without the index file, the reference of the runs reading an interleaved file
+    def pairRun(self):
+        if RegressionTest.pairFolder == None:
+            args = list(testdata.BASELINE_RUNS["pe"])
+            del args[args.index("-7"):args.index("-7") + 2]
+            RegressionTest.pairFolder = self.runAfter(args)
+            self.assertEqual(testdata.collectRun(self.pairFolder)["summary"], self.baseline["pe"]["summary"])
+        return self.pairFolder
+
+    #the interleaved outputs <name>.<output>.fq of the run in folder must be the records of the pair run in turn,
+    #and after.json must be same
+    #goodFile is the name of the good output in folder if it is given by good_output_file
+    def checkInterleaved(self, folder, name, goodFile = None, outputs = testdata.OUTPUT_FOLDERS):
+        pair = self.pairRun()
+        for output in outputs:
+            filename = os.path.join(folder, output, name + "." + output + ".fq")
+            if output == "good" and goodFile != None:
+                self.assertFalse(os.path.exists(filename))
+                filename = os.path.join(folder, goodFile)
+            records = testdata.readRecords(filename)
+            self.assertEqual(records[0::2], testdata.readRecords(os.path.join(pair, output, "S_R1." + output + ".fq")))
+            self.assertEqual(records[1::2], testdata.readRecords(os.path.join(pair, output, "S_R2." + output + ".fq")))
+        result = testdata.collectRun(folder)
+        expected = testdata.collectRun(pair)
+        self.assertEqual(result["summary"], expected["summary"])
+        self.assertEqual(dict([(k, v) for k, v in result["outputs"].items() if k.startswith("after.json/")]),
+            dict([(k, v) for k, v in expected["outputs"].items() if k.startswith("after.json/")]))
+
+    def testPairedEnd(self):
+        self.checkRun("pe")
+
+    def testSingleEnd(self):
+        self.checkRun("se")
+
+    def testCompactReads(self):
+        self.checkRun("pe", ["--compact_reads", "on"])
+        self.checkRun("se", ["--compact_reads", "on"])
+
+    def testMmap(self):
+        self.checkRun("pe", ["--mmap", "on"])
+
+    def testGzipInput(self):
+        gz = {"S_R1.fq" : "S_R1.fq.gz", "S_R2.fq" : "S_R2.fq.gz", "S_I1.fq" : "S_I1.fq.gz"}
+        self.checkRun("pe", ["--decompressor", "python"], gz)
+        self.checkRun("pe", ["--decompressor", "auto"], gz)
+
+    def testFilterProcesses(self):
+        chunks = testdata.PAIRS / CHUNK_SIZE
+        for extraArgs in (["--filter_processes", "2"], ["--filter_processes", "3", "--compact_reads", "on"]):
+            folder = self.checkRun("pe", extraArgs + ["--filter_order", "ordered"], chunkSize = CHUNK_SIZE)
+            self.assertEqual(self.filteredChunks(folder), chunks)
+        folder = self.checkRun("se", ["--filter_processes", "2"], chunkSize = CHUNK_SIZE)
+        self.assertEqual(self.filteredChunks(folder), chunks)
+
+    def testFilterUnordered(self):
+        serial = self.checkRun("pe", chunkSize = CHUNK_SIZE)
+        folder = self.checkRun("pe", ["--filter_processes", "3", "--filter_order", "unordered"], chunkSize = CHUNK_SIZE, ordered = False)
+        self.assertEqual(self.filteredChunks(folder), testdata.PAIRS / CHUNK_SIZE)
+        self.assertEqual(testdata.digestSortedOutputs(folder), testdata.digestSortedOutputs(serial))
+        #the chunks can be written in any order, but the records of R1, R2 and I1 are written in the same order
+        for output in testdata.OUTPUT_FOLDERS:
+            names = testdata.outputNames(folder, output).values()
+            for other in names[1:]:
+                self.assertEqual(other, names[0])
+
+    #read1 and read2 share the writers of interleaved outputs, the batches of a chunk must keep the pairs in turn
+    def testInterleavedOutput(self):
+        folder = self.runAfter(["-1", "S_IL.fq", "--interleaved", "on", "--store_overlap", "on", "--draw", "off"])
+        self.checkInterleaved(folder, "S_IL")
+        folder = self.runAfter(["-1", "S_IL.fq", "--interleaved", "on", "--store_overlap", "on", "--draw", "off",
+            "--filter_processes", "2"], chunkSize = CHUNK_SIZE)
+        self.checkInterleaved(folder, "S_IL")
+
+    def testStdin(self):
+        folder = self.runAfter(["-1", "-", "--interleaved", "on", "--store_overlap", "on", "--draw", "off"], stdin = "S_IL.fq")
+        self.checkInterleaved(folder, "stdin")
+        self.assertTrue(os.path.exists(os.path.join(folder, "QC", "stdin", "after.json")))
+
+    def testGoodOutputStdout(self):
+        folder = self.runAfter(["-1", "S_IL.fq", "--interleaved", "on", "--store_overlap", "on", "--draw", "off",
+            "--good_output_file", "-"], stdout = "out.fq")
+        self.checkInterleaved(folder, "S_IL", "out.fq")
+        #read1 and read2 of a two-file run are written to good_output_file in turn, the other outputs are not interleaved
+        folder = self.runAfter(["-1", "S_R1.fq", "-2", "S_R2.fq", "--store_overlap", "on", "--draw", "off",
+            "--good_output_file", "-"], stdout = "out.fq")
+        self.checkInterleaved(folder, "S_R1", "out.fq", ["good"])
+        #from stdin to stdout, like in a pipe
+        folder = self.runAfter(["-1", "-", "--interleaved", "on", "--store_overlap", "on", "--draw", "off",
+            "--good_output_file", "-"], stdin = "S_IL.fq", stdout = "out.fq")
+        self.checkInterleaved(folder, "stdin", "out.fq")
+
+    #a stream is read only once, so it cannot be sampled entirely
+    def testStreamQcSample(self):
+        for args, stdin in ((["-1", "-"], "S_R1.fq"), (["-1", "S_IL.fq", "--interleaved", "on"], None)):
+            folder = self.runAfter(args + ["--qc_sample", "0", "--draw", "off"], 1, stdin = stdin)
+            log = open(os.path.join(folder, "log.txt")).read()
+            self.assertTrue("qc_sample should be more than 0 for stdin or an interleaved read1_file" in log)
+            self.assertFalse("Traceback" in log)
+
+    def testCompressionLevel(self):
+        self.checkRun("pe", ["--compression_level", "6", "--compression_threads", "2"])
+        for level in ("12", "-1"):
+            folder = self.runAfter(["-1", "S_R1.fq", "-2", "S_R2.fq", "--compression_level", level, "--draw", "off"], 1)
+            log = open(os.path.join(folder, "log.txt")).read()
+            self.assertTrue("compression_level should be 1~9, or 0 for no compression" in log)
+            self.assertFalse("Traceback" in log)
+
+    def testBadSinkGzip(self):
+        self.checkRun("pe", ["--bad_sink", "gzip"])
+
+    #the bad_reads of after.json, which has the exact count of bad reads of each reason whatever bad_sink is
+    def badReads(self, folder):
+        qc = os.path.join(folder, "QC")
+        for name in os.listdir(qc):
+            jsonFile = os.path.join(qc, name, "after.json")
+            if os.path.exists(jsonFile):
+                return json.load(open(jsonFile))["bad_reads"]
+
+    #the counts of each reason of bad_reads must add up to the BAD* counts of the summary
+    def checkBadCounts(self, folder, summary):
+        c = self.badReads(folder)["reads_by_reason"]
+        self.assertEqual(sum(c.values()), summary["bad_reads"])
+        self.assertEqual(c["BADBCD1"] + c["BADBCD2"], summary["bad_reads_with_bad_barcode"])
+        self.assertEqual(c["BADBBL"], summary["bad_reads_with_reads_in_bubble"])
+        self.assertEqual(c["BADLEN"] + c["BADTRIM1"] + c["BADTRIM2"], summary["bad_reads_with_bad_read_length"])
+        self.assertEqual(c["BADPOL"], summary["bad_reads_with_polyX"])
+        self.assertEqual(c["BADLQC"], summary["bad_reads_with_low_quality"])
+        self.assertEqual(c["BADNCT"], summary["bad_reads_with_too_many_N"])
+        self.assertEqual(c["BADOL"] + c["BADMISMATCH"] + c["BADINDEL"], summary["bad_reads_with_bad_overlap"])
+
+    #the sampled bad records must be at most size records of each reason, and be a subsequence of all bad records
+    def checkBadSample(self, records, allRecords, size):
+        reasons = {}
+        for record in records:
+            reason = [r for r in badsink.BAD_REASONS if record.startswith("@" + r)][0]
+            reasons[reason] = reasons.get(reason, 0) + 1
+        for reason, count in reasons.items():
+            self.assertTrue(count <= size, reason + " has " + str(count) + " sampled reads")
+        k = 0
+        for record in records:
+            while k < len(allRecords) and allRecords[k] != record:
+                k += 1
+            self.assertTrue(k < len(allRecords), "sampled record not in input order: " + record.split("\n")[0])
+            k += 1
+
+    def testBadSinkNone(self):
+        folder = self.checkRun("pe", ["--bad_sink", "none"], ordered = False)
+        bad = os.path.join(folder, "bad")
+        self.assertTrue(not os.path.exists(bad) or os.listdir(bad) == [])
+        self.assertEqual(self.badReads(folder)["stored_reads"], 0)
+        self.checkBadCounts(folder, self.baseline["pe"]["summary"])
+
+    def testBadSinkSample(self):
+        size = 5
+        full = self.checkRun("pe")
+        self.checkBadCounts(full, self.baseline["pe"]["summary"])
+        sampled = self.checkRun("pe", ["--bad_sink", "sample:" + str(size)], ordered = False)
+        self.checkBadCounts(sampled, self.baseline["pe"]["summary"])
+        for name in ("S_R1.bad.fq", "S_R2.bad.fq", "S_I1.bad.fq"):
+            records = testdata.readRecords(os.path.join(sampled, "bad", name))
+            self.assertTrue(0 < len(records) < len(testdata.readRecords(os.path.join(full, "bad", name))))
+            self.assertEqual(len(records), self.badReads(sampled)["stored_reads"])
+            self.checkBadSample(records, testdata.readRecords(os.path.join(full, "bad", name)), size)
+        names = testdata.outputNames(sampled, "bad").values()
+        for other in names[1:]:
+            self.assertEqual(other, names[0])
+        #the seed is fixed, so the same reads are sampled on every run
+        again = self.checkRun("pe", ["--bad_sink", "sample:" + str(size)], ordered = False)
+        self.assertEqual(testdata.digestOutputs(again), testdata.digestOutputs(sampled))
+        #the kept reads only depend on the record numbers, not on the order the chunks of parallel filtering are written in
+        expected = dict([(k, v) for k, v in testdata.digestOutputs(sampled).items() if k.startswith("bad/")])
+        for run in xrange(3):
+            folder = self.checkRun("pe", ["--bad_sink", "sample:" + str(size), "--filter_processes", "3", "--filter_order", "unordered"],
+                chunkSize = 50, ordered = False)
+            self.assertEqual(dict([(k, v) for k, v in testdata.digestOutputs(folder).items() if k.startswith("bad/")]), expected)
+        #read1 and read2 of interleaved input share the bad writer, the sampled pairs are written in turn
+        interleaved = self.runAfter(["-1", "S_IL.fq", "--interleaved", "on", "--draw", "off", "--bad_sink", "sample:" + str(size)])
+        records = testdata.readRecords(os.path.join(interleaved, "bad", "S_IL.bad.fq"))
+        self.assertEqual(records[0::2], testdata.readRecords(os.path.join(sampled, "bad", "S_R1.bad.fq")))
+        self.assertEqual(records[1::2], testdata.readRecords(os.path.join(sampled, "bad", "S_R2.bad.fq")))
+        self.checkBadCounts(interleaved, self.baseline["pe"]["summary"])
+
+    #the records of the shards of folder in the order of the input, by the manifest
+    def mergeShards(self, folder, policy):
+        manifest = json.load(open(os.path.join(folder, "good", "S_R1.good.shards.json")))
+        self.assertEqual(manifest["policy"], policy)
+        self.assertEqual(sum([shard["reads"] for shard in manifest["shards"]]), manifest["total_reads"])
+        merged = {}
+        for name in ("read1", "read2", "index1"):
+            shards = []
+            for shard in manifest["shards"]:
+                records = testdata.readRecords(os.path.join(folder, "good", shard[name]))
+                self.assertEqual(len(records), shard["reads"])
+                shards.append(records)
+            if policy.startswith("roundrobin:"):
+                #record k is in shard k % N
+                records = []
+                for k in xrange(manifest["total_reads"]):
+                    records.append(shards[k % len(shards)][k / len(shards)])
+            else:
+                records = sum(shards, [])
+            merged[name] = records
+        return manifest, merged
+
+    def testGoodShards(self):
+        full = self.checkRun("pe")
+        expected = {}
+        for name, filename in (("read1", "S_R1"), ("read2", "S_R2"), ("index1", "S_I1")):
+            expected[name] = testdata.readRecords(os.path.join(full, "good", filename + ".good.fq"))
+        for policy, shards in (("roundrobin:3", 3), ("count:300", 3)):
+            folder = self.checkRun("pe", ["--good_shards", policy], ordered = False)
+            manifest, merged = self.mergeShards(folder, policy)
+            self.assertEqual(len(manifest["shards"]), shards)
+            self.assertEqual(manifest["total_reads"], self.baseline["pe"]["summary"]["good_reads"])
+            self.assertEqual(merged, expected)
+            #the shards of read1, read2 and index1 have the same records in the same order
+            for shard in manifest["shards"]:
+                names = [[record.split("\n")[0].split(" ")[0] for record in testdata.readRecords(os.path.join(folder, "good", shard[name]))]
+                    for name in ("read1", "read2", "index1")]
+                self.assertEqual(names[1], names[0])
+                self.assertEqual(names[2], names[0])
+
+    def testPairNameCheck(self):
+        #swap two records of read2, the names of read1 and read2 don't match at record 11
+        lines = open(os.path.join(self.folder, "S_R2.fq")).readlines()
+        lines[40:44], lines[44:48] = lines[44:48], lines[40:44]
+        f = open(os.path.join(self.folder, "S_R2_swapped.fq"), "w")
+        f.writelines(lines)
+        f.close()
+        self.inputs.append("S_R2_swapped.fq")
+        folder = self.runAfter(["-1", "S_R1.fq", "-2", "S_R2_swapped.fq", "--draw", "off"], 1)
+        self.assertTrue("read names don't match at record 11" in open(os.path.join(folder, "log.txt")).read())
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os,sys
+import shutil
+import tempfile
+import time
+import unittest
+import testdata
+import progress
+import scheduler
+
+#the jobs of processDir are bounded: at most maxJobs are filtering, and at most one more is started
+#while the others write their QC and report
+
+#a job which finishes filtering at once and then takes a while to write its QC and report, like processOptions
+def finishSlowly(name, code, queue):
+    queue.put({'file': name, 'state': "done", 'reads': 0, 'input_bytes': None})
+    time.sleep(0.3)
+    queue.put({'file': name, 'state': "finished", 'summary': {'good_reads': len(name)}})
+    sys.exit(code)
+
+#records the most jobs running at the same time
+class CountingScheduler(scheduler.JobScheduler):
+
+    def __init__(self, jobs, maxJobs, memoryBudget, progress):
+        scheduler.JobScheduler.__init__(self, jobs, maxJobs, memoryBudget, progress)
+        self.maxRunning = 0
+
+    def start(self, job):
+        scheduler.JobScheduler.start(self, job)
+        self.maxRunning = max(self.maxRunning, len(self.running))
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def runJobs(self, number, maxJobs, memoryBudget = 0):
+        jobs = []
+        for i in xrange(number):
+            name = "job" + str(i)
+            jobs.append(scheduler.Job(name, i, 300, finishSlowly, (name, i % 2)))
+        aggregator = progress.ProgressAggregator(dict([(job.name, job.size) for job in jobs]), os.path.join(self.folder, "status.json"), 0)
+        jobScheduler = CountingScheduler(jobs, maxJobs, memoryBudget, aggregator)
+        jobScheduler.run()
+        return (jobs, jobScheduler.maxRunning)
+
+    def testBoundedJobs(self):
+        for maxJobs in (1, 2, 3):
+            jobs, maxRunning = self.runJobs(8, maxJobs)
+            self.assertTrue(maxRunning <= maxJobs + 1, str(maxRunning) + " jobs ran with maxJobs " + str(maxJobs))
+            self.assertEqual([job.exitCode for job in jobs], [i % 2 for i in xrange(8)])
+            self.assertEqual([job.summary for job in jobs], [{'good_reads': len(job.name)} for job in jobs])
+
+    def testMemoryBudget(self):
+        jobs, maxRunning = self.runJobs(4, 4, 600)
+        self.assertEqual(maxRunning, 2)
+
+if __name__  == "__main__":
+    unittest.main()
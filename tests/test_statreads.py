@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os,sys
+import signal
+import unittest
+import testdata
+import preprocesser
+
+#the R2 QC is run in a child process by startStatReads, finishStatReads must return its result,
+#and raise instead of waiting forever if the child dies without sending anything
+
+class CountReads:
+
+    def __init__(self):
+        self.reads = 0
+
+    def statReads(self, reads):
+        self.reads = len(reads)
+
+class KilledChild:
+
+    def statReads(self, reads):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+class StatReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poll = preprocesser.STAT_READS_POLL
+        preprocesser.STAT_READS_POLL = 0.1
+
+    def tearDown(self):
+        preprocesser.STAT_READS_POLL = self.poll
+
+    def testResult(self):
+        job = preprocesser.startStatReads(CountReads(), [["@r", "ACGT", "+", "IIII"]] * 10)
+        self.assertEqual(preprocesser.finishStatReads(job).reads, 10)
+
+    def testKilledChild(self):
+        job = preprocesser.startStatReads(KilledChild(), [])
+        try:
+            preprocesser.finishStatReads(job)
+        except Exception as e:
+            self.assertTrue("Failed to stat the reads in child process" in str(e))
+            self.assertTrue("exit code " + str(-signal.SIGKILL) in str(e))
+        else:
+            self.fail("finishStatReads should raise when the child is killed")
+
+if __name__  == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+import os,sys
+import random
+import gzip
+import hashlib
+import json
+import subprocess
+import shutil
+import tempfile
+
+#the AfterQC folder, it is the first of sys.path so the modules of AfterQC can be imported by the tests
+#and util finds editdistance/libed.so in it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if sys.path[0] != ROOT:
+    sys.path.insert(0, ROOT)
+
+#a small deterministic dataset like a real paired-end run: inserts from 60 to 350 bp, so some pairs overlap
+#and some have the adapter sequenced, with N bases, sequencing errors, low quality bases and a few polyG reads
+#the same seed always gives the same reads, the outputs of AfterQC on them are recorded in data/baseline.json
+
+READ_LEN = 101
+ADAPTER = "AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC"
+COMP = {"A" : "T", "T" : "A", "C" : "G", "G" : "C", "N" : "N"}
+
+def reverseComplement(seq):
+    return "".join([COMP[c] for c in reversed(seq)])
+
+def mutate(rand, seq):
+    seq = list(seq)
+    qual = []
+    for i in xrange(len(seq)):
+        r = rand.random()
+        if r < 0.01:
+            seq[i] = "N"
+        elif r < 0.03:
+            seq[i] = rand.choice("ACGT")
+        if rand.random() < 0.15:
+            qual.append(chr(33 + rand.randint(2, 40)))
+        else:
+            qual.append(chr(33 + rand.randint(28, 40)))
+    return ("".join(seq), "".join(qual))
+
+#write folder/<prefix>_R1.fq, _R2.fq and _I1.fq with number pairs, and their .gz copies if gz is True
+#returns the list of the file names written
+def writePairs(folder, number, seed = 1, prefix = "S", gz = False):
+    rand = random.Random(seed)
+    names = [prefix + "_R1.fq", prefix + "_R2.fq", prefix + "_I1.fq"]
+    files = [open(os.path.join(folder, name), "w") for name in names]
+    for k in xrange(number):
+        insert = rand.randint(60, 350)
+        fragment = "".join([rand.choice("ACGT") for x in xrange(insert)])
+        s1 = (fragment + ADAPTER + "A" * 200)[0:READ_LEN]
+        s2 = (reverseComplement(fragment) + ADAPTER + "A" * 200)[0:READ_LEN]
+        if rand.random() < 0.01:
+            s1 = s1[0:20] + "G" * 60 + s1[80:]
+        (seq1, qual1) = mutate(rand, s1)
+        (seq2, qual2) = mutate(rand, s2)
+        name = "@NB500:12:HXXX:1:%d:%d:%d" % (11101 + rand.randint(0, 5), rand.randint(1000, 25000), rand.randint(1000, 19000))
+        files[0].write(name + " 1:N:0:ACGT\n" + seq1 + "\n+\n" + qual1 + "\n")
+        files[1].write(name + " 2:N:0:ACGT\n" + seq2 + "\n+\n" + qual2 + "\n")
+        files[2].write(name + " 1:N:0:ACGT\nACGTACGT\n+\nIIIIIIII\n")
+    for f in files:
+        f.close()
+    if gz:
+        for name in list(names):
+            data = open(os.path.join(folder, name)).read()
+            out = gzip.open(os.path.join(folder, name + ".gz"), "wb")
+            out.write(data)
+            out.close()
+            names.append(name + ".gz")
+    return names
+
+#write folder/<name> with the records of read1 and read2 in turn, like an interleaved fastq file
+def writeInterleaved(folder, read1, read2, name):
+    lines1 = open(os.path.join(folder, read1)).read().splitlines()
+    lines2 = open(os.path.join(folder, read2)).read().splitlines()
+    f = open(os.path.join(folder, name), "w")
+    for i in xrange(0, len(lines1), 4):
+        f.write("\n".join(lines1[i:i + 4] + lines2[i:i + 4]) + "\n")
+    f.close()
+    return name
+
+#the folders of the good, bad and overlap outputs of AfterQC
+OUTPUT_FOLDERS = ("good", "bad", "overlap")
+#the parts of after.json which are same for all ways of filtering, other parts like performance are not compared
+AFTER_JSON_KEYS = ("summary", "overlap", "kmer_content")
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+#run after.py with preprocesser.FILTER_CHUNK_SIZE set to the first argument, so a small dataset has many chunks
+CHUNK_SIZE_RUNNER = ("import sys; chunkSize = int(sys.argv[1]); sys.argv = sys.argv[2:]; sys.path.insert(0, %r); "
+    "import preprocesser; preprocesser.FILTER_CHUNK_SIZE = chunkSize; import after; after.main()") % ROOT
+
+#run after.py in folder with args, returns the exit code, the output is written to folder/log.txt
+#chunkSize changes the count of records in a chunk of parallel filtering
+#stdin is the name of a file in folder to give to stdin, stdout is the name of a file in folder to write stdout to,
+#then only stderr is written to folder/log.txt
+def runAfter(afterPy, folder, args, env = None, chunkSize = None, stdin = None, stdout = None):
+    log = open(os.path.join(folder, "log.txt"), "w")
+    command = [sys.executable, afterPy] + args
+    if chunkSize != None:
+        command = [sys.executable, "-c", CHUNK_SIZE_RUNNER, str(chunkSize), afterPy] + args
+    input = None
+    if stdin != None:
+        input = open(os.path.join(folder, stdin), "rb")
+    output = log
+    if stdout != None:
+        output = open(os.path.join(folder, stdout), "wb")
+    code = subprocess.call(command, cwd = folder, stdin = input, stdout = output, stderr = subprocess.STDOUT if stdout == None else log, env = env)
+    for f in (input, output, log):
+        if f != None and not f.closed:
+            f.close()
+    return code
+
+#the md5 of each output file and of the compared parts of after.json
+#a .gz output is decompressed and named without .gz, so it is compared with the same output written without compression
+def digestOutputs(folder):
+    result = {}
+    for output in OUTPUT_FOLDERS:
+        path = os.path.join(folder, output)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if name.endswith(".gz"):
+                f = gzip.open(filename, "rb")
+                name = name[0:-3]
+            else:
+                f = open(filename, "rb")
+            result[output + "/" + name] = md5(f.read())
+            f.close()
+    qc = os.path.join(folder, "QC")
+    for name in sorted(os.listdir(qc)):
+        jsonFile = os.path.join(qc, name, "after.json")
+        if os.path.exists(jsonFile):
+            stat = json.load(open(jsonFile))
+            #the original AfterQC sorted the kmers with the same count in the order of a dict, now by name
+            for name, kmers in stat["kmer_content"].items():
+                stat["kmer_content"][name] = sorted(kmers, key=lambda x: (-x[1], x[0]))
+            for key in AFTER_JSON_KEYS:
+                #a single-end run has no overlap
+                if key in stat:
+                    result["after.json/" + key] = md5(json.dumps(stat[key], sort_keys = True))
+    return result
+
+#the 4-line records of a fastq file, a .gz file is decompressed
+def readRecords(filename):
+    if filename.endswith(".gz"):
+        f = gzip.open(filename, "rb")
+    else:
+        f = open(filename, "rb")
+    lines = f.read().splitlines()
+    f.close()
+    return ["\n".join(lines[i:i + 4]) for i in xrange(0, len(lines), 4)]
+
+#the md5 of the sorted records of each output file, to compare outputs written in different orders
+def digestSortedOutputs(folder):
+    result = {}
+    for output in OUTPUT_FOLDERS:
+        path = os.path.join(folder, output)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            result[output + "/" + name] = md5("\n".join(sorted(readRecords(os.path.join(path, name)))))
+    return result
+
+#the read names of each record of the output files of a folder, without the " 1:..." or " 2:..." comment
+def outputNames(folder, output):
+    path = os.path.join(folder, output)
+    names = {}
+    for name in sorted(os.listdir(path)):
+        names[name] = [record.split("\n")[0].split(" ")[0] for record in readRecords(os.path.join(path, name))]
+    return names
+
+#the pairs of the dataset and the runs recorded in data/baseline.json, by the serial filter of the original AfterQC
+PAIRS = 1000
+BASELINE_RUNS = {
+    "pe" : ["-1", "S_R1.fq", "-2", "S_R2.fq", "-7", "S_I1.fq", "--store_overlap", "on", "--draw", "off"],
+    "se" : ["-1", "S_R1.fq", "--draw", "off"],
+}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "baseline.json")
+
+#the digests of the outputs of a run in folder, and the summary of after.json
+#the summary is kept as it is, so a failed test shows which counts are different
+def collectRun(folder):
+    result = {"outputs" : digestOutputs(folder), "summary" : None}
+    qc = os.path.join(folder, "QC")
+    for name in os.listdir(qc):
+        jsonFile = os.path.join(qc, name, "after.json")
+        if os.path.exists(jsonFile):
+            result["summary"] = json.load(open(jsonFile))["summary"]
+    return result
+
+def recordRun(afterPy, folder, args):
+    if runAfter(afterPy, folder, args) != 0:
+        raise Exception("after.py failed, see " + os.path.join(folder, "log.txt"))
+    return collectRun(folder)
+
+#record data/baseline.json by the after.py of an AfterQC folder, run: python testdata.py <AfterQC folder>
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python testdata.py <AfterQC folder>")
+        sys.exit(1)
+    afterPy = os.path.join(os.path.abspath(sys.argv[1]), "after.py")
+    baseline = {}
+    for name, args in BASELINE_RUNS.items():
+        folder = tempfile.mkdtemp()
+        try:
+            writePairs(folder, PAIRS)
+            baseline[name] = recordRun(afterPy, folder, args)
+        finally:
+            shutil.rmtree(folder)
+    f = open(BASELINE_FILE, "w")
+    f.write(json.dumps(baseline, sort_keys=True,indent=4, separators=(',', ': ')))
+    f.close()
+
+if __name__  == "__main__":
+    main()
@@ -2,34 +2,45 @@
  
 import os,sys
 from ctypes import *
+import seqkernel
 
 EDIT_DISTANCE_MODULE_EXISTS = True
 EDIT_DISTANCE_CTYPES_LOADED = False
+OVERLAP_CTYPES_LOADED = False
+OVERLAP_SEEDED_CTYPES_LOADED = False
+ADAPTER_CTYPES_LOADED = False
 
 # try load editdistance built-in module first
 # if editdistance built-in module not exist, try to load editdistance/libed.so, which is made by make in AfterQC folder
+# libed.so also has find_overlap and find_overlap_seeded, the native versions of overlap and overlapSeeded,
+# and adapter_scan, the native scan of adaptertrim, so it is loaded even if editdistance module exists
 try:
     import editdistance
 except ImportError:
     EDIT_DISTANCE_MODULE_EXISTS = False
-    ed_lib_file  = os.path.join(sys.path[0], "editdistance/libed.so")
-    if os.path.exists(ed_lib_file):
-        try:
-            ed_ctypes = cdll.LoadLibrary(ed_lib_file)
-        except Exception:
-            EDIT_DISTANCE_CTYPES_LOADED = False
-        else:
-            EDIT_DISTANCE_CTYPES_LOADED = True
 else:
     EDIT_DISTANCE_MODULE_EXISTS = True
 
+ed_lib_file  = os.path.join(sys.path[0], "editdistance/libed.so")
+if os.path.exists(ed_lib_file):
+    try:
+        ed_ctypes = cdll.LoadLibrary(ed_lib_file)
+    except Exception:
+        EDIT_DISTANCE_CTYPES_LOADED = False
+    else:
+        EDIT_DISTANCE_CTYPES_LOADED = True
+        # a libed.so built before find_overlap was added doesn't have it
+        OVERLAP_CTYPES_LOADED = hasattr(ed_ctypes, "find_overlap")
+        OVERLAP_SEEDED_CTYPES_LOADED = hasattr(ed_ctypes, "find_overlap_seeded")
+        ADAPTER_CTYPES_LOADED = hasattr(ed_ctypes, "adapter_scan")
+
 if EDIT_DISTANCE_MODULE_EXISTS==False and EDIT_DISTANCE_CTYPES_LOADED == False:
     print("Warning: editdistance module doesn't exist, it will make AfterQC extremely slow")
     print("If you are using python, run: pip install editdistance")
     print("If you are using pypy, run: make, in AfterQC folder to build editdistance with ctypes")
 
 
-COMP = {"A" : "T", "T" : "A", "C" : "G", "G" : "C", "a" : "t", "t" : "a", "c" : "g", "g" : "c", "N":"N", "\n":"\n"}
+COMP = seqkernel.COMP
     
 def parseBool(str):
     str = str.lower()
@@ -39,32 +50,19 @@ def parseBool(str):
         return False
 
 def complement(base):
-    return COMP[base]
+    return seqkernel.complement(base)
 
 def qualNum(q):
     return ord(q) - 33
 
 def reverseComplement(origin):
-    length = len(origin)
-    revCompArr = ['' for x in xrange(length)]
-    for i in xrange(length):
-        orig = origin[length - i -1]
-        if orig in COMP:
-            revCompArr[i] = COMP[orig]
-        else:
-            revCompArr[i] = 'N'
-    return ''.join(revCompArr)
+    return seqkernel.reverseComplement(origin)
 
 def reverse(origin):
     return origin[::-1]
 
 def hammingDistance(s1, s2):
-    length = min(len(s1), len(s2))
-    d = 0
-    for i in xrange(length):
-        if s1[i] != s2[i]:
-            d += 1
-    return d
+    return seqkernel.hammingDistance(s1, s2)
 
 #simple edit distance
 def editDistance(s1, s2):
@@ -90,17 +88,26 @@ def editDistance(s1, s2):
 def distance_threshold(overlap_len):
     return min(3, overlap_len/10.0)
 
+# the overlap of r1 and the reverse complement of r2, returns (offset, overlap_len, distance)
+# the native find_overlap of libed.so is used if it is loaded, it returns the same result as overlapScan
 def overlap(r1, r2):
+    if OVERLAP_CTYPES_LOADED:
+        return overlapNative(r1, r2)
+    return overlapScan(r1, r2)
+
+def overlapNative(r1, r2):
+    result = (c_int * 3)()
+    ed_ctypes.find_overlap(r1, len(r1), r2, len(r2), result)
+    return (result[0], result[1], result[2])
+
+def overlapScan(r1, r2):
     len1 = len(r1)
     len2 = len(r2)
-    reverse_r2 = reverseComplement(r2)
+    reverse_r2 = seqkernel.reverseComplement(r2)
 
-    overlapped = False
-    overlap_len = 0
     offset = 0
-    distance = 0
     # a match of less than 10 is considered as unconfident
-    while offset < len1-10 and overlapped==False:
+    while offset < len1-10:
         # the overlap length of r1 & r2 when r2 is move right for offset
         overlap_len = min(len1-offset, len2)
 
@@ -108,49 +115,143 @@ def overlap(r1, r2):
         distance = editDistance(r1[offset : offset+overlap_len], reverse_r2[0 : overlap_len])
         threshold = distance_threshold(overlap_len)
         if distance <= threshold:
-            # now we find a good candidate
-            # we verify it by moving r2 one more base to see if the distance is getting longer
-            # if yes, then current is the best match, otherwise it's not
-            while offset < len1-10:
-                next_offset = offset + 1
-                next_overlap_len = min(len1-next_offset, len2)
-                next_distance = editDistance(r1[next_offset : next_offset+next_overlap_len], reverse_r2[0 : next_overlap_len])
-                if distance <= next_distance:
-                    overlapped = True
-                    break
-                else:
-                    offset = next_offset
-                    distance = next_distance
-                    overlap_len = next_overlap_len
-            break
+            return foundOverlap(r1, reverse_r2, offset, overlap_len, distance)
         else:
             offset += max(1, (distance - int(threshold))/2 )
 
+    return (0,0,0)
+
+# a good candidate is found at offset, returns the overlap like overlapScan
+def foundOverlap(r1, reverse_r2, offset, overlap_len, distance):
+    len1 = len(r1)
+    len2 = len(reverse_r2)
+    overlapped = False
+    # we verify it by moving r2 one more base to see if the distance is getting longer
+    # if yes, then current is the best match, otherwise it's not
+    while offset < len1-10:
+        next_offset = offset + 1
+        next_overlap_len = min(len1-next_offset, len2)
+        next_distance = editDistance(r1[next_offset : next_offset+next_overlap_len], reverse_r2[0 : next_overlap_len])
+        if distance <= next_distance:
+            overlapped = True
+            break
+        else:
+            offset = next_offset
+            distance = next_distance
+            overlap_len = next_overlap_len
+
     if overlapped and offset == 0:
-        # check if distance can get smaller if offset goes negative
-        # this only happens when insert DNA is shorter than sequencing read length, and some adapter/primer is sequenced but not trimmed cleanly
-        # we go reversely
-        while offset > -(len2-10):
-            # the overlap length of r1 & r2 when r2 is move right for offset
-            overlap_len = min(len1,  len2- abs(offset))
-            distance = editDistance(r1[0:overlap_len], reverse_r2[-offset : -offset + overlap_len])
-            threshold = distance_threshold(overlap_len)
-            if distance <= threshold:
-                while offset > -(len2-10):
-                    next_offset = offset - 1
-                    next_overlap_len = min(len1,  len2- abs(next_offset))
-                    next_distance = editDistance(r1[0:next_overlap_len], reverse_r2[-next_offset : -next_offset + next_overlap_len])
-                    if distance <= next_distance:
-                        return (offset, overlap_len, distance)
-                    else:
-                        distance = next_distance
-                        overlap_len = next_overlap_len
-                        offset = next_offset
-            else:
-                offset -= max(1, (distance - int(threshold))/2 )
+        return negativeOverlap(r1, reverse_r2)
     elif overlapped:
         return (offset, overlap_len, distance)
+    return (0,0,0)
 
+# check if distance can get smaller if offset goes negative
+# this only happens when insert DNA is shorter than sequencing read length, and some adapter/primer is sequenced but not trimmed cleanly
+def negativeOverlap(r1, reverse_r2):
+    len1 = len(r1)
+    len2 = len(reverse_r2)
+    offset = 0
+    # we go reversely
+    while offset > -(len2-10):
+        # the overlap length of r1 & r2 when r2 is move right for offset
+        overlap_len = min(len1,  len2- abs(offset))
+        distance = editDistance(r1[0:overlap_len], reverse_r2[-offset : -offset + overlap_len])
+        threshold = distance_threshold(overlap_len)
+        if distance <= threshold:
+            while offset > -(len2-10):
+                next_offset = offset - 1
+                next_overlap_len = min(len1,  len2- abs(next_offset))
+                next_distance = editDistance(r1[0:next_overlap_len], reverse_r2[-next_offset : -next_offset + next_overlap_len])
+                if distance <= next_distance:
+                    return (offset, overlap_len, distance)
+                else:
+                    distance = next_distance
+                    overlap_len = next_overlap_len
+                    offset = next_offset
+        else:
+            offset -= max(1, (distance - int(threshold))/2 )
+
+    return (0,0,0)
+
+# the k-mer seeded overlap
+# overlapScan spends most of its time at offsets which cannot match, the seeded overlap only checks the offsets near
+# the k-mers of SEED_K bases shared by r1 and the reverse complement of r2, and the offsets of short overlaps
+# if an overlap with a distance within the threshold is long enough, it has a shared k-mer within SEED_SHIFT offsets,
+# the candidates are checked from the smallest offset, and the first one within the threshold is refined like overlapScan
+# if a read has a base other than ACGT (usually a low quality read with N), or the k-mers are shared at more than
+# MAX_SEED_DIAGONALS offsets (repeats), the seeds are ambiguous and the exhaustive overlapScan is used
+# the result is same as overlapScan, unless overlapScan skips the first offset within the threshold
+OVERLAP_ENGINES = ("exhaustive", "seeded")
+SEED_K = 8
+MAX_SEED_DIAGONALS = 8
+SEED_SHIFT = 3
+
+def overlapEngine(name):
+    if name == "seeded":
+        return overlapSeeded
+    return overlap
+
+def overlapSeeded(r1, r2):
+    if OVERLAP_SEEDED_CTYPES_LOADED:
+        return overlapSeededNative(r1, r2)
+    return overlapSeededPython(r1, r2)
+
+def overlapSeededNative(r1, r2):
+    result = (c_int * 3)()
+    ed_ctypes.find_overlap_seeded(r1, len(r1), r2, len(r2), SEED_K, MAX_SEED_DIAGONALS, SEED_SHIFT, result)
+    return (result[0], result[1], result[2])
+
+def isACGT(seq):
+    return len(seq.translate(None, "ACGT")) == 0
+
+# if an overlap of overlap_len has a distance within the threshold, r1 and reverse_r2 share SEED_K bases in it
+# at most t edits leave at least overlap_len - t matched bases in at most t + 1 runs
+def seedGuaranteed(overlap_len):
+    t = int(distance_threshold(overlap_len))
+    return overlap_len / (t + 1) >= SEED_K
+
+# the sorted offsets to check, or None if the seeds are ambiguous
+def seedCandidates(r1, reverse_r2):
+    if not isACGT(r1) or not isACGT(reverse_r2):
+        return None
+    len1 = len(r1)
+    len2 = len(reverse_r2)
+    kmers = {}
+    for j in xrange(len2 - SEED_K + 1):
+        kmers.setdefault(reverse_r2[j : j+SEED_K], []).append(j)
+    last = len1 - 11
+    diagonals = set()
+    for i in xrange(len1 - SEED_K + 1):
+        for j in kmers.get(r1[i : i+SEED_K], ()):
+            if -SEED_SHIFT <= i - j <= last + SEED_SHIFT:
+                diagonals.add(i - j)
+    if len(diagonals) > MAX_SEED_DIAGONALS:
+        return None
+    candidates = set()
+    for diagonal in diagonals:
+        candidates.update(xrange(max(0, diagonal - SEED_SHIFT), min(last, diagonal + SEED_SHIFT) + 1))
+    # an overlap of 4 * SEED_K bases or longer always has a seed
+    start = 0
+    if len2 >= 4 * SEED_K:
+        start = max(0, len1 - 4 * SEED_K)
+    for offset in xrange(start, last + 1):
+        if not seedGuaranteed(min(len1-offset, len2)):
+            candidates.add(offset)
+    return sorted(candidates)
+
+def overlapSeededPython(r1, r2):
+    len1 = len(r1)
+    len2 = len(r2)
+    reverse_r2 = seqkernel.reverseComplement(r2)
+    candidates = seedCandidates(r1, reverse_r2)
+    if candidates == None:
+        return overlapScan(r1, r2)
+    for offset in candidates:
+        overlap_len = min(len1-offset, len2)
+        distance = editDistance(r1[offset : offset+overlap_len], reverse_r2[0 : overlap_len])
+        if distance <= distance_threshold(overlap_len):
+            return foundOverlap(r1, reverse_r2, offset, overlap_len, distance)
     return (0,0,0)
 
 def changeString(str, pos, val):